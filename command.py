@@ -23,6 +23,15 @@ import sys
 from event_log import EventLog
 from error import NoSuchProjectError
 from error import InvalidProjectGroupsError
+from git_command import GitCommand
+from manifest_index import ManifestIndex
+from scheduler import Scheduler
+
+try:
+  import git_command_async
+except (ImportError, SyntaxError):
+  # Python 2 has neither asyncio nor async functions.
+  git_command_async = None
 
 
 class Command(object):
@@ -103,35 +112,47 @@ class Command(object):
     """
     raise NotImplementedError
 
-  def _ResetPathToProjectMap(self, projects):
-    self._by_path = dict((p.worktree, p) for p in projects)
-
-  def _UpdatePathToProjectMap(self, project):
-    self._by_path[project.worktree] = project
-
-  def _GetProjectByPath(self, manifest, path):
-    project = None
-    if os.path.exists(path):
-      oldpath = None
-      while path and \
-            path != oldpath and \
-            path != manifest.topdir:
-        try:
-          project = self._by_path[path]
-          break
-        except KeyError:
-          oldpath = path
-          path = os.path.dirname(path)
-      if not project and path == manifest.topdir:
-        try:
-          project = self._by_path[path]
-        except KeyError:
-          pass
-    else:
-      try:
-        project = self._by_path[path]
-      except KeyError:
-        pass
+  def GatherGit(self, queries, jobs, bare=False):
+    """Run short git commands for many projects concurrently.
+
+    With asyncio the commands all run from this thread, otherwise (or if
+    asyncio cannot start subprocesses here) |jobs| threads run them.
+
+    Args:
+      queries: (project, cmdv) tuples.
+      jobs: How many commands may run at the same time.
+      bare: Run in the git directories rather than in the work trees.
+
+    Returns:
+      An (exit status, stdout, stderr) tuple for each query, in order.
+    """
+    if git_command_async and git_command_async.Usable():
+      cmds = [git_command_async.AsyncGitCommand(project, cmdv, bare=bare)
+              for project, cmdv in queries]
+      git_command_async.RunAll(cmds, jobs)
+      return [(c.rc, c.stdout, c.stderr) for c in cmds]
+
+    results = [None] * len(queries)
+    def _Run(i):
+      project, cmdv = queries[i]
+      p = GitCommand(project, cmdv, bare=bare,
+                     capture_stdout=True, capture_stderr=True)
+      results[i] = (p.Wait(), p.stdout, p.stderr)
+
+    scheduler = Scheduler(max(1, min(jobs, len(queries))))
+    for i in range(len(queries)):
+      scheduler.Add(i)
+    scheduler.Run(_Run)
+    return results
+
+  def _GetProjectByPath(self, index, path):
+    """The project of |index| at |path|.
+
+    Paths that exist may also be anywhere inside the project's work tree.
+    """
+    project = index.ByPath(path)
+    if project is None and os.path.exists(path):
+      project = index.ByPath(path, inside=True)
     return project
 
   def GetProjects(self, args, manifest=None, groups='', missing_ok=False,
@@ -140,7 +161,7 @@ class Command(object):
     """
     if not manifest:
       manifest = self.manifest
-    all_projects_list = manifest.projects
+    index = manifest.index
     result = []
 
     mp = manifest.manifestProject
@@ -150,37 +171,42 @@ class Command(object):
     if not groups:
       groups = 'default,platform-' + platform.system().lower()
     groups = [x for x in re.split(r'[,\s]+', groups) if x]
+    in_groups = index.MatchGroups(groups)
+
+    def _MatchesGroups(project):
+      # Submodules are not part of the manifest, and so not in the index.
+      if project.Derived:
+        return project.MatchesGroups(groups)
+      return index.Contains(in_groups, project)
 
     if not args:
       derived_projects = {}
-      for project in all_projects_list:
+      for project in index.projects:
         if submodules_ok or project.sync_s:
           derived_projects.update((p.name, p)
                                   for p in project.GetDerivedSubprojects())
-      all_projects_list.extend(derived_projects.values())
+      all_projects_list = index.Select(in_groups)
+      all_projects_list.extend(p for p in derived_projects.values()
+                               if p.MatchesGroups(groups))
       for project in all_projects_list:
-        if (missing_ok or project.Exists) and project.MatchesGroups(groups):
+        if missing_ok or project.Exists:
           result.append(project)
     else:
-      self._ResetPathToProjectMap(all_projects_list)
-
       for arg in args:
         projects = manifest.GetProjectsWithName(arg)
 
         if not projects:
           path = os.path.abspath(arg).replace('\\', '/')
-          project = self._GetProjectByPath(manifest, path)
+          project = self._GetProjectByPath(index, path)
 
-          # If it's not a derived project, update path->project mapping and
-          # search again, as arg might actually point to a derived subproject.
+          # If it's not a derived project, search its submodules too, as arg
+          # might actually point to a derived subproject.
           if (project and not project.Derived and (submodules_ok or
                                                    project.sync_s)):
-            search_again = False
-            for subproject in project.GetDerivedSubprojects():
-              self._UpdatePathToProjectMap(subproject)
-              search_again = True
-            if search_again:
-              project = self._GetProjectByPath(manifest, path) or project
+            subprojects = project.GetDerivedSubprojects()
+            if subprojects:
+              project = self._GetProjectByPath(ManifestIndex(subprojects),
+                                               path) or project
 
           if project:
             projects = [project]
@@ -191,7 +217,7 @@ class Command(object):
         for project in projects:
           if not missing_ok and not project.Exists:
             raise NoSuchProjectError(arg)
-          if not project.MatchesGroups(groups):
+          if not _MatchesGroups(project):
             raise InvalidProjectGroupsError(arg)
 
         result.extend(projects)
@@ -203,18 +229,17 @@ class Command(object):
 
   def FindProjects(self, args, inverse=False):
     result = []
+    index = self.manifest.index
+    found = index.Search(args)
     patterns = [re.compile(r'%s' % a, re.IGNORECASE) for a in args]
     for project in self.GetProjects(''):
-      for pattern in patterns:
-        match = pattern.search(project.name) or pattern.search(project.relpath)
-        if not inverse and match:
-          result.append(project)
-          break
-        if inverse and match:
-          break
+      if project.Derived:
+        match = any(pattern.search(project.name) or
+                    pattern.search(project.relpath) for pattern in patterns)
       else:
-        if inverse:
-          result.append(project)
+        match = index.Contains(found, project)
+      if match != inverse:
+        result.append(project)
     result.sort(key=lambda project: project.relpath)
     return result
 
@@ -0,0 +1,203 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Decide which repositories need `git gc` and run it, maybe in background.
+
+The planner applies the same thresholds as `git gc --auto` (gc.auto and
+gc.autoPackLimit) from directory listings, so repositories that do not need
+any work cost no git process at all.
+
+This file can also be run as a script; that is how the detached background
+process started by RunInBackground() does its work.
+"""
+
+from __future__ import print_function
+
+import errno
+import os
+import subprocess
+import sys
+import time
+
+from git_objects import LooseObjectEstimate, ObjectStats
+
+# Defaults of git itself, see git-gc(1).
+DEFAULT_GC_AUTO = 6700
+DEFAULT_PACK_LIMIT = 50
+
+# A lock older than this is considered abandoned even if its process lives.
+_LOCK_EXPIRE_S = 12 * 60 * 60
+
+
+class GcTask(object):
+  """A repository that needs gc, and the pack.threads to run it with."""
+
+  def __init__(self, gitdir, size, reason):
+    self.gitdir = gitdir
+    self.size = size
+    self.reason = reason
+    self.threads = 1
+
+
+def NeedsGc(gitdir, gc_auto=None, pack_limit=None):
+  """Why `git gc --auto` would do work in |gitdir|, or None if it would not.
+
+  Args:
+    gitdir: The git directory holding the objects.
+    gc_auto: The gc.auto setting; 0 disables automatic gc.
+    pack_limit: The gc.autoPackLimit setting; 0 disables the pack check.
+  """
+  if gc_auto is None:
+    gc_auto = DEFAULT_GC_AUTO
+  if pack_limit is None:
+    pack_limit = DEFAULT_PACK_LIMIT
+  if gc_auto <= 0:
+    return None
+
+  # Like git, compare in whole objects/17 entries.
+  loose = LooseObjectEstimate(gitdir)
+  if loose > 256 * ((gc_auto + 255) // 256):
+    return 'about %d loose objects' % loose
+
+  if pack_limit > 0:
+    stats = ObjectStats(gitdir, loose=False)
+    packs = stats.packs - stats.kept_packs
+    if packs > pack_limit:
+      return '%d packs' % packs
+  return None
+
+
+def Plan(repos, cpu_count):
+  """Select the repositories that need gc and share the CPUs among them.
+
+  Args:
+    repos: (gitdir, gc_auto, pack_limit) tuples; see NeedsGc().
+    cpu_count: Number of CPUs available for repacking.
+
+  Returns:
+    A list of GcTask, largest repository first.  Each task gets a share of
+    |cpu_count| as pack.threads that is proportional to its size.
+  """
+  tasks = []
+  for gitdir, gc_auto, pack_limit in repos:
+    reason = NeedsGc(gitdir, gc_auto, pack_limit)
+    if reason:
+      tasks.append(GcTask(gitdir, ObjectStats(gitdir).size, reason))
+
+  total = sum(t.size for t in tasks)
+  for t in tasks:
+    if total:
+      share = int(round(float(cpu_count) * t.size / total))
+    else:
+      share = 1
+    t.threads = max(1, min(cpu_count, share))
+  tasks.sort(key=lambda t: (-t.size, t.gitdir))
+  return tasks
+
+
+def IsLocked(lock_path):
+  """Whether a live background gc holds |lock_path|."""
+  return os.path.exists(lock_path) and not _IsStale(lock_path)
+
+
+def RunInBackground(tasks, lock_path, log_path):
+  """Run |tasks| one after another in a detached process.
+
+  The process holds |lock_path| while it works, and exits right away if
+  another background gc already holds it.  Its output goes to |log_path|.
+
+  Returns:
+    False if detaching is not supported here; the caller should run the
+    tasks itself.
+  """
+  if not hasattr(os, 'setsid'):
+    return False
+
+  cmd = [sys.executable, os.path.abspath(__file__), lock_path]
+  for t in tasks:
+    cmd.extend([str(t.threads), t.gitdir])
+
+  devnull = open(os.devnull, 'r')
+  log = open(log_path, 'a')
+  try:
+    subprocess.Popen(cmd, stdin=devnull, stdout=log, stderr=log,
+                     close_fds=True, preexec_fn=os.setsid,
+                     cwd=os.path.dirname(lock_path))
+  finally:
+    devnull.close()
+    log.close()
+  return True
+
+
+def _AcquireLock(lock_path):
+  for _ in range(2):
+    try:
+      fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError as e:
+      if e.errno != errno.EEXIST or not _IsStale(lock_path):
+        return False
+      try:
+        os.remove(lock_path)
+      except OSError:
+        return False
+      continue
+    os.write(fd, str(os.getpid()).encode('utf-8'))
+    os.close(fd)
+    return True
+  return False
+
+
+def _IsStale(lock_path):
+  try:
+    if time.time() - os.path.getmtime(lock_path) > _LOCK_EXPIRE_S:
+      return True
+    with open(lock_path) as fd:
+      pid = int(fd.read().strip())
+  except (IOError, OSError, ValueError):
+    return True
+  try:
+    os.kill(pid, 0)
+  except OSError as e:
+    return e.errno == errno.ESRCH
+  return False
+
+
+def _Main(argv):
+  lock_path = argv[0]
+  work = argv[1:]
+  if not _AcquireLock(lock_path):
+    return 0
+  try:
+    try:
+      os.nice(10)
+    except (AttributeError, OSError):
+      pass
+    for i in range(0, len(work) - 1, 2):
+      threads, gitdir = work[i], work[i + 1]
+      print('%s: gc %s (pack.threads=%s)'
+            % (time.strftime('%Y-%m-%d %H:%M:%S'), gitdir, threads))
+      sys.stdout.flush()
+      subprocess.call(['git', '--git-dir=%s' % gitdir,
+                       '-c', 'pack.threads=%s' % threads,
+                       '-c', 'gc.autoDetach=false',
+                       'gc', '--auto', '--quiet'])
+  finally:
+    os.remove(lock_path)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(_Main(sys.argv[1:]))
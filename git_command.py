@@ -15,15 +15,25 @@
 # limitations under the License.
 
 from __future__ import print_function
+import atexit
+import binascii
+import codecs
+import collections
 import os
 import sys
 import subprocess
 import tempfile
+import time
 from signal import SIGTERM
+try:
+  import threading as _threading
+except ImportError:
+  import dummy_threading as _threading
 
 from error import GitError
 import platform_utils
-from trace import REPO_TRACE, IsTrace, Trace
+from pyversion import is_python3
+from trace import REPO_TRACE, IsTrace, Trace, RecordCommand
 from wrapper import Wrapper
 
 GIT = 'git'
@@ -37,6 +47,12 @@ _ssh_proxy_path = None
 _ssh_sock_path = None
 _ssh_clients = []
 
+# Git directories with running cat-file processes, least recently used
+# first.  Each one holds up to two processes with two pipes each.
+_MAX_CAT_FILES = 16
+_cat_files = collections.OrderedDict()
+_cat_files_lock = _threading.Lock()
+
 def ssh_sock(create=True):
   global _ssh_sock_path
   if _ssh_sock_path is None:
@@ -111,6 +127,223 @@ def git_require(min_version, fail=False):
 def _setenv(env, name, value):
   env[name] = value.encode()
 
+
+def cat_file(gitdir):
+  """Return the shared CatFileBatch of |gitdir|, starting it if needed.
+
+  At most _MAX_CAT_FILES git directories keep their processes running; the
+  least recently used one is stopped to make room for a new one.
+  """
+  gitdir = os.path.abspath(gitdir)
+  with _cat_files_lock:
+    c = _cat_files.pop(gitdir, None)
+    if c is None or c.pid != os.getpid():
+      # Never share the pipes of our parent after a fork.
+      if not _cat_files:
+        atexit.register(close_cat_files)
+      while len(_cat_files) >= _MAX_CAT_FILES:
+        _, old = _cat_files.popitem(last=False)
+        old.Close(retire=True)
+      c = CatFileBatch(gitdir)
+    _cat_files[gitdir] = c
+    return c
+
+
+def close_cat_files(gitdir=None):
+  """Stop the cat-file processes of |gitdir|, or all of them."""
+  with _cat_files_lock:
+    if gitdir is None:
+      gitdirs = list(_cat_files)
+    else:
+      gitdirs = [os.path.abspath(gitdir)]
+    for d in gitdirs:
+      c = _cat_files.pop(d, None)
+      if c is not None:
+        c.Close(retire=True)
+
+
+class CatFileBatch(object):
+  """Answers object queries for one git directory without forking.
+
+  A `git cat-file --batch-check` and a `git cat-file --batch` process are
+  started on first use and kept running, so every query costs a round trip
+  over a pipe instead of a new git process.  Queries from several threads
+  are serialized.
+  """
+
+  # Names written before reading any answer in InfoMany().  The answers of
+  # one chunk must fit in the pipe buffer, or git and we would deadlock.
+  _CHUNK = 64
+
+  def __init__(self, gitdir):
+    self.gitdir = gitdir
+    self.pid = os.getpid()
+    self._lock = _threading.Lock()
+    self._procs = {}
+    self._started = {}
+    self._retired = False
+
+  def Info(self, name):
+    """Look up |name| (any revision expression git understands).
+
+    Returns:
+      An (object id, type, size) tuple, or None if there is no such object.
+    """
+    return self.InfoMany([name])[0]
+
+  def InfoMany(self, names):
+    """Like Info() for many names, sending the queries in batches."""
+    names = list(names)
+    result = []
+    with self._lock:
+      for i in range(0, len(names), self._CHUNK):
+        chunk = names[i:i + self._CHUNK]
+        result.extend(self._Request('--batch-check', chunk, self._ReadInfo))
+    return result
+
+  def Contents(self, name):
+    """Read the object |name|.
+
+    Returns:
+      An (object id, type, data) tuple with data as bytes, or None if there
+      is no such object.
+    """
+    with self._lock:
+      return self._Request('--batch', [name], self._ReadContents)[0]
+
+  def TreeEntries(self, name):
+    """List the tree |name|.
+
+    Returns:
+      A dict mapping each entry name to its (mode, object id), or None if
+      |name| is not a tree.
+    """
+    obj = self.Contents(name)
+    if obj is None or obj[1] != 'tree':
+      return None
+    oid, _, data = obj
+    # Entries are "<octal mode> <name>\0<binary object id>".
+    oid_len = len(oid) // 2
+    entries = {}
+    pos = 0
+    while pos < len(data):
+      sp = data.index(b' ', pos)
+      nul = data.index(b'\0', sp)
+      end = nul + 1 + oid_len
+      entries[data[sp + 1:nul].decode('utf-8')] = (
+          data[pos:sp].decode('utf-8'),
+          binascii.hexlify(data[nul + 1:end]).decode('utf-8'))
+      pos = end
+    return entries
+
+  def Close(self, retire=False):
+    """Stop the git processes; they are restarted on the next query.
+
+    With |retire|, later queries stop the processes again when they are
+    done, for objects that cat_file() no longer keeps track of.
+    """
+    with self._lock:
+      self._retired = self._retired or retire
+      for mode in list(self._procs):
+        self._Stop(mode)
+
+  def _Request(self, mode, names, reader):
+    for name in names:
+      if '\n' in name:
+        raise GitError('cat-file: invalid object name %r' % name)
+    request = ''.join('%s\n' % n for n in names).encode('utf-8')
+    for attempt in (1, 2):
+      p = self._procs.get(mode)
+      if p is None:
+        p = self._procs[mode] = self._Start(mode)
+        self._started[mode] = time.time()
+      try:
+        p.stdin.write(request)
+        p.stdin.flush()
+        result = [reader(p.stdout) for _ in names]
+        if self._retired:
+          self._Stop(mode)
+        return result
+      except (IOError, OSError, EOFError) as e:
+        # git went away (killed, or a ^C reached it); start over once.
+        self._Stop(mode)
+        if attempt == 2:
+          raise GitError('cat-file %s in %s: %s' % (mode, self.gitdir, e))
+      except BaseException:
+        # Interrupted half way, the rest of the answers would be read by the
+        # next query.
+        self._Stop(mode)
+        raise
+
+  def _Stop(self, mode):
+    p = self._procs.pop(mode)
+    # Closing stdout too makes git exit even if it is blocked writing answers.
+    for f in (p.stdin, p.stdout):
+      try:
+        f.close()
+      except (IOError, OSError):
+        pass
+    try:
+      p.wait()
+    except OSError:
+      pass
+    RecordCommand('cat-file', self.gitdir, self._started.pop(mode),
+                  p.returncode)
+
+  def _Start(self, mode):
+    env = os.environ.copy()
+    for key in [REPO_TRACE,
+                'GIT_ALTERNATE_OBJECT_DIRECTORIES',
+                'GIT_OBJECT_DIRECTORY',
+                'GIT_WORK_TREE',
+                'GIT_GRAFT_FILE',
+                'GIT_INDEX_FILE']:
+      if key in env:
+        del env[key]
+    env[GIT_DIR] = self.gitdir
+    command = [GIT, 'cat-file', mode]
+    if IsTrace():
+      Trace(': export GIT_DIR=%s\n: %s 0<| 1>| &', self.gitdir,
+            ' '.join(command))
+    devnull = open(os.devnull, 'w')
+    try:
+      return subprocess.Popen(command,
+                              env = env,
+                              stdin = subprocess.PIPE,
+                              stdout = subprocess.PIPE,
+                              stderr = devnull)
+    except Exception as e:
+      raise GitError('cat-file: %s' % e)
+    finally:
+      devnull.close()
+
+  @staticmethod
+  def _ReadHeader(stdout):
+    line = stdout.readline()
+    if not line.endswith(b'\n'):
+      raise EOFError('unexpected end of output')
+    fields = line.decode('utf-8').rstrip('\n').split(' ')
+    if len(fields) != 3 or not fields[2].isdigit():
+      # "<name> missing" or "<name> ambiguous"
+      return None
+    return fields[0], fields[1], int(fields[2])
+
+  @classmethod
+  def _ReadInfo(cls, stdout):
+    return cls._ReadHeader(stdout)
+
+  @classmethod
+  def _ReadContents(cls, stdout):
+    info = cls._ReadHeader(stdout)
+    if info is None:
+      return None
+    oid, kind, size = info
+    data = stdout.read(size + 1)
+    if len(data) != size + 1:
+      raise EOFError('unexpected end of output')
+    return oid, kind, data[:size]
+
+
 class GitCommand(object):
   def __init__(self,
                project,
@@ -209,6 +442,18 @@ class GitCommand(object):
         dbg += ' 2>|'
       Trace('%s', dbg)
 
+    self._start = time.time()
+    self._verb = cmdv[0]
+    if project:
+      self._project_name = project.relpath
+    elif gitdir:
+      self._project_name = gitdir
+    else:
+      self._project_name = None
+    self._out_bytes = 0
+    self._Start(command, cwd, env, stdin, stdout, stderr, ssh_proxy)
+
+  def _Start(self, command, cwd, env, stdin, stdout, stderr, ssh_proxy):
     try:
       p = subprocess.Popen(command,
                            cwd = cwd,
@@ -231,15 +476,68 @@ class GitCommand(object):
       rc = self._CaptureOutput()
     finally:
       _remove_ssh_client(p)
+    RecordCommand(self._verb, self._project_name, self._start, rc,
+                  self._out_bytes)
     return rc
 
+  def Records(self, sep='\n'):
+    """Yield the standard output of the command split at |sep| as it runs.
+
+    Use this instead of Wait() for commands with large outputs, e.g. with
+    sep='\\0' for the output of -z options.  A final |sep| does not start an
+    empty record.  Standard error is collected in self.stderr, and the exit
+    status is in self.rc once all records have been read.
+    """
+    p = self.process
+    sep = sep.encode('utf-8')
+    stderr = []
+    pending = []
+    finished = False
+    try:
+      for std_name, buf in self._ReadOutput():
+        if std_name == 'stderr':
+          stderr.append(buf)
+          continue
+        parts = buf.split(sep)
+        if len(parts) == 1:
+          pending.append(buf)
+          continue
+        pending.append(parts[0])
+        yield _decode(b''.join(pending))
+        for record in parts[1:-1]:
+          yield _decode(record)
+        pending = [parts[-1]] if parts[-1] else []
+      if pending:
+        yield _decode(b''.join(pending))
+      finished = True
+    finally:
+      self.stderr = _decode(b''.join(stderr))
+      if not finished:
+        # The caller stopped early; let git die writing to the closed pipe.
+        p.stdout.close()
+        p.stderr.close()
+      self.rc = p.wait()
+      _remove_ssh_client(p)
+      RecordCommand(self._verb, self._project_name, self._start, self.rc,
+                    self._out_bytes)
+
   def _CaptureOutput(self):
+    out = {'stdout': [], 'stderr': []}
+    for std_name, buf in self._ReadOutput():
+      out[std_name].append(buf)
+    # Join once at the end; appending to a string is quadratic.
+    self.stdout = _decode(b''.join(out['stdout']))
+    self.stderr = _decode(b''.join(out['stderr']))
+    return self.process.wait()
+
+  def _ReadOutput(self):
+    """Yield (std_name, bytes) chunks of output, echoing the ones not captured.
+    """
     p = self.process
     s_in = platform_utils.FileDescriptorStreams.create()
     s_in.add(p.stdout, sys.stdout, 'stdout')
     s_in.add(p.stderr, sys.stderr, 'stderr')
-    self.stdout = ''
-    self.stderr = ''
+    decoders = {}
 
     while not s_in.is_done:
       in_ready = s_in.select()
@@ -248,13 +546,24 @@ class GitCommand(object):
         if not buf:
           s_in.remove(s)
           continue
-        if not hasattr(buf, 'encode'):
-          buf = buf.decode()
-        if s.std_name == 'stdout':
-          self.stdout += buf
-        else:
-          self.stderr += buf
+        if not isinstance(buf, bytes):
+          buf = buf.encode('utf-8')
+        self._out_bytes += len(buf)
         if self.tee[s.std_name]:
-          s.dest.write(buf)
+          if is_python3():
+            # A chunk may end inside a multibyte character.
+            if s.std_name not in decoders:
+              decoders[s.std_name] = codecs.getincrementaldecoder('utf-8')(
+                  'replace')
+            s.dest.write(decoders[s.std_name].decode(buf))
+          else:
+            s.dest.write(buf)
           s.dest.flush()
-    return p.wait()
+        yield s.std_name, buf
+
+
+def _decode(buf):
+  """Output of git as a native string, like sys.stdout takes."""
+  if is_python3():
+    return buf.decode('utf-8', 'replace')
+  return buf
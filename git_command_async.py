@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run many short git commands concurrently from a single thread.
+
+This needs asyncio and the async syntax of Python 3.5; command.py falls back
+to threads when this module cannot be imported.
+"""
+
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+
+from error import GitError
+from git_command import GitCommand, _decode
+from trace import RecordCommand
+
+
+class AsyncGitCommand(GitCommand):
+  """A GitCommand that is started by awaiting Run() in an event loop.
+
+  Standard output and error are always captured; there is no standard input.
+  """
+
+  def __init__(self, project, cmdv, bare=False, cwd=None, gitdir=None):
+    self.stdout = None
+    self.stderr = None
+    self.rc = None
+    GitCommand.__init__(self, project, cmdv, bare=bare, capture_stdout=True,
+                        capture_stderr=True, cwd=cwd, gitdir=gitdir)
+
+  def _Start(self, command, cwd, env, stdin, stdout, stderr, ssh_proxy):
+    # Remember how to start git; Run() does it.
+    self._command = command
+    self._cwd = cwd
+    self._env = env
+
+  async def Run(self):
+    """Run git to completion and return its exit status."""
+    self._start = time.time()
+    try:
+      p = await asyncio.create_subprocess_exec(*self._command,
+                                               cwd=self._cwd,
+                                               env=self._env,
+                                               stdin=subprocess.DEVNULL,
+                                               stdout=subprocess.PIPE,
+                                               stderr=subprocess.PIPE)
+    except Exception as e:
+      raise GitError('%s: %s' % (self._command[1], e))
+    out, err = await p.communicate()
+    self.stdout = _decode(out)
+    self.stderr = _decode(err)
+    self.rc = p.returncode
+    RecordCommand(self._verb, self._project_name, self._start, self.rc,
+                  len(out) + len(err))
+    return self.rc
+
+  def Wait(self):
+    """Run git to completion from outside of an event loop; see Usable()."""
+    RunAll([self], 1)
+    return self.rc
+
+
+async def _Gather(cmds, jobs):
+  sem = asyncio.Semaphore(jobs)
+
+  async def _Run(cmd):
+    async with sem:
+      await cmd.Run()
+
+  await asyncio.gather(*[_Run(cmd) for cmd in cmds])
+
+
+def Usable():
+  """Whether RunAll() can start subprocesses from the calling thread.
+
+  Before Python 3.8, the loop has to be attached to the child watcher, which
+  only works from the main thread, and the default loop on Windows cannot
+  start subprocesses at all.
+  """
+  if sys.version_info >= (3, 8):
+    return True
+  return (sys.platform != 'win32' and
+          threading.current_thread() is threading.main_thread())
+
+
+def RunAll(cmds, jobs):
+  """Run the AsyncGitCommands |cmds|, at most |jobs| at a time."""
+  loop = asyncio.new_event_loop()
+  watcher = None
+  try:
+    if sys.version_info < (3, 8):
+      # Exits of children are only reported to the attached loop.
+      watcher = asyncio.get_child_watcher()
+      watcher.attach_loop(loop)
+    loop.run_until_complete(_Gather(cmds, max(1, jobs)))
+  finally:
+    if watcher:
+      watcher.attach_loop(None)
+    loop.close()
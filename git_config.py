@@ -53,6 +53,8 @@ else:
 from git_command import GitCommand
 from git_command import ssh_sock
 from git_command import terminate_ssh_clients
+import git_config_file
+import repo_cache
 from git_refs import R_CHANGES, R_HEADS, R_TAGS
 
 ID_RE = re.compile(r'^[0-9a-f]{40}$')
@@ -89,17 +91,25 @@ class GitConfig(object):
     return cls._ForUser
 
   @classmethod
-  def ForRepository(cls, gitdir, defaults=None):
+  def ForRepository(cls, gitdir, defaults=None, cache=None):
     return cls(configfile = os.path.join(gitdir, 'config'),
-               defaults = defaults)
+               defaults = defaults,
+               cache = cache)
 
-  def __init__(self, configfile, defaults=None, jsonFile=None):
+  def __init__(self, configfile, defaults=None, jsonFile=None, cache=None):
+    """Access the git config file |configfile|.
+
+    The parsed file is kept in the RepoCache |cache| if one is given,
+    else in the JSON file |jsonFile| next to it.
+    """
     self.file = configfile
     self.defaults = defaults
     self._cache_dict = None
     self._section_dict = None
     self._remotes = {}
     self._branches = {}
+    self._pending = None
+    self._repo_cache = cache
 
     self._json = jsonFile
     if self._json is None:
@@ -132,6 +142,41 @@ class GitConfig(object):
       return False
     return None
 
+  def GetInt(self, name):
+    """Returns an integer from the configuration file.
+
+    This follows the git config syntax, so a k, m or g suffix multiplies the
+    value by 1024, 1024^2 or 1024^3.
+
+    Returns:
+      None if the value was not defined, or is not an integer.
+      Otherwise, the number itself.
+    """
+    v = self.GetString(name)
+    if v is None:
+      return None
+    v = v.strip()
+
+    mult = 1
+    if v.endswith(('k', 'K')):
+      v = v[:-1]
+      mult = 1024
+    elif v.endswith(('m', 'M')):
+      v = v[:-1]
+      mult = 1024 * 1024
+    elif v.endswith(('g', 'G')):
+      v = v[:-1]
+      mult = 1024 * 1024 * 1024
+
+    base = 10
+    if v.startswith('0x'):
+      base = 16
+
+    try:
+      return int(v, base=base) * mult
+    except ValueError:
+      return None
+
   def GetString(self, name, all_keys=False):
     """Get the first value for a key, or None if it is not defined.
 
@@ -173,7 +218,7 @@ class GitConfig(object):
     if value is None:
       if old:
         del self._cache[key]
-        self._do('--unset-all', name)
+        self._Change(name, None)
 
     elif isinstance(value, list):
       if len(value) == 0:
@@ -184,13 +229,29 @@ class GitConfig(object):
 
       elif old != value:
         self._cache[key] = list(value)
-        self._do('--replace-all', name, value[0])
-        for i in range(1, len(value)):
-          self._do('--add', name, value[i])
+        self._Change(name, list(value))
 
     elif len(old) != 1 or old[0] != value:
       self._cache[key] = [value]
-      self._do('--replace-all', name, value)
+      self._Change(name, [value])
+
+  @contextlib.contextmanager
+  def Transaction(self):
+    """Write the SetString() calls of a `with` block to the file at once.
+
+    The file is rewritten once when the outermost block exits, instead of
+    running one `git config` per key.
+    """
+    if self._pending is not None:
+      yield
+      return
+    self._pending = []
+    try:
+      yield
+    finally:
+      pending, self._pending = self._pending, None
+      if pending:
+        self._Write(pending)
 
   def GetRemote(self, name):
     """Get the remote.$name.* configuration values as an object.
@@ -260,12 +321,37 @@ class GitConfig(object):
     return self._cache_dict
 
   def _Read(self):
+    if self._repo_cache is not None:
+      return self._ReadCached()
     d = self._ReadJson()
     if d is None:
-      d = self._ReadGit()
+      d = self._ReadFile()
+      if d is None:
+        d = self._ReadGit()
       self._SaveJson(d)
     return d
 
+  def _ReadCached(self):
+    key = os.path.abspath(self.file)
+    stamp = repo_cache.FileStamp(self.file)
+    d = self._repo_cache.Get('config', key, stamp)
+    if d is None:
+      d = self._ReadFile()
+      if d is None:
+        d = self._ReadGit()
+      self._repo_cache.Put('config', key, stamp, d)
+      # Sidecars of older versions of repo are not used anymore.
+      if os.path.exists(self._json):
+        platform_utils.remove(self._json)
+    return d
+
+  def _ReadFile(self):
+    """Parse the file in-process, or return None to leave it to git."""
+    try:
+      return git_config_file.ReadConfig(self.file)
+    except (IOError, OSError, git_config_file.ConfigSyntaxError):
+      return None
+
   def _ReadJson(self):
     try:
       if os.path.getmtime(self._json) \
@@ -296,6 +382,28 @@ class GitConfig(object):
       if os.path.exists(self._json):
         platform_utils.remove(self._json)
 
+  def _Change(self, name, values):
+    self._section_dict = None
+    if self._pending is not None:
+      self._pending.append((name, values))
+    else:
+      self._Write([(name, values)])
+
+  def _Write(self, changes):
+    try:
+      git_config_file.EditConfig(self.file, changes)
+    except git_config_file.ConfigSyntaxError:
+      # Let git deal with what the native writer does not handle.
+      for name, values in changes:
+        if values is None:
+          self._do('--unset-all', name)
+        else:
+          self._do('--replace-all', name, values[0])
+          for v in values[1:]:
+            self._do('--add', name, v)
+    if self._cache_dict is not None and self._repo_cache is None:
+      self._SaveJson(self._cache_dict)
+
   def _ReadGit(self):
     """
     Read configuration data from git.
@@ -520,6 +628,24 @@ def GetSchemeFromUrl(url):
     return m.group(1)
   return None
 
+def GetHostFromUrl(url):
+  """Return the host name a remote URL connects to, or None for local URLs.
+  """
+  m = URI_ALL.match(url)
+  if m:
+    host = m.group(2)
+  else:
+    m = URI_SCP.match(url)
+    if not m or os.path.exists(url):
+      return None
+    host = m.group(1)
+  host = host.rsplit('@', 1)[-1]
+  if host.startswith('['):
+    host = host[1:].split(']', 1)[0]
+  elif ':' in host:
+    host = host.split(':', 1)[0]
+  return host or None
+
 @contextlib.contextmanager
 def GetUrlCookieFile(url, quiet):
   if url.startswith('persistent-'):
@@ -721,14 +847,15 @@ class Remote(object):
   def Save(self):
     """Save this remote to the configuration.
     """
-    self._Set('url', self.url)
-    if self.pushUrl is not None:
-      self._Set('pushurl', self.pushUrl + '/' + self.projectname)
-    else:
-      self._Set('pushurl', self.pushUrl)
-    self._Set('review', self.review)
-    self._Set('projectname', self.projectname)
-    self._Set('fetch', list(map(str, self.fetch)))
+    with self._config.Transaction():
+      self._Set('url', self.url)
+      if self.pushUrl is not None:
+        self._Set('pushurl', self.pushUrl + '/' + self.projectname)
+      else:
+        self._Set('pushurl', self.pushUrl)
+      self._Set('review', self.review)
+      self._Set('projectname', self.projectname)
+      self._Set('fetch', list(map(str, self.fetch)))
 
   def _Set(self, key, value):
     key = 'remote.%s.%s' % (self.name, key)
@@ -764,24 +891,13 @@ class Branch(object):
   def Save(self):
     """Save this branch back into the configuration.
     """
-    if self._config.HasSection('branch', self.name):
+    with self._config.Transaction():
       if self.remote:
         self._Set('remote', self.remote.name)
       else:
         self._Set('remote', None)
       self._Set('merge', self.merge)
 
-    else:
-      fd = open(self._config.file, 'a')
-      try:
-        fd.write('[branch "%s"]\n' % self.name)
-        if self.remote:
-          fd.write('\tremote = %s\n' % self.remote.name)
-        if self.merge:
-          fd.write('\tmerge = %s\n' % self.merge)
-      finally:
-        fd.close()
-
   def _Set(self, key, value):
     key = 'branch.%s.%s' % (self.name, key)
     return self._config.SetString(key, value)
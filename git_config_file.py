@@ -0,0 +1,495 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read and edit git config files without running git.
+
+The syntax is the one of git's config.c: sections with optional quoted
+subsections, values with quotes and escapes, continuation lines, and
+comments.  Lines that an edit does not touch are kept as they are.
+"""
+
+import codecs
+import errno
+import os
+import re
+import string
+
+from error import GitError
+
+
+_KEY_CHARS = frozenset(string.ascii_letters + string.digits + '-')
+_SECTION_CHARS = _KEY_CHARS | frozenset('.')
+
+# Like git, give up on include cycles at this depth.
+_MAX_INCLUDE_DEPTH = 10
+
+
+class ConfigSyntaxError(ValueError):
+  """The file is not valid git config syntax, or uses a form not handled."""
+
+
+class ConfigEntry(object):
+  """A section header or a variable of a config file.
+
+  Attributes:
+    base: The section, and "." and the subsection if there is one, or None
+        before the first section header.  The section is lowercase, the
+        subsection keeps its case unless it was written in the deprecated
+        [section.subsection] form.
+    key: The lowercase variable name, or None for a section header.
+    value: The value, or None for a variable without "=".
+    first: Index of the line the entry starts on.
+    last: Index of the line the entry ends on.
+  """
+
+  __slots__ = ('base', 'key', 'value', 'first', 'last')
+
+  def __init__(self, base, key, value, first, last):
+    self.base = base
+    self.key = key
+    self.value = value
+    self.first = first
+    self.last = last
+
+  @property
+  def name(self):
+    if self.base is None:
+      # A variable before the first section header.
+      return self.key
+    return '%s.%s' % (self.base, self.key)
+
+
+def SplitLines(text):
+  """Split |text| into lines that keep their line ends."""
+  parts = text.split('\n')
+  lines = [p + '\n' for p in parts[:-1]]
+  if parts[-1]:
+    lines.append(parts[-1])
+  return lines
+
+
+def ParseLines(lines):
+  """Parse the lines of a config file into a list of ConfigEntry.
+
+  Raises:
+    ConfigSyntaxError: If git would reject the file.
+  """
+  entries = []
+  base = None
+  i = 0
+  bom = _Decode(codecs.BOM_UTF8)
+  if lines and lines[0].startswith(bom):
+    lines = [lines[0][len(bom):]] + lines[1:]
+  while i < len(lines):
+    line = _Chomp(lines[i])
+    pos = _SkipSpace(line, 0)
+    while pos < len(line) and line[pos] == '[':
+      base, pos = _ParseHeader(line, pos + 1, i)
+      entries.append(ConfigEntry(base, None, None, i, i))
+      pos = _SkipSpace(line, pos)
+    if pos == len(line) or line[pos] in '#;':
+      i += 1
+      continue
+    if line[pos] not in string.ascii_letters:
+      raise ConfigSyntaxError('bad config line %d' % (i + 1))
+
+    start = pos
+    while pos < len(line) and line[pos] in _KEY_CHARS:
+      pos += 1
+    key = line[start:pos].lower()
+    while pos < len(line) and line[pos] in ' \t':
+      pos += 1
+    if pos == len(line):
+      entries.append(ConfigEntry(base, key, None, i, i))
+      i += 1
+      continue
+    if line[pos] != '=':
+      raise ConfigSyntaxError('bad config line %d' % (i + 1))
+    value, last = _ParseValue(lines, i, pos + 1)
+    entries.append(ConfigEntry(base, key, value, i, last))
+    i = last + 1
+  return entries
+
+
+def ReadConfig(path, includes=False, gitdir=None):
+  """Read the config file |path| like `git config --file |path| --list`.
+
+  Args:
+    path: The config file.
+    includes: Whether to follow include.path and includeIf.*.path, like
+        `git config --includes`.
+    gitdir: The git directory the "gitdir:" and "onbranch:" conditions of
+        includeIf sections are checked against.  Without it those
+        conditions never match.
+
+  Returns:
+    A dict of variable names to the list of their values.  A missing file
+    has no variables.
+
+  Raises:
+    ConfigSyntaxError: If git would reject the file.
+  """
+  config = {}
+  _ReadInto(config, path, includes, gitdir, 0)
+  return config
+
+
+def _ReadInto(config, path, includes, gitdir, depth):
+  try:
+    with open(path, 'rb') as f:
+      data = f.read()
+  except IOError as e:
+    # Like git, missing include files are skipped.
+    if e.errno in (errno.ENOENT, errno.ENOTDIR):
+      return
+    raise
+  for e in ParseLines(SplitLines(_Decode(data))):
+    if e.key is None:
+      continue
+    name = e.name
+    config.setdefault(name, []).append(e.value)
+    if not includes or e.key != 'path' or e.value is None:
+      continue
+    if e.base == 'include':
+      pass
+    elif not (e.base.startswith('includeif.') and
+              _IncludeIf(e.base[len('includeif.'):], path, gitdir)):
+      continue
+    if depth >= _MAX_INCLUDE_DEPTH:
+      raise ConfigSyntaxError('exceeded maximum include depth in %s' % path)
+    include = os.path.expanduser(e.value)
+    if not os.path.isabs(include):
+      include = os.path.join(os.path.dirname(path), include)
+    _ReadInto(config, include, includes, gitdir, depth + 1)
+
+
+def _IncludeIf(condition, path, gitdir):
+  """Whether the condition of an includeIf section in |path| holds."""
+  if gitdir is None:
+    return False
+  kind, _, pattern = condition.partition(':')
+  if kind in ('gitdir', 'gitdir/i'):
+    if pattern.startswith('~/'):
+      pattern = os.path.expanduser(pattern)
+    elif pattern.startswith('./'):
+      pattern = os.path.join(os.path.dirname(os.path.realpath(path)),
+                             pattern[2:])
+    elif not os.path.isabs(pattern):
+      pattern = '**/' + pattern
+    if pattern.endswith('/'):
+      pattern += '**'
+    flags = re.I if kind == 'gitdir/i' else 0
+    regex = re.compile(_GlobToRegex(pattern), flags)
+    gitdir = os.path.abspath(gitdir)
+    return bool(regex.match(gitdir) or
+                regex.match(os.path.realpath(gitdir)))
+  if kind == 'onbranch':
+    try:
+      with open(os.path.join(gitdir, 'HEAD')) as f:
+        head = f.read().strip()
+    except IOError:
+      return False
+    if not head.startswith('ref: refs/heads/'):
+      return False
+    if pattern.endswith('/'):
+      pattern += '**'
+    return bool(re.match(_GlobToRegex(pattern), head[len('ref: refs/heads/'):]))
+  return False
+
+
+def _GlobToRegex(pattern):
+  """Translate a wildmatch() pattern with WM_PATHNAME into a regex."""
+  out = []
+  i = 0
+  while i < len(pattern):
+    c = pattern[i]
+    if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+      out.append('(?:.*/)?')
+      i += 3
+      continue
+    if pattern.startswith('**', i) and i + 2 == len(pattern) and (
+        i == 0 or pattern[i - 1] == '/'):
+      out.append('.*')
+      i += 2
+      continue
+    if c == '*':
+      out.append('[^/]*')
+    elif c == '?':
+      out.append('[^/]')
+    elif c == '[':
+      end = pattern.find(']', i + 2)
+      if end < 0:
+        out.append(re.escape(c))
+      else:
+        cls = pattern[i + 1:end]
+        if cls[:1] == '!':
+          cls = '^' + cls[1:]
+        out.append('[%s]' % cls.replace('\\', '\\\\'))
+        i = end
+    elif c == '\\' and i + 1 < len(pattern):
+      i += 1
+      out.append(re.escape(pattern[i]))
+    else:
+      out.append(re.escape(c))
+    i += 1
+  out.append('$')
+  return ''.join(out)
+
+
+def EditConfig(path, changes):
+  """Apply |changes| to the config file |path| in one write.
+
+  Like git, the file is written to |path|.lock first, which is then renamed
+  over |path|.  A missing file is created.
+
+  Args:
+    path: The config file.
+    changes: (name, values) tuples, applied in order.  A list of values
+        replaces all the values of the variable |name|, like
+        `git config --replace-all` followed by `git config --add`.  None
+        removes the variable, like `git config --unset-all`.
+
+  Raises:
+    ConfigSyntaxError: If the file cannot be edited here.  It is left as
+        it was.
+    GitError: If the file is locked by another writer.
+  """
+  path = os.path.realpath(path)
+  lock = path + '.lock'
+  try:
+    fd = os.open(lock, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+  except OSError as e:
+    if e.errno == errno.EEXIST:
+      raise GitError('could not lock config file %s' % path)
+    raise
+  try:
+    try:
+      with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    except IOError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      st = None
+      data = b''
+
+    lines = SplitLines(_Decode(data))
+    for name, values in changes:
+      lines = _Apply(lines, name, values)
+
+    os.write(fd, _Encode(''.join(lines)))
+    os.close(fd)
+    fd = None
+    if st is not None:
+      os.chmod(lock, st.st_mode & 0o7777)
+    os.rename(lock, path)
+    lock = None
+  finally:
+    if fd is not None:
+      os.close(fd)
+    if lock is not None:
+      os.remove(lock)
+
+
+def FormatValue(value):
+  """Quote and escape |value| the way `git config` writes it."""
+  quote = (value.startswith(' ') or value.endswith(' ') or
+           ';' in value or '#' in value)
+  value = (value.replace('\\', '\\\\').replace('"', '\\"')
+           .replace('\n', '\\n').replace('\t', '\\t'))
+  if quote:
+    return '"%s"' % value
+  return value
+
+
+def _Apply(lines, name, values):
+  """Replace or remove the variable |name| in |lines|."""
+  parts = name.split('.')
+  if len(parts) < 2:
+    raise ConfigSyntaxError('invalid key: %s' % name)
+  base = '.'.join([parts[0].lower()] + parts[1:-1])
+  key = parts[-1].lower()
+
+  if lines and not lines[-1].endswith('\n'):
+    lines = lines[:-1] + [lines[-1] + '\n']
+  entries = ParseLines(lines)
+  headers = set(e.first for e in entries if e.key is None)
+  matches = [e for e in entries if e.base == base and e.key == key]
+  if any(e.first in headers for e in matches):
+    # A variable on the line of its section header.
+    raise ConfigSyntaxError('cannot edit %s' % name)
+
+  # Like git, new lines keep the case the caller spelled the name in.
+  new = []
+  for v in values or []:
+    if v is None:
+      new.append('\t%s\n' % parts[-1])
+    else:
+      new.append('\t%s = %s\n' % (parts[-1], FormatValue(v)))
+
+  if matches:
+    at = matches[-1].last + 1
+  elif not new:
+    return lines
+  else:
+    at = None
+    in_section = False
+    for e in entries:
+      if e.key is None:
+        in_section = e.base == base
+      if in_section:
+        at = e.last + 1
+    if at is None:
+      section = parts[0]
+      sub = '.'.join(parts[1:-1])
+      if sub:
+        sub = sub.replace('\\', '\\\\').replace('"', '\\"')
+        new.insert(0, '[%s "%s"]\n' % (section, sub))
+      else:
+        new.insert(0, '[%s]\n' % section)
+      at = len(lines)
+
+  removed = set()
+  for e in matches:
+    removed.update(range(e.first, e.last + 1))
+  if matches and not new:
+    # Like git, drop sections left without variables or comments.
+    starts = sorted(headers) + [len(lines)]
+    for e in entries:
+      if e.key is not None or e.base != base:
+        continue
+      end = starts[starts.index(e.first) + 1]
+      body = range(e.first + 1, end)
+      if not any(e.first < m.first < end for m in matches):
+        continue
+      if all(i in removed or not lines[i].strip() for i in body):
+        removed.update(range(e.first, end))
+  result = []
+  for i, line in enumerate(lines):
+    if i == at:
+      result.extend(new)
+    if i not in removed:
+      result.append(line)
+  if at == len(lines):
+    result.extend(new)
+  return result
+
+
+def _ParseHeader(line, pos, lineno):
+  """Parse a [section] or [section "subsection"] header after its "["."""
+  start = pos
+  while pos < len(line) and line[pos] in _SECTION_CHARS:
+    pos += 1
+  section = line[start:pos].lower()
+  if not section or pos == len(line):
+    raise ConfigSyntaxError('bad section header on line %d' % (lineno + 1))
+  if line[pos] == ']':
+    return section, pos + 1
+  if line[pos] not in ' \t':
+    raise ConfigSyntaxError('bad section header on line %d' % (lineno + 1))
+
+  pos = _SkipSpace(line, pos)
+  if pos == len(line) or line[pos] != '"':
+    raise ConfigSyntaxError('bad section header on line %d' % (lineno + 1))
+  pos += 1
+  sub = []
+  while pos < len(line) and line[pos] != '"':
+    if line[pos] == '\\':
+      pos += 1
+      if pos == len(line):
+        break
+    sub.append(line[pos])
+    pos += 1
+  if line[pos + 1:pos + 2] != ']':
+    raise ConfigSyntaxError('bad section header on line %d' % (lineno + 1))
+  return '%s.%s' % (section, ''.join(sub)), pos + 2
+
+
+_ESCAPES = {'n': '\n', 't': '\t', 'b': '\b', '\\': '\\', '"': '"'}
+
+
+def _ParseValue(lines, i, pos):
+  """Parse the value starting at |pos| of |lines|[|i|], like parse_value().
+
+  Returns:
+    The value, and the index of the line it ends on.
+  """
+  value = []
+  quote = False
+  spaces = 0
+  line = _Chomp(lines[i])
+  while True:
+    if pos == len(line):
+      if quote:
+        raise ConfigSyntaxError('unterminated quote on line %d' % (i + 1))
+      return ''.join(value), i
+    c = line[pos]
+    pos += 1
+    if c in ' \t\r\v\f' and not quote:
+      if value:
+        spaces += 1
+      continue
+    if c in '#;' and not quote:
+      return ''.join(value), i
+    if spaces:
+      value.append(' ' * spaces)
+      spaces = 0
+    if c == '\\':
+      if pos == len(line):
+        # A continuation line.
+        if i + 1 == len(lines):
+          if quote:
+            raise ConfigSyntaxError('unterminated quote on line %d' % (i + 1))
+          return ''.join(value), i
+        i += 1
+        line = _Chomp(lines[i])
+        pos = 0
+        continue
+      c = _ESCAPES.get(line[pos])
+      if c is None:
+        raise ConfigSyntaxError('bad escape on line %d' % (i + 1))
+      pos += 1
+      value.append(c)
+    elif c == '"':
+      quote = not quote
+    else:
+      value.append(c)
+
+
+def _Chomp(line):
+  if line.endswith('\n'):
+    line = line[:-1]
+    if line.endswith('\r'):
+      line = line[:-1]
+  return line
+
+
+def _SkipSpace(line, pos):
+  while pos < len(line) and line[pos] in ' \t\r\v\f':
+    pos += 1
+  return pos
+
+
+def _Decode(data):
+  if str is bytes:
+    return data
+  return data.decode('utf-8', 'surrogateescape')
+
+
+def _Encode(text):
+  if str is bytes:
+    return text
+  return text.encode('utf-8', 'surrogateescape')
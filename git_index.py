@@ -0,0 +1,293 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read the git index, to tell whether a work tree is clean without git.
+
+Only a "certainly clean" answer is given here.  Anything that git would have
+to look at more closely (an entry whose stat data differs, a racily clean
+entry, an unknown file on disk) is reported, and the caller asks git.
+"""
+
+import binascii
+import os
+import stat
+import struct
+
+_SIGNATURE = b'DIRC'
+_ENTRY = struct.Struct('>10I20sH')
+
+# Entry flags.
+_ASSUME_VALID = 0x8000
+_EXTENDED = 0x4000
+_STAGE_MASK = 0x3000
+# Extended entry flags (index version 3 and later).
+_SKIP_WORKTREE = 0x4000
+_INTENT_TO_ADD = 0x2000
+
+# Modes of the index entries.
+_GITLINK = 0o160000
+_SYMLINK = 0o120000
+
+
+class IndexEntry(object):
+  """One path in the index, with the stat data recorded for it."""
+
+  __slots__ = ('name', 'ctime', 'ctime_ns', 'mtime', 'mtime_ns', 'dev',
+               'ino', 'mode', 'uid', 'gid', 'size', 'oid', 'flags',
+               'extended_flags')
+
+  def __init__(self, name, fields, extended_flags):
+    self.name = name
+    (self.ctime, self.ctime_ns, self.mtime, self.mtime_ns, self.dev,
+     self.ino, self.mode, self.uid, self.gid, self.size, oid,
+     self.flags) = fields
+    self.oid = binascii.hexlify(oid).decode('utf-8')
+    self.extended_flags = extended_flags
+
+  @property
+  def stage(self):
+    return (self.flags & _STAGE_MASK) >> 12
+
+
+class Index(object):
+  """The parsed contents of an index file.
+
+  Attributes:
+    version: The index format version, 2 to 4.
+    entries: The IndexEntry objects, sorted by name.
+    tree: The tree id of the whole index from the cache-tree extension, or
+        None if git did not record it or it was invalidated.
+    mtime: The modification time of the index file, in seconds.
+  """
+
+  def __init__(self, version, entries, tree, st):
+    self.version = version
+    self.entries = entries
+    self.tree = tree
+    self.mtime = int(st.st_mtime)
+
+
+def ReadIndex(path):
+  """Parse the index file at |path|.
+
+  Returns:
+    An Index, or None if there is no index or it uses features this reader
+    does not handle: split or sparse indexes, and other object formats than
+    SHA-1.
+  """
+  try:
+    with open(path, 'rb') as fd:
+      st = os.fstat(fd.fileno())
+      data = fd.read()
+  except (IOError, OSError):
+    return None
+  if len(data) < 12 + 20 or data[:4] != _SIGNATURE:
+    return None
+  version, count = struct.unpack_from('>II', data, 4)
+  if version not in (2, 3, 4):
+    return None
+
+  end = len(data) - 20
+  entries = []
+  pos = 12
+  name = b''
+  try:
+    for _ in range(count):
+      fields = _ENTRY.unpack_from(data, pos)
+      entry_start = pos
+      pos += _ENTRY.size
+      extended_flags = 0
+      if fields[-1] & _EXTENDED:
+        extended_flags = struct.unpack_from('>H', data, pos)[0]
+        pos += 2
+      if version == 4:
+        # The name is the previous one with a number of bytes removed from
+        # its end, and a suffix appended.
+        strip, pos = _ReadVarint(data, pos)
+        nul = data.index(b'\0', pos)
+        name = name[:len(name) - strip] + data[pos:nul]
+        pos = nul + 1
+      else:
+        nul = data.index(b'\0', pos)
+        name = data[pos:nul]
+        # Entries are padded with 1 to 8 NULs to a multiple of 8 bytes.
+        pos = entry_start + ((nul - entry_start + 8) & ~7)
+      entries.append(IndexEntry(_DecodeName(name), fields, extended_flags))
+
+    tree = None
+    while pos + 8 <= end:
+      sig, size = struct.unpack_from('>4sI', data, pos)
+      pos += 8
+      if sig in (b'link', b'sdir'):
+        return None
+      if sig == b'TREE':
+        tree = _RootTree(data[pos:pos + size])
+      pos += size
+  except (struct.error, ValueError, IndexError):
+    return None
+  return Index(version, entries, tree, st)
+
+
+def ChangedEntries(worktree, index):
+  """List the entries that git would have to look at more closely.
+
+  An entry is reported when it is not at stage 0, is about to be added,
+  or when the stat data of its file differs from the one recorded in the
+  index.  Entries that are racily clean, i.e. modified in the same second
+  the index was written, are reported too, as only their content could
+  tell whether they changed.
+  """
+  changed = []
+  for e in index.entries:
+    if e.stage or e.extended_flags & _INTENT_TO_ADD:
+      changed.append(e)
+      continue
+    if e.flags & _ASSUME_VALID or e.extended_flags & _SKIP_WORKTREE:
+      continue
+    if e.mode == _GITLINK:
+      # Submodules are ignored, like `git diff-files --ignore-submodules`.
+      continue
+    try:
+      st = os.lstat(os.path.join(worktree, e.name))
+    except OSError:
+      changed.append(e)
+      continue
+    if not _StatMatches(e, st) or _IsRacy(e, index):
+      changed.append(e)
+  return changed
+
+
+def HasUnknownFiles(worktree, index):
+  """Whether the work tree has files that are not in the index.
+
+  Ignore rules are not applied, so a True result only means that git has to
+  be asked for the untracked files.
+  """
+  tracked = set(e.name for e in index.entries)
+  dirs = set()
+  for name in tracked:
+    parts = name.split('/')
+    for i in range(1, len(parts)):
+      dirs.add('/'.join(parts[:i]))
+
+  for top, subdirs, files in os.walk(worktree):
+    rel = os.path.relpath(top, worktree).replace(os.sep, '/')
+    prefix = '' if rel == '.' else rel + '/'
+    for f in files:
+      if prefix + f not in tracked:
+        return True
+    keep = []
+    for d in subdirs:
+      path = prefix + d
+      if not prefix and d == '.git':
+        continue
+      if path in tracked:
+        # A symlink or a submodule.
+        continue
+      if path not in dirs or os.path.islink(os.path.join(top, d)):
+        if _HasFiles(os.path.join(top, d)):
+          return True
+        continue
+      keep.append(d)
+    subdirs[:] = keep
+  return False
+
+
+def _HasFiles(path):
+  if os.path.islink(path):
+    return True
+  for _, _, files in os.walk(path):
+    if files:
+      return True
+  return False
+
+
+def _StatMatches(e, st):
+  """Compare like git's ie_match_stat(), but also compare nanoseconds.
+
+  Nanoseconds are only compared where os.stat() has them exactly (not on
+  Python 2, whose float times are not precise enough).
+  """
+  mode = st.st_mode
+  if e.mode == _SYMLINK:
+    if not stat.S_ISLNK(mode):
+      return False
+  elif not stat.S_ISREG(mode):
+    return False
+  elif (e.mode & 0o100) != (mode & 0o100):
+    return False
+  return (e.mtime == int(st.st_mtime) & 0xffffffff and
+          _NanosecondsMatch(e.mtime_ns, st, 'st_mtime') and
+          e.ctime == int(st.st_ctime) & 0xffffffff and
+          _NanosecondsMatch(e.ctime_ns, st, 'st_ctime') and
+          e.ino == st.st_ino & 0xffffffff and
+          e.uid == st.st_uid & 0xffffffff and
+          e.gid == st.st_gid & 0xffffffff and
+          e.size == st.st_size & 0xffffffff)
+
+
+def _IsRacy(e, index):
+  """Whether the file may have changed after the index recorded it.
+
+  Like git built without USE_NSEC, a modification in the same second as the
+  index was written counts as racy.
+  """
+  return e.mtime >= index.mtime
+
+
+def _NanosecondsMatch(ns, st, attr):
+  """Whether |ns| is the nanoseconds part of the time |attr| of |st|."""
+  st_ns = getattr(st, attr + '_ns', None)
+  if st_ns is None:
+    return True
+  return ns == st_ns % 1000000000
+
+
+def _ReadVarint(data, pos):
+  """Read the offset encoding of git's varint.c."""
+  c = _Byte(data, pos)
+  pos += 1
+  value = c & 0x7f
+  while c & 0x80:
+    c = _Byte(data, pos)
+    pos += 1
+    value = ((value + 1) << 7) | (c & 0x7f)
+  return value, pos
+
+
+def _DecodeName(name):
+  if str is bytes:
+    # Python 2 file names are bytes too.
+    return name
+  # Undecodable names round trip like the ones from os.walk().
+  return name.decode('utf-8', 'surrogateescape')
+
+
+def _Byte(data, pos):
+  b = data[pos]
+  return b if isinstance(b, int) else ord(b)
+
+
+def _RootTree(data):
+  """The tree id of the root entry of a cache-tree extension, or None."""
+  nul = data.index(b'\0')
+  if nul != 0:
+    return None
+  nl = data.index(b'\n', nul)
+  entry_count = int(data[nul + 1:nl].split(b' ')[0])
+  if entry_count < 0:
+    return None
+  return binascii.hexlify(data[nl + 1:nl + 21]).decode('utf-8')
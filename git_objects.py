@@ -0,0 +1,268 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cheap access to the objects in a git repository, without running git.
+
+Statistics are computed from directory listings and pack index headers.
+Single objects can be read when they are stored whole, loose or packed.
+"""
+
+import binascii
+import os
+import struct
+import zlib
+
+_IDX_V2_MAGIC = b'\377tOc'
+
+
+class ObjectStats(object):
+  """Counts and sizes of the loose objects and packs of a git directory."""
+
+  def __init__(self, gitdir, loose=True, since=None):
+    """Scan |gitdir|; with |loose| False only its packs are looked at.
+
+    With |since| set, only objects and packs written at or after that time
+    are counted, e.g. the ones received by a fetch started then.
+    """
+    self._since = since
+    self.loose_objects = 0
+    self.loose_size = 0
+    self.packs = 0
+    self.kept_packs = 0
+    self.packed_objects = 0
+    self.pack_size = 0
+
+    objects = os.path.join(gitdir, 'objects')
+    if loose:
+      self._ScanLoose(objects)
+    self._ScanPacks(os.path.join(objects, 'pack'))
+
+  @property
+  def objects(self):
+    """Number of objects; objects stored more than once count every time."""
+    return self.loose_objects + self.packed_objects
+
+  @property
+  def size(self):
+    """Bytes used by loose objects and packs."""
+    return self.loose_size + self.pack_size
+
+  def _ScanLoose(self, objects):
+    try:
+      names = os.listdir(objects)
+    except OSError:
+      return
+    for name in names:
+      if len(name) != 2 or not _IsHex(name):
+        continue
+      subdir = os.path.join(objects, name)
+      try:
+        # Adding an object updates the modification time of its directory.
+        if self._since is not None and os.stat(subdir).st_mtime < self._since:
+          continue
+        entries = os.listdir(subdir)
+      except OSError:
+        continue
+      for entry in entries:
+        if len(entry) != 38 or not _IsHex(entry):
+          continue
+        st = self._Stat(os.path.join(subdir, entry))
+        if st:
+          self.loose_size += st.st_size
+          self.loose_objects += 1
+
+  def _ScanPacks(self, packdir):
+    try:
+      names = os.listdir(packdir)
+    except OSError:
+      return
+    names = set(names)
+    for name in names:
+      if not name.endswith('.pack'):
+        continue
+      base = name[:-len('.pack')]
+      st = self._Stat(os.path.join(packdir, name))
+      if not st:
+        continue
+      self.pack_size += st.st_size
+      self.packs += 1
+      if base + '.keep' in names:
+        self.kept_packs += 1
+      if base + '.idx' in names:
+        self.packed_objects += IndexObjectCount(
+            os.path.join(packdir, base + '.idx'))
+
+  def _Stat(self, path):
+    """os.stat() of |path|, or None if it is missing or too old."""
+    try:
+      st = os.stat(path)
+    except OSError:
+      return None
+    if self._since is not None and st.st_mtime < self._since:
+      return None
+    return st
+
+
+def LooseObjectEstimate(gitdir):
+  """Estimate the number of loose objects the way `git gc --auto` does.
+
+  Object names are uniformly distributed, so the objects/17 fan-out
+  directory holds about 1/256 of all loose objects.
+  """
+  try:
+    names = os.listdir(os.path.join(gitdir, 'objects', '17'))
+  except OSError:
+    return 0
+  return 256 * sum(1 for n in names if len(n) == 38 and _IsHex(n))
+
+
+def IndexObjectCount(path):
+  """Number of objects listed in a pack index (version 1 or 2).
+
+  The count is the last entry of the fan-out table in the index header.
+  Returns 0 if the index cannot be read.
+  """
+  try:
+    with open(path, 'rb') as fd:
+      header = fd.read(8 + 256 * 4)
+  except IOError:
+    return 0
+  if header[:4] == _IDX_V2_MAGIC:
+    fanout = header[8:]
+  else:
+    fanout = header
+  if len(fanout) < 256 * 4:
+    return 0
+  return struct.unpack('>I', fanout[255 * 4:256 * 4])[0]
+
+
+def ReadObject(gitdir, oid):
+  """Read the object |oid| of |gitdir| if that is simple.
+
+  Returns:
+    A (type, data) tuple, or None if the object is not found, is stored as
+    a delta, or lives in an alternate object directory.
+  """
+  objects = os.path.join(gitdir, 'objects')
+  try:
+    with open(os.path.join(objects, oid[:2], oid[2:]), 'rb') as fd:
+      raw = zlib.decompress(fd.read())
+  except (IOError, OSError, zlib.error):
+    pass
+  else:
+    header, _, data = raw.partition(b'\0')
+    kind, _, size = header.partition(b' ')
+    if not size.isdigit() or int(size) != len(data):
+      return None
+    return kind.decode('utf-8'), data
+
+  if len(oid) != 40:
+    return None
+  packdir = os.path.join(objects, 'pack')
+  try:
+    names = os.listdir(packdir)
+  except OSError:
+    return None
+  binoid = binascii.unhexlify(oid)
+  for name in names:
+    if not name.endswith('.idx'):
+      continue
+    offset = _PackOffset(os.path.join(packdir, name), binoid)
+    if offset is not None:
+      return _ReadPacked(os.path.join(packdir, name[:-4] + '.pack'), offset)
+  return None
+
+
+# Object types in pack files; deltas (6, 7) are not supported.
+_PACK_TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+
+
+def _PackOffset(idx_path, binoid):
+  """Binary search a version 2 pack index for the offset of |binoid|."""
+  try:
+    fd = open(idx_path, 'rb')
+  except IOError:
+    return None
+  with fd:
+    header = fd.read(8 + 256 * 4)
+    if len(header) != 8 + 256 * 4 or header[:4] != _IDX_V2_MAGIC:
+      return None
+    first = binoid[0] if isinstance(binoid[0], int) else ord(binoid[0])
+    fanout = struct.unpack('>256I', header[8:])
+    count = fanout[255]
+    lo = fanout[first - 1] if first else 0
+    hi = fanout[first]
+    names = 8 + 256 * 4
+    while lo < hi:
+      mid = (lo + hi) // 2
+      fd.seek(names + mid * 20)
+      name = fd.read(20)
+      if name == binoid:
+        break
+      if name < binoid:
+        lo = mid + 1
+      else:
+        hi = mid
+    else:
+      return None
+    offsets = names + count * (20 + 4)
+    fd.seek(offsets + mid * 4)
+    offset = struct.unpack('>I', fd.read(4))[0]
+    if offset & 0x80000000:
+      fd.seek(offsets + count * 4 + (offset & 0x7fffffff) * 8)
+      offset = struct.unpack('>Q', fd.read(8))[0]
+    return offset
+
+
+def _ReadPacked(pack_path, offset):
+  try:
+    fd = open(pack_path, 'rb')
+  except IOError:
+    return None
+  with fd:
+    fd.seek(offset)
+    c = ord(fd.read(1))
+    kind = _PACK_TYPES.get((c >> 4) & 7)
+    size = c & 15
+    shift = 4
+    while c & 0x80:
+      c = ord(fd.read(1))
+      size |= (c & 0x7f) << shift
+      shift += 7
+    if kind is None:
+      return None
+    d = zlib.decompressobj()
+    data = []
+    have = 0
+    while have < size:
+      chunk = fd.read(8192)
+      if not chunk:
+        return None
+      out = d.decompress(chunk)
+      data.append(out)
+      have += len(out)
+  data = b''.join(data)
+  if len(data) != size:
+    return None
+  return kind, data
+
+
+def _IsHex(name):
+  try:
+    int(name, 16)
+  except ValueError:
+    return False
+  return True
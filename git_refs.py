@@ -14,9 +14,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import mmap
 import os
+import time
 from trace import Trace
 import platform_utils
+import repo_cache
 
 HEAD      = 'HEAD'
 R_CHANGES = 'refs/changes/'
@@ -25,13 +28,30 @@ R_TAGS    = 'refs/tags/'
 R_PUB     = 'refs/published/'
 R_M       = 'refs/remotes/m/'
 
+# Bump when the layout of the snapshots kept in the RepoCache changes.
+_SNAPSHOT_VERSION = '1'
+
 
 class GitRefs(object):
-  def __init__(self, gitdir):
+  """The refs of a git directory, read from its files without running git.
+
+  Once everything was loaded, only the loose ref files and directories whose
+  modification time changed are read again.  A single get() before that
+  reads just the loose file of the ref, or binary searches packed-refs.
+
+  With a RepoCache, what was read is kept as a snapshot for the next repo
+  command, which then only has to check the modification times.
+  """
+
+  def __init__(self, gitdir, cache=None):
     self._gitdir = gitdir
+    self._cache = cache
     self._phyref = None
     self._symref = None
+    self._packed = {}
+    self._loose = {}
     self._mtime = {}
+    self._dirty = False
 
   @property
   def all(self):
@@ -39,6 +59,8 @@ class GitRefs(object):
     return self._phyref
 
   def get(self, name):
+    if self._phyref is None:
+      return self._Lookup(name)
     try:
       return self.all[name]
     except KeyError:
@@ -54,6 +76,50 @@ class GitRefs(object):
 
       if name in self._mtime:
         del self._mtime[name]
+      self._loose.pop(name, None)
+      self._packed.pop(name, None)
+      self._Restat(name)
+      self._dirty = True
+
+  def updated(self, name, ref_id, deref=True):
+    """Record that we just set |name| to |ref_id|.
+
+    With |deref| a symbolic ref is followed and its target is updated, like
+    `git update-ref` does without --no-deref.
+    """
+    if self._phyref is None:
+      return
+    if deref:
+      name = self._Resolve(name)
+    elif name in self._symref:
+      del self._symref[name]
+    self._phyref[name] = ref_id
+    self._loose[name] = ref_id
+    for sym in self._symref:
+      if self._Resolve(sym) == name:
+        self._phyref[sym] = ref_id
+    self._Restat(name)
+    self._dirty = True
+
+  def _Resolve(self, name):
+    for _ in range(5):
+      if name not in self._symref:
+        break
+      name = self._symref[name]
+    return name
+
+  def _Restat(self, name):
+    """Accept the modification times our own write of |name| changed."""
+    keys = [name, 'packed-refs']
+    parts = name.split('/')[:-1]
+    keys.extend('/'.join(parts[:i]) + '/' for i in range(1, len(parts) + 1))
+    for key in keys:
+      if key not in self._mtime and key != name and not key.endswith('/'):
+        continue
+      try:
+        self._mtime[key] = os.path.getmtime(os.path.join(self._gitdir, key))
+      except OSError:
+        self._mtime.pop(key, None)
 
   def symref(self, name):
     try:
@@ -63,30 +129,134 @@ class GitRefs(object):
       return ''
 
   def _EnsureLoaded(self):
-    if self._phyref is None or self._NeedUpdate():
-      self._LoadAll()
+    if self._phyref is None:
+      if self._LoadSnapshot():
+        self._Refresh()
+        self._Merge()
+      else:
+        self._LoadAll()
+      self._SaveSnapshot()
+    elif self._Refresh():
+      self._Merge()
+      self._SaveSnapshot()
+    elif self._dirty:
+      self._SaveSnapshot()
+
+  def _LoadSnapshot(self):
+    """Start from the snapshot of an earlier command, if there is one."""
+    if self._cache is None:
+      return False
+    data = self._cache.Get('refs', os.path.abspath(self._gitdir),
+                           _SNAPSHOT_VERSION)
+    try:
+      packed, loose, mtime = data['packed'], data['loose'], data['mtime']
+    except (KeyError, TypeError):
+      return False
+    self._packed = packed
+    self._loose = loose
+    self._mtime = mtime
+    return True
 
-  def _NeedUpdate(self):
+  def _SaveSnapshot(self):
+    self._dirty = False
+    if self._cache is None:
+      return
+    # Files modified too recently could change again without changing their
+    # modification time, so the next command reads them again.
+    now = time.time()
+    mtime = dict((name, -1 if t is not None and repo_cache.IsRacy(t, now)
+                  else t)
+                 for name, t in self._mtime.items())
+    self._cache.Put('refs', os.path.abspath(self._gitdir), _SNAPSHOT_VERSION,
+                    {'packed': self._packed, 'loose': self._loose,
+                     'mtime': mtime})
+
+  def _TrackRoots(self):
+    # Watch these even while missing, e.g. before the first fetch.
+    for name in ('packed-refs', 'refs/', HEAD):
+      self._mtime.setdefault(name, None)
+
+  def _Refresh(self):
+    """Re-read the ref files and directories that changed.
+
+    Returns:
+      True if anything was re-read.
+    """
     Trace(': scan refs %s', self._gitdir)
 
-    for name, mtime in self._mtime.items():
+    self._TrackRoots()
+    changed = False
+    for name, mtime in list(self._mtime.items()):
+      if name not in self._mtime or self._mtime[name] != mtime:
+        # Dropped or re-read along with its directory already.
+        continue
+      path = os.path.join(self._gitdir, name)
       try:
-        if mtime != os.path.getmtime(os.path.join(self._gitdir, name)):
-          return True
+        current = os.path.getmtime(path)
       except OSError:
-        return True
-    return False
+        current = None
+      if current == mtime:
+        continue
+      changed = True
+      if name == 'packed-refs':
+        self._ReadPackedRefs()
+      elif name.endswith('/'):
+        self._RescanDir(name)
+      else:
+        self._loose.pop(name, None)
+        self._mtime.pop(name, None)
+        self._ReadLoose1(path, name)
+    return changed
+
+  def _RescanDir(self, prefix):
+    """Pick up the refs added to or removed from the directory |prefix|."""
+    base = os.path.join(self._gitdir, prefix)
+    try:
+      self._mtime[prefix] = os.path.getmtime(base)
+      names = set(platform_utils.listdir(base))
+    except OSError:
+      names = set()
+      self._mtime.pop(prefix, None)
+
+    for key in [k for k in self._mtime if k.startswith(prefix)]:
+      child = key[len(prefix):].split('/', 1)[0]
+      if child and child not in names:
+        self._mtime.pop(key, None)
+    for key in [k for k in self._loose if k.startswith(prefix)]:
+      child = key[len(prefix):].split('/', 1)[0]
+      if child not in names:
+        del self._loose[key]
+
+    for name in names:
+      p = os.path.join(base, name)
+      if platform_utils.isdir(p):
+        if prefix + name + '/' not in self._mtime:
+          self._ReadLoose(prefix + name + '/')
+      elif not name.endswith('.lock') and prefix + name not in self._mtime:
+        self._ReadLoose1(p, prefix + name)
 
   def _LoadAll(self):
     Trace(': load refs %s', self._gitdir)
 
-    self._phyref = {}
-    self._symref = {}
+    self._packed = {}
+    self._loose = {}
     self._mtime = {}
 
     self._ReadPackedRefs()
     self._ReadLoose('refs/')
     self._ReadLoose1(os.path.join(self._gitdir, HEAD), HEAD)
+    self._TrackRoots()
+    self._Merge()
+
+  def _Merge(self):
+    """Combine the packed and loose refs and resolve symbolic refs."""
+    self._phyref = dict(self._packed)
+    self._symref = {}
+    for name, value in self._loose.items():
+      if value.startswith('ref: '):
+        self._symref[name] = value[5:]
+      else:
+        self._phyref[name] = value
 
     scan = self._symref
     attempts = 0
@@ -101,6 +271,8 @@ class GitRefs(object):
       attempts += 1
 
   def _ReadPackedRefs(self):
+    self._packed = {}
+    self._mtime.pop('packed-refs', None)
     path = os.path.join(self._gitdir, 'packed-refs')
     try:
       fd = open(path, 'r')
@@ -122,17 +294,21 @@ class GitRefs(object):
         ref_id = p[0]
         name = p[1]
 
-        self._phyref[name] = ref_id
+        self._packed[name] = ref_id
     finally:
       fd.close()
     self._mtime['packed-refs'] = mtime
 
   def _ReadLoose(self, prefix):
     base = os.path.join(self._gitdir, prefix)
-    for name in platform_utils.listdir(base):
+    try:
+      self._mtime[prefix] = os.path.getmtime(base)
+      names = platform_utils.listdir(base)
+    except OSError:
+      return
+    for name in names:
       p = os.path.join(base, name)
       if platform_utils.isdir(p):
-        self._mtime[prefix] = os.path.getmtime(base)
         self._ReadLoose(prefix + name + '/')
       elif name.endswith('.lock'):
         pass
@@ -140,30 +316,109 @@ class GitRefs(object):
         self._ReadLoose1(p, prefix + name)
 
   def _ReadLoose1(self, path, name):
-    try:
-      fd = open(path)
-    except IOError:
+    value = _ReadRefFile(path)
+    if value is None:
       return
+    self._loose[name], self._mtime[name] = value
 
-    try:
-      try:
-        mtime = os.path.getmtime(path)
-        ref_id = fd.readline()
-      except (IOError, OSError):
-        return
-    finally:
-      fd.close()
+  def _Lookup(self, name):
+    """Look up |name| without loading all refs."""
+    for _ in range(5):
+      if name != HEAD and not name.startswith('refs/'):
+        return ''
+      value = _ReadRefFile(os.path.join(self._gitdir, name))
+      if value is None:
+        return _PackedLookup(os.path.join(self._gitdir, 'packed-refs'),
+                             name) or ''
+      ref_id = value[0]
+      if not ref_id.startswith('ref: '):
+        return ref_id
+      name = ref_id[5:]
+    return ''
+
+
+def _ReadRefFile(path):
+  """The content of the loose ref file |path| and its modification time.
+
+  Returns:
+    A (value, mtime) tuple, or None if there is no such ref.  The value is
+    an object id, or "ref: " and the name of the target for symbolic refs.
+  """
+  try:
+    fd = open(path)
+  except IOError:
+    return None
 
+  try:
     try:
-      ref_id = ref_id.decode()
-    except AttributeError:
-      pass
-    if not ref_id:
-      return
-    ref_id = ref_id[:-1]
+      mtime = os.path.getmtime(path)
+      ref_id = fd.readline()
+    except (IOError, OSError):
+      return None
+  finally:
+    fd.close()
+
+  try:
+    ref_id = ref_id.decode()
+  except AttributeError:
+    pass
+  if not ref_id:
+    return None
+  return ref_id[:-1], mtime
+
+
+def _PackedLookup(path, name):
+  """Binary search packed-refs for |name|, like git does.
+
+  git keeps packed-refs sorted by name, so a single ref can be found
+  without reading the whole file.  Files not marked as sorted are read in
+  full instead.
+
+  Returns:
+    The object id of |name|, or None.
+  """
+  try:
+    fd = open(path, 'rb')
+  except IOError:
+    return None
+  with fd:
+    if os.fstat(fd.fileno()).st_size == 0:
+      return None
+    data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    key = name.encode('utf-8')
+    start = 0
+    if data[:1] == b'#':
+      start = data.find(b'\n') + 1
+      if b' sorted' not in data[:start]:
+        return _PackedScan(data, start, key)
+    lo, hi = start, len(data)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      rec = data.rfind(b'\n', lo, mid) + 1 or lo
+      if data[rec:rec + 1] == b'^':
+        # Peeled values belong to the line before.
+        rec = data.rfind(b'\n', lo, rec - 1) + 1 or lo
+      eol = data.find(b'\n', rec)
+      if eol < 0:
+        eol = len(data)
+      ref_id, _, ref_name = data[rec:eol].partition(b' ')
+      if ref_name == key:
+        return ref_id.decode('utf-8')
+      if ref_name < key:
+        lo = eol + 1
+        if data[lo:lo + 1] == b'^':
+          lo = data.find(b'\n', lo) + 1 or len(data)
+      else:
+        hi = rec
+    return None
+  finally:
+    data.close()
+
 
-    if ref_id.startswith('ref: '):
-      self._symref[name] = ref_id[5:]
-    else:
-      self._phyref[name] = ref_id
-    self._mtime[name] = mtime
+def _PackedScan(data, start, key):
+  for line in data[start:].split(b'\n'):
+    ref_id, _, ref_name = line.partition(b' ')
+    if ref_name == key:
+      return ref_id.decode('utf-8')
+  return None
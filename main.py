@@ -45,8 +45,9 @@ except ImportError:
 
 from color import SetDefaultColoring
 import event_log
-from trace import SetTrace
-from git_command import git, GitCommand
+from trace import SetTrace, SetTraceSummary, Commands, FormatTraceSummary, \
+    WriteTraceEvents
+from git_command import git, GitCommand, close_cat_files
 from git_config import init_ssh, close_ssh
 from command import InteractiveCommand
 from command import MirrorSafeCommand
@@ -85,6 +86,14 @@ global_options.add_option('--color',
 global_options.add_option('--trace',
                           dest='trace', action='store_true',
                           help='trace git command execution')
+global_options.add_option('--trace-summary',
+                          dest='trace_summary', action='store_true',
+                          help='summarize the git processes run, per command '
+                               'and per project')
+global_options.add_option('--trace-json',
+                          dest='trace_json', action='store', metavar='FILE',
+                          help='write the git processes run to FILE in the '
+                               'Chrome trace event format')
 global_options.add_option('--time',
                           dest='time', action='store_true',
                           help='time repo command execution')
@@ -122,6 +131,8 @@ class _Repo(object):
 
     if gopts.trace:
       SetTrace()
+    if gopts.trace_summary or gopts.trace_json:
+      SetTraceSummary()
     if gopts.show_version:
       if name == 'help':
         name = 'version'
@@ -225,6 +236,16 @@ class _Repo(object):
           print('real\t%dh%dm%.3fs' % (hours, minutes, seconds),
                 file=sys.stderr)
 
+      if gopts.trace_summary or gopts.trace_json:
+        # Stop the long running git processes so they are accounted for.
+        close_cat_files()
+        records = Commands()
+        if gopts.trace_summary:
+          print(FormatTraceSummary(records), file=sys.stderr)
+        if gopts.trace_json:
+          WriteTraceEvents(records, os.path.abspath(
+                           os.path.expanduser(gopts.trace_json)))
+
       cmd.event_log.FinishEvent(cmd_event, finish,
                                 result is None or result == 0)
       if gopts.event_log:
@@ -529,6 +550,7 @@ def _Main(argv):
       result = repo._Run(argv) or 0
     finally:
       close_ssh()
+      close_cat_files()
   except KeyboardInterrupt:
     print('aborted by user', file=sys.stderr)
     result = 1
@@ -0,0 +1,174 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Lookups of projects by path, group and pattern.
+
+An index is built once per loaded manifest, so commands that select
+projects do not have to look at every project for every argument.
+"""
+
+import os
+import re
+
+# Patterns that refer to their groups by number or name cannot be joined
+# into one expression.
+_GROUP_REFERENCE_RE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+# Nor can patterns with inline flags: before Python 3.11, flags in the middle
+# of an expression apply to all of it.
+_INLINE_FLAGS_RE = re.compile(r'\(\?[aiLmsux-]')
+
+
+class ManifestIndex(object):
+  """Indexes a list of projects.
+
+  Sets of projects are integers used as bitsets, where bit i stands for
+  the i-th project.  Each part of the index is built when first used, and
+  results are kept for later calls.
+  """
+
+  def __init__(self, projects):
+    self.projects = list(projects)
+    self._positions = dict((id(p), i) for i, p in enumerate(self.projects))
+    self._by_worktree = None
+    self._strings = None
+    self._groups = {}
+    self._group_masks = {}
+    self._searches = {}
+
+  def ByPath(self, path, inside=False):
+    """The project whose work tree is |path|.
+
+    Args:
+      path: An absolute path, with / as separator.
+      inside: Whether to return the project with the longest work tree
+          that contains |path| if there is none at |path|.
+    """
+    if self._by_worktree is None:
+      self._by_worktree = dict((p.worktree, p) for p in self.projects
+                               if p.worktree)
+
+    project = self._by_worktree.get(path)
+    while project is None and inside:
+      parent = os.path.dirname(path)
+      if parent == path:
+        break
+      path = parent
+      project = self._by_worktree.get(path)
+    return project
+
+  def MatchGroups(self, manifest_groups):
+    """The set of projects that Project.MatchesGroups() would accept.
+
+    Groups are resolved in order; a group prefixed with "-" removes the
+    projects in it again.
+    """
+    key = tuple(manifest_groups or ['default'])
+    try:
+      return self._group_masks[key]
+    except KeyError:
+      pass
+    mask = 0
+    for group in key:
+      if group.startswith('-'):
+        # Project groups may also be named "-x".
+        mask = (mask | self._Group(group)) & ~self._Group(group[1:])
+      else:
+        mask |= self._Group(group)
+    self._group_masks[key] = mask
+    return mask
+
+  def _Group(self, group):
+    """The set of projects in |group|."""
+    try:
+      return self._groups[group]
+    except KeyError:
+      pass
+    # Like Project.MatchesGroups(), every project is in "all", and in
+    # "default" unless it is in "notdefault".
+    if group == 'all':
+      mask = (1 << len(self.projects)) - 1
+    else:
+      mask = self._Mask([i for i, p in enumerate(self.projects)
+                         if p.groups and group in p.groups])
+    if group == 'default':
+      mask |= self._Group('all') & ~self._Group('notdefault')
+    self._groups[group] = mask
+    return mask
+
+  def Search(self, patterns):
+    """The set of projects whose name or path matches any of |patterns|.
+
+    Patterns are regular expressions, matched ignoring case anywhere in
+    the name or path.
+    """
+    key = tuple(patterns)
+    try:
+      return self._searches[key]
+    except KeyError:
+      pass
+    if self._strings is None:
+      self._strings = {}
+      for i, project in enumerate(self.projects):
+        self._strings.setdefault(project.name, []).append(i)
+        if project.relpath != project.name:
+          self._strings.setdefault(project.relpath, []).append(i)
+
+    regexes = [re.compile(r'%s' % p, re.IGNORECASE) for p in patterns]
+    if len(regexes) > 1 and not any(_GROUP_REFERENCE_RE.search(p) or
+                                    _INLINE_FLAGS_RE.search(p)
+                                    for p in patterns):
+      try:
+        regexes = [re.compile('|'.join('(?:%s)' % p for p in patterns),
+                              re.IGNORECASE)]
+      except re.error:
+        # For example the same group name in two patterns.
+        pass
+
+    positions = []
+    for regex in regexes:
+      for s in filter(regex.search, self._strings):
+        positions.extend(self._strings[s])
+    mask = self._Mask(positions)
+    self._searches[key] = mask
+    return mask
+
+  def Select(self, mask):
+    """The projects in the set |mask|, in index order."""
+    bits = bin(mask)[:1:-1]
+    result = []
+    i = bits.find('1')
+    while i >= 0:
+      result.append(self.projects[i])
+      i = bits.find('1', i + 1)
+    return result
+
+  def Contains(self, mask, project):
+    """Whether |project| is in the set |mask|."""
+    i = self._positions.get(id(project))
+    return i is not None and bool(mask >> i & 1)
+
+  def _Mask(self, positions):
+    """The set of the projects at |positions|."""
+    if not positions:
+      return 0
+    if len(positions) == 1:
+      return 1 << positions[0]
+    bits = bytearray(b'0' * len(self.projects))
+    for i in positions:
+      bits[i] = ord('1')
+    bits.reverse()
+    return int(bytes(bits), 2)
@@ -20,6 +20,7 @@ import os
 import re
 import sys
 import xml.dom.minidom
+from xml.etree import ElementTree
 
 from pyversion import is_python3
 if is_python3():
@@ -33,14 +34,19 @@ else:
 import gitc_utils
 from git_config import GitConfig
 from git_refs import R_HEADS, HEAD
+from manifest_index import ManifestIndex
 import platform_utils
 from project import RemoteSpec, Project, MetaProject
+import repo_cache
 from error import ManifestParseError, ManifestInvalidRevisionError
 
 MANIFEST_FILE_NAME = 'manifest.xml'
 LOCAL_MANIFEST_NAME = 'local_manifest.xml'
 LOCAL_MANIFESTS_DIR_NAME = 'local_manifests'
 
+# Bump when the model of manifests kept in the repo cache changes.
+_MODEL_VERSION = 1
+
 # urljoin gets confused if the scheme is not known.
 urllib.parse.uses_relative.extend([
     'ssh',
@@ -73,6 +79,53 @@ class _Default(object):
   def __ne__(self, other):
     return self.__dict__ != other.__dict__
 
+class _XmlNode(object):
+  """An element of a manifest file.
+
+  Only keeps the element's name, attributes, children and text, and answers
+  the parts of the minidom interface the parser uses.
+  """
+
+  __slots__ = ('nodeName', 'attributes', 'childNodes', 'text')
+
+  def __init__(self, elem):
+    self.nodeName = elem.tag
+    # Copied, as the element is cleared once read.
+    self.attributes = dict(elem.attrib)
+    self.childNodes = [_XmlNode(e) for e in elem]
+    self.text = elem.text or ''
+
+  def getAttribute(self, name):
+    return self.attributes.get(name, '')
+
+  def hasAttribute(self, name):
+    return name in self.attributes
+
+def _ReadManifestNodes(path):
+  """Yields the children of the <manifest> element of |path|.
+
+  The file is streamed, and each child is dropped from the tree as soon as
+  it is read.
+  """
+  root = None
+  depth = 0
+  try:
+    for event, elem in ElementTree.iterparse(path, events=('start', 'end')):
+      if event == 'start':
+        if root is None:
+          if elem.tag != 'manifest':
+            raise ManifestParseError("no <manifest> in %s" % (path,))
+          root = elem
+        depth += 1
+        continue
+      depth -= 1
+      if depth == 1:
+        node = _XmlNode(elem)
+        root.clear()
+        yield node
+  except (IOError, OSError, ElementTree.ParseError) as e:
+    raise ManifestParseError("error parsing manifest %s: %s" % (path, e))
+
 class _XmlRemote(object):
   def __init__(self,
                name,
@@ -81,7 +134,10 @@ class _XmlRemote(object):
                pushUrl=None,
                manifestUrl=None,
                review=None,
-               revision=None):
+               revision=None,
+               fetchRetries=None,
+               fetchRetryDelay=None,
+               syncJ=None):
     self.name = name
     self.fetchUrl = fetch
     self.pushUrl = pushUrl
@@ -89,6 +145,9 @@ class _XmlRemote(object):
     self.remoteAlias = alias
     self.reviewUrl = review
     self.revision = revision
+    self.fetchRetries = fetchRetries
+    self.fetchRetryDelay = fetchRetryDelay
+    self.syncJ = syncJ
     self.resolvedFetchUrl = self._resolveFetchUrl()
 
   def __eq__(self, other):
@@ -119,6 +178,20 @@ class _XmlRemote(object):
       url = urllib.parse.urljoin(manifestUrl, url)
     return url
 
+  def ToModel(self):
+    """The arguments to recreate this remote from the manifest cache."""
+    return {
+        'name': self.name,
+        'alias': self.remoteAlias,
+        'fetch': self.fetchUrl,
+        'pushUrl': self.pushUrl,
+        'review': self.reviewUrl,
+        'revision': self.revision,
+        'fetchRetries': self.fetchRetries,
+        'fetchRetryDelay': self.fetchRetryDelay,
+        'syncJ': self.syncJ,
+    }
+
   def ToRemoteSpec(self, projectName):
     fetchUrl = self.resolvedFetchUrl.rstrip('/')
     url = fetchUrl + '/' + projectName
@@ -130,7 +203,10 @@ class _XmlRemote(object):
                       pushUrl=self.pushUrl,
                       review=self.reviewUrl,
                       orig_name=self.name,
-                      fetchUrl=self.fetchUrl)
+                      fetchUrl=self.fetchUrl,
+                      fetchRetries=self.fetchRetries,
+                      fetchRetryDelay=self.fetchRetryDelay,
+                      syncJ=self.syncJ)
 
 class XmlManifest(object):
   """manages the repo configuration file"""
@@ -140,6 +216,7 @@ class XmlManifest(object):
     self.topdir = os.path.dirname(self.repodir)
     self.manifestFile = os.path.join(self.repodir, MANIFEST_FILE_NAME)
     self.globalConfig = GitConfig.ForUser()
+    self.cache = repo_cache.Open(self.repodir)
     self.localManifestWarning = False
     self.isGitcClient = False
     self._load_local_manifests = True
@@ -205,6 +282,12 @@ class XmlManifest(object):
       e.setAttribute('review', r.reviewUrl)
     if r.revision is not None:
       e.setAttribute('revision', r.revision)
+    if r.fetchRetries is not None:
+      e.setAttribute('fetch-retries', str(r.fetchRetries))
+    if r.fetchRetryDelay is not None:
+      e.setAttribute('fetch-retry-delay', str(r.fetchRetryDelay))
+    if r.syncJ is not None:
+      e.setAttribute('sync-j', str(r.syncJ))
 
   def _ParseGroups(self, groups):
     return [x for x in re.split(r'[,\s]+', groups) if x]
@@ -394,6 +477,14 @@ class XmlManifest(object):
     self._Load()
     return list(self._paths.values())
 
+  @property
+  def index(self):
+    """The ManifestIndex of the projects, built on first use."""
+    self._Load()
+    if self._index is None:
+      self._index = ManifestIndex(self._paths.values())
+    return self._index
+
   @property
   def remotes(self):
     self._Load()
@@ -435,6 +526,7 @@ class XmlManifest(object):
     self._loaded = False
     self._projects = {}
     self._paths = {}
+    self._index = None
     self._remotes = {}
     self._default = None
     self._repo_hooks_project = None
@@ -450,33 +542,8 @@ class XmlManifest(object):
         b = b[len(R_HEADS):]
       self.branch = b
 
-      nodes = []
-      nodes.append(self._ParseManifestXml(self.manifestFile,
-                                          self.manifestProject.worktree))
-
-      if self._load_local_manifests:
-        local = os.path.join(self.repodir, LOCAL_MANIFEST_NAME)
-        if os.path.exists(local):
-          if not self.localManifestWarning:
-            self.localManifestWarning = True
-            print('warning: %s is deprecated; put local manifests '
-                  'in `%s` instead' % (LOCAL_MANIFEST_NAME,
-                  os.path.join(self.repodir, LOCAL_MANIFESTS_DIR_NAME)),
-                  file=sys.stderr)
-          nodes.append(self._ParseManifestXml(local, self.repodir))
-
-        local_dir = os.path.abspath(os.path.join(self.repodir,
-                                    LOCAL_MANIFESTS_DIR_NAME))
-        try:
-          for local_file in sorted(platform_utils.listdir(local_dir)):
-            if local_file.endswith('.xml'):
-              local = os.path.join(local_dir, local_file)
-              nodes.append(self._ParseManifestXml(local, self.repodir))
-        except OSError:
-          pass
-
       try:
-        self._ParseManifest(nodes)
+        self._BuildModel(self._LoadModel())
       except ManifestParseError as e:
         # There was a problem parsing, unload ourselves in case they catch
         # this error and try again later, we will show the correct error
@@ -489,23 +556,70 @@ class XmlManifest(object):
 
       self._loaded = True
 
-  def _ParseManifestXml(self, path, include_root):
-    try:
-      root = xml.dom.minidom.parse(path)
-    except (OSError, xml.parsers.expat.ExpatError) as e:
-      raise ManifestParseError("error parsing manifest %s: %s" % (path, e))
+  def _LoadModel(self):
+    """The manifest compiled into plain data, see _ParseManifest.
 
-    if not root or not root.childNodes:
-      raise ManifestParseError("no root node in %s" % (path,))
+    The model only depends on the manifest files, and is kept in the repo
+    cache until one of them changes.
+    """
+    local = os.path.join(self.repodir, LOCAL_MANIFEST_NAME)
+    local_dir = os.path.join(self.repodir, LOCAL_MANIFESTS_DIR_NAME)
+    roots = [self.manifestFile]
+    if self._load_local_manifests:
+      roots.extend([local, local_dir])
+      if os.path.exists(local):
+        if not self.localManifestWarning:
+          self.localManifestWarning = True
+          print('warning: %s is deprecated; put local manifests '
+                'in `%s` instead' % (LOCAL_MANIFEST_NAME, local_dir),
+                file=sys.stderr)
+
+    # The stamp of the files that decide which files are read at all; the
+    # entry also records the stamps of all files that were read.
+    key = '%s %d' % (self.manifestFile, self._load_local_manifests)
+    stamp = repo_cache.FileStamp(*roots)
+    if stamp is not None:
+      stamp = '%d %s' % (_MODEL_VERSION, stamp)
+    if self.cache:
+      entry = self.cache.Get('manifest', key, stamp)
+      if entry and repo_cache.FileStamp(*entry['files']) == entry['stamp']:
+        return entry['model']
+
+    files = []
+    nodes = []
+    nodes.append(self._ParseManifestXml(self.manifestFile,
+                                        self.manifestProject.worktree,
+                                        files=files))
 
-    for manifest in root.childNodes:
-      if manifest.nodeName == 'manifest':
-        break
-    else:
-      raise ManifestParseError("no <manifest> in %s" % (path,))
+    if self._load_local_manifests:
+      if os.path.exists(local):
+        nodes.append(self._ParseManifestXml(local, self.repodir, files=files))
+
+      try:
+        for local_file in sorted(platform_utils.listdir(local_dir)):
+          if local_file.endswith('.xml'):
+            nodes.append(self._ParseManifestXml(
+                os.path.join(local_dir, local_file), self.repodir,
+                files=files))
+      except OSError:
+        pass
+
+    model = self._ParseManifest(nodes)
+    if self.cache and None not in [s for _, s in files]:
+      self.cache.Put('manifest', key, stamp, {
+          'files': [f for f, _ in files],
+          'stamp': ' '.join(s for _, s in files),
+          'model': model,
+      })
+    return model
+
+  def _ParseManifestXml(self, path, include_root, files=None):
+    if files is not None:
+      # Taken before the file is read, so later changes are noticed.
+      files.append((path, repo_cache.FileStamp(path)))
 
     nodes = []
-    for node in manifest.childNodes:
+    for node in _ReadManifestNodes(path):
       if node.nodeName == 'include':
         name = self._reqatt(node, 'name')
         fp = os.path.join(include_root, name)
@@ -513,7 +627,7 @@ class XmlManifest(object):
           raise ManifestParseError("include %s doesn't exist or isn't a file"
               % (name,))
         try:
-          nodes.extend(self._ParseManifestXml(fp, include_root))
+          nodes.extend(self._ParseManifestXml(fp, include_root, files=files))
         # should isolate this to the exact exception, but that's
         # tricky.  actual parsing implementation may vary.
         except (KeyboardInterrupt, RuntimeError, SystemExit):
@@ -526,70 +640,84 @@ class XmlManifest(object):
     return nodes
 
   def _ParseManifest(self, node_list):
-    for node in itertools.chain(*node_list):
-      if node.nodeName == 'remote':
-        remote = self._ParseRemote(node)
-        if remote:
-          if remote.name in self._remotes:
-            if remote != self._remotes[remote.name]:
-              raise ManifestParseError(
-                  'remote %s already exists with different attributes' %
-                  (remote.name))
-          else:
-            self._remotes[remote.name] = remote
+    """Compiles the parsed manifest files into a model of plain data.
 
+    Projects are kept as records (see _ParseProject) so the model can be
+    stored as JSON; _BuildModel turns it into Project objects.
+    """
+    # Sort the elements by kind in a single walk; all remotes must be known
+    # before the default and the projects refer to them.
+    kinds = ('remote', 'default', 'notice', 'manifest-server')
+    nodes = dict((kind, []) for kind in kinds)
+    project_nodes = []
     for node in itertools.chain(*node_list):
-      if node.nodeName == 'default':
-        new_default = self._ParseDefault(node)
-        if self._default is None:
-          self._default = new_default
-        elif new_default != self._default:
-          raise ManifestParseError('duplicate default in %s' %
-                                   (self.manifestFile))
+      nodes.get(node.nodeName, project_nodes).append(node)
+
+    for node in nodes['remote']:
+      remote = self._ParseRemote(node)
+      if remote:
+        if remote.name in self._remotes:
+          if remote != self._remotes[remote.name]:
+            raise ManifestParseError(
+                'remote %s already exists with different attributes' %
+                (remote.name))
+        else:
+          self._remotes[remote.name] = remote
+
+    for node in nodes['default']:
+      new_default = self._ParseDefault(node)
+      if self._default is None:
+        self._default = new_default
+      elif new_default != self._default:
+        raise ManifestParseError('duplicate default in %s' %
+                                 (self.manifestFile))
 
     if self._default is None:
       self._default = _Default()
 
-    for node in itertools.chain(*node_list):
-      if node.nodeName == 'notice':
-        if self._notice is not None:
-          raise ManifestParseError(
-              'duplicate notice in %s' %
-              (self.manifestFile))
-        self._notice = self._ParseNotice(node)
+    for node in nodes['notice']:
+      if self._notice is not None:
+        raise ManifestParseError(
+            'duplicate notice in %s' %
+            (self.manifestFile))
+      self._notice = self._ParseNotice(node)
 
-    for node in itertools.chain(*node_list):
-      if node.nodeName == 'manifest-server':
-        url = self._reqatt(node, 'url')
-        if self._manifest_server is not None:
-          raise ManifestParseError(
-              'duplicate manifest-server in %s' %
-              (self.manifestFile))
-        self._manifest_server = url
+    for node in nodes['manifest-server']:
+      url = self._reqatt(node, 'url')
+      if self._manifest_server is not None:
+        raise ManifestParseError(
+            'duplicate manifest-server in %s' %
+            (self.manifestFile))
+      self._manifest_server = url
+
+    records = []
+    projects = {}
+    paths = {}
+    repo_hooks = None
 
-    def recursively_add_projects(project):
-      projects = self._projects.setdefault(project.name, [])
-      if project.relpath is None:
+    def recursively_add_projects(record):
+      if record['relpath'] is None:
         raise ManifestParseError(
             'missing path for %s in %s' %
-            (project.name, self.manifestFile))
-      if project.relpath in self._paths:
+            (record['name'], self.manifestFile))
+      if record['relpath'] in paths:
         raise ManifestParseError(
             'duplicate path %s in %s' %
-            (project.relpath, self.manifestFile))
-      self._paths[project.relpath] = project
-      projects.append(project)
-      for subproject in project.subprojects:
-        recursively_add_projects(subproject)
+            (record['relpath'], self.manifestFile))
+      paths[record['relpath']] = record
+      projects.setdefault(record['name'], []).append(record)
+      for subrecord in record['subprojects']:
+        recursively_add_projects(subrecord)
 
-    for node in itertools.chain(*node_list):
+    for node in project_nodes:
       if node.nodeName == 'project':
-        project = self._ParseProject(node)
-        recursively_add_projects(project)
+        record = self._ParseProject(node)
+        recursively_add_projects(record)
+        records.append(record)
       if node.nodeName == 'extend-project':
         name = self._reqatt(node, 'name')
 
-        if name not in self._projects:
+        if name not in projects:
           raise ManifestParseError('extend-project element specifies non-existent '
                                    'project: %s' % name)
 
@@ -599,27 +727,27 @@ class XmlManifest(object):
           groups = self._ParseGroups(groups)
         revision = node.getAttribute('revision')
 
-        for p in self._projects[name]:
-          if path and p.relpath != path:
+        for p in projects[name]:
+          if path and p['relpath'] != path:
             continue
           if groups:
-            p.groups.extend(groups)
+            p['groups'].extend(groups)
           if revision:
-            p.revisionExpr = revision
+            p['revision'] = revision
       if node.nodeName == 'repo-hooks':
         # Get the name of the project and the (space-separated) list of enabled.
         repo_hooks_project = self._reqatt(node, 'in-project')
         enabled_repo_hooks = self._reqatt(node, 'enabled-list').split()
 
         # Only one project can be the hooks project
-        if self._repo_hooks_project is not None:
+        if repo_hooks is not None:
           raise ManifestParseError(
               'duplicate repo-hooks in %s' %
               (self.manifestFile))
 
-        # Store a reference to the Project.
+        # Find the record of the project.
         try:
-          repo_hooks_projects = self._projects[repo_hooks_project]
+          repo_hooks_projects = projects[repo_hooks_project]
         except KeyError:
           raise ManifestParseError(
               'project %s not found for repo-hooks' %
@@ -629,26 +757,127 @@ class XmlManifest(object):
           raise ManifestParseError(
               'internal error parsing repo-hooks in %s' %
               (self.manifestFile))
-        self._repo_hooks_project = repo_hooks_projects[0]
+        repo_hooks = repo_hooks_projects[0]
 
-        # Store the enabled hooks in the Project object.
-        self._repo_hooks_project.enabled_repo_hooks = enabled_repo_hooks
+        # Store the enabled hooks in the record.
+        repo_hooks['enabled_repo_hooks'] = enabled_repo_hooks
       if node.nodeName == 'remove-project':
         name = self._reqatt(node, 'name')
 
-        if name not in self._projects:
+        if name not in projects:
           raise ManifestParseError('remove-project element specifies non-existent '
                                    'project: %s' % name)
 
-        for p in self._projects[name]:
-          del self._paths[p.relpath]
-        del self._projects[name]
+        # The records stay in the tree of their parent project.
+        for p in projects[name]:
+          p['removed'] = True
+          del paths[p['relpath']]
+        del projects[name]
 
         # If the manifest removes the hooks project, treat it as if it deleted
         # the repo-hooks element too.
-        if self._repo_hooks_project and (self._repo_hooks_project.name == name):
-          self._repo_hooks_project = None
+        if repo_hooks and (repo_hooks['name'] == name):
+          del repo_hooks['enabled_repo_hooks']
+          repo_hooks = None
+
+    d = self._default
+    return {
+        'remotes': [r.ToModel() for r in self._remotes.values()],
+        'default': {
+            'remote': d.remote.name if d.remote else None,
+            'revisionExpr': d.revisionExpr,
+            'destBranchExpr': d.destBranchExpr,
+            'upstreamExpr': d.upstreamExpr,
+            'sync_j': d.sync_j,
+            'sync_c': d.sync_c,
+            'sync_s': d.sync_s,
+            'sync_tags': d.sync_tags,
+        },
+        'notice': self._notice,
+        'manifest_server': self._manifest_server,
+        'projects': records,
+    }
+
+  def _BuildModel(self, model):
+    """Creates the remotes and projects of a model from _ParseManifest."""
+    manifestUrl = self.manifestProject.config.GetString('remote.origin.url')
+    self._remotes = {}
+    for r in model['remotes']:
+      remote = _XmlRemote(manifestUrl=manifestUrl,
+                          **dict((str(k), v) for k, v in r.items()))
+      self._remotes[remote.name] = remote
+
+    self._default = _Default()
+    for k, v in model['default'].items():
+      setattr(self._default, str(k), v)
+    if self._default.remote is not None:
+      self._default.remote = self._remotes[self._default.remote]
+
+    self._notice = model['notice']
+    self._manifest_server = model['manifest_server']
+    self._projects = {}
+    self._paths = {}
+    self._repo_hooks_project = None
+    mirror = self.IsMirror
+    for record in model['projects']:
+      self._BuildProject(record, mirror)
+
+  def _BuildProject(self, record, mirror, parent=None):
+    """Creates the Project of a record from _ParseProject."""
+    name = record['name']
+    if parent is None:
+      relpath, worktree, gitdir, objdir = \
+          self.GetProjectPaths(name, record['path'])
+    else:
+      relpath, worktree, gitdir, objdir = \
+          self.GetSubprojectPaths(parent, name, record['path'])
 
+    if mirror and record['force_path']:
+      gitdir = os.path.join(self.topdir, '%s.git' % record['path'])
+
+    remote = self._remotes[record['remote']]
+    extra_proj_attrs = dict((str(k), v) for k, v in record['extra'].items())
+    project = Project(manifest = self,
+                      name = name,
+                      remote = remote.ToRemoteSpec(name),
+                      gitdir = gitdir,
+                      objdir = objdir,
+                      worktree = worktree,
+                      relpath = relpath,
+                      revisionExpr = record['revision'],
+                      revisionId = None,
+                      rebase = record['rebase'],
+                      groups = list(record['groups']),
+                      sync_c = record['sync_c'],
+                      sync_s = record['sync_s'],
+                      sync_tags = record['sync_tags'],
+                      clone_depth = record['clone_depth'],
+                      upstream = record['upstream'],
+                      parent = parent,
+                      dest_branch = record['dest_branch'],
+                      **extra_proj_attrs)
+
+    if not mirror:
+      # src is project relative;
+      # dest is relative to the top of the tree
+      for src, dest in record['copyfiles']:
+        project.AddCopyFile(src, dest, os.path.join(self.topdir, dest))
+      for src, dest in record['linkfiles']:
+        project.AddLinkFile(src, dest, os.path.join(self.topdir, dest))
+    for annotation in record['annotations']:
+      project.AddAnnotation(*annotation)
+
+    if not record.get('removed'):
+      self._projects.setdefault(project.name, []).append(project)
+      self._paths[project.relpath] = project
+      if 'enabled_repo_hooks' in record:
+        self._repo_hooks_project = project
+        project.enabled_repo_hooks = record['enabled_repo_hooks']
+
+    for subrecord in record['subprojects']:
+      project.subprojects.append(
+          self._BuildProject(subrecord, mirror, project))
+    return project
 
   def _AddMetaProjectMirror(self, m):
     name = None
@@ -706,8 +935,26 @@ class XmlManifest(object):
     revision = node.getAttribute('revision')
     if revision == '':
       revision = None
+    fetchRetries = self._ParseRemoteInt(node, 'fetch-retries')
+    fetchRetryDelay = self._ParseRemoteInt(node, 'fetch-retry-delay')
+    syncJ = self._ParseRemoteInt(node, 'sync-j', minimum=1)
     manifestUrl = self.manifestProject.config.GetString('remote.origin.url')
-    return _XmlRemote(name, alias, fetch, pushUrl, manifestUrl, review, revision)
+    return _XmlRemote(name, alias, fetch, pushUrl, manifestUrl, review,
+                      revision, fetchRetries, fetchRetryDelay, syncJ)
+
+  def _ParseRemoteInt(self, node, attname, minimum=0):
+    """Reads an optional integer attribute of a <remote>."""
+    value = node.getAttribute(attname)
+    if not value:
+      return None
+    try:
+      value = int(value)
+      if value < minimum:
+        raise ValueError()
+    except ValueError:
+      raise ManifestParseError('invalid %s %s in %s' %
+                               (attname, value, self.manifestFile))
+    return value
 
   def _ParseDefault(self, node):
     """
@@ -761,7 +1008,7 @@ class XmlManifest(object):
       http://www.python.org/dev/peps/pep-0257/
     """
     # Get the data out of the node...
-    notice = node.childNodes[0].data
+    notice = node.text
 
     # Figure out minimum indentation, skipping the first line (the same line
     # as the <notice> tag)...
@@ -794,11 +1041,12 @@ class XmlManifest(object):
 
   def _ParseProject(self, node, parent = None, **extra_proj_attrs):
     """
-    reads a <project> element from the manifest file
+    reads a <project> element from the manifest file into a record of
+    plain data, from which _BuildProject creates the Project
     """
     name = self._reqatt(node, 'name')
     if parent:
-      name = self._JoinName(parent.name, name)
+      name = self._JoinName(parent['name'], name)
 
     remote = self._get_remote(node)
     if remote is None:
@@ -865,49 +1113,48 @@ class XmlManifest(object):
     groups = self._ParseGroups(groups)
 
     if parent is None:
-      relpath, worktree, gitdir, objdir = self.GetProjectPaths(name, path)
+      relpath = path
     else:
-      relpath, worktree, gitdir, objdir = \
-          self.GetSubprojectPaths(parent, name, path)
+      relpath = self._JoinRelpath(parent['relpath'], path)
 
     default_groups = ['all', 'name:%s' % name, 'path:%s' % relpath]
     groups.extend(set(default_groups).difference(groups))
 
-    if self.IsMirror and node.hasAttribute('force-path'):
-      if node.getAttribute('force-path').lower() in ("yes", "true", "1"):
-        gitdir = os.path.join(self.topdir, '%s.git' % path)
-
-    project = Project(manifest = self,
-                      name = name,
-                      remote = remote.ToRemoteSpec(name),
-                      gitdir = gitdir,
-                      objdir = objdir,
-                      worktree = worktree,
-                      relpath = relpath,
-                      revisionExpr = revisionExpr,
-                      revisionId = None,
-                      rebase = rebase,
-                      groups = groups,
-                      sync_c = sync_c,
-                      sync_s = sync_s,
-                      sync_tags = sync_tags,
-                      clone_depth = clone_depth,
-                      upstream = upstream,
-                      parent = parent,
-                      dest_branch = dest_branch,
-                      **extra_proj_attrs)
+    force_path = node.getAttribute('force-path').lower() in ("yes", "true", "1")
+
+    record = {
+        'name': name,
+        'path': path,
+        'relpath': relpath,
+        'remote': remote.name,
+        'revision': revisionExpr,
+        'rebase': rebase,
+        'groups': groups,
+        'sync_c': sync_c,
+        'sync_s': sync_s,
+        'sync_tags': sync_tags,
+        'clone_depth': clone_depth or None,
+        'upstream': upstream,
+        'dest_branch': dest_branch,
+        'force_path': force_path,
+        'extra': extra_proj_attrs,
+        'copyfiles': [],
+        'linkfiles': [],
+        'annotations': [],
+        'subprojects': [],
+    }
 
     for n in node.childNodes:
       if n.nodeName == 'copyfile':
-        self._ParseCopyFile(project, n)
+        record['copyfiles'].append(self._ParseCopyFile(n))
       if n.nodeName == 'linkfile':
-        self._ParseLinkFile(project, n)
+        record['linkfiles'].append(self._ParseLinkFile(n))
       if n.nodeName == 'annotation':
-        self._ParseAnnotation(project, n)
+        record['annotations'].append(self._ParseAnnotation(n))
       if n.nodeName == 'project':
-        project.subprojects.append(self._ParseProject(n, parent = project))
+        record['subprojects'].append(self._ParseProject(n, parent = record))
 
-    return project
+    return record
 
   def GetProjectPaths(self, name, path):
     relpath = path
@@ -943,23 +1190,17 @@ class XmlManifest(object):
       worktree = os.path.join(parent.worktree, path).replace('\\', '/')
     return relpath, worktree, gitdir, objdir
 
-  def _ParseCopyFile(self, project, node):
+  def _ParseCopyFile(self, node):
     src = self._reqatt(node, 'src')
     dest = self._reqatt(node, 'dest')
-    if not self.IsMirror:
-      # src is project relative;
-      # dest is relative to the top of the tree
-      project.AddCopyFile(src, dest, os.path.join(self.topdir, dest))
+    return [src, dest]
 
-  def _ParseLinkFile(self, project, node):
+  def _ParseLinkFile(self, node):
     src = self._reqatt(node, 'src')
     dest = self._reqatt(node, 'dest')
-    if not self.IsMirror:
-      # src is project relative;
-      # dest is relative to the top of the tree
-      project.AddLinkFile(src, dest, os.path.join(self.topdir, dest))
+    return [src, dest]
 
-  def _ParseAnnotation(self, project, node):
+  def _ParseAnnotation(self, node):
     name = self._reqatt(node, 'name')
     value = self._reqatt(node, 'value')
     try:
@@ -969,7 +1210,7 @@ class XmlManifest(object):
     if keep != "true" and keep != "false":
       raise ManifestParseError('optional "keep" attribute must be '
             '"true" or "false"')
-    project.AddAnnotation(name, value, keep)
+    return [name, value, keep]
 
   def _get_remote(self, node):
     name = node.getAttribute('remote')
@@ -30,13 +30,20 @@ import tempfile
 import time
 import traceback
 
+try:
+  import threading as _threading
+except ImportError:
+  import dummy_threading as _threading
+
 from color import Coloring
-from git_command import GitCommand, git_require
+from git_command import GitCommand, git_require, cat_file, close_cat_files
 from git_config import GitConfig, IsId, GetSchemeFromUrl, GetUrlCookieFile, \
     ID_RE
 from error import GitError, HookError, UploadError, DownloadError
 from error import ManifestInvalidRevisionError
 from error import NoManifestException
+import git_index
+import git_objects
 import platform_utils
 from trace import IsTrace, Trace
 
@@ -52,6 +59,9 @@ else:
   urllib.parse = urlparse
   input = raw_input
 
+# Guards the creation of the per-project objects that keep state.
+_lazy_lock = _threading.Lock()
+
 
 def _lwrite(path, content):
   lock = '%s.lock' % path
@@ -328,6 +338,11 @@ class _LinkFile(object):
 
 class RemoteSpec(object):
 
+  # Failed fetches are retried this many times by default, waiting
+  # DEFAULT_FETCH_RETRY_DELAY seconds (doubled on every further attempt).
+  DEFAULT_FETCH_RETRIES = 1
+  DEFAULT_FETCH_RETRY_DELAY = 30
+
   def __init__(self,
                name,
                url=None,
@@ -335,7 +350,10 @@ class RemoteSpec(object):
                review=None,
                revision=None,
                orig_name=None,
-               fetchUrl=None):
+               fetchUrl=None,
+               fetchRetries=None,
+               fetchRetryDelay=None,
+               syncJ=None):
     self.name = name
     self.url = url
     self.pushUrl = pushUrl
@@ -343,6 +361,22 @@ class RemoteSpec(object):
     self.revision = revision
     self.orig_name = orig_name
     self.fetchUrl = fetchUrl
+    if fetchRetries is None:
+      fetchRetries = self.DEFAULT_FETCH_RETRIES
+    if fetchRetryDelay is None:
+      fetchRetryDelay = self.DEFAULT_FETCH_RETRY_DELAY
+    self.fetchRetries = fetchRetries
+    self.fetchRetryDelay = fetchRetryDelay
+    self.syncJ = syncJ
+
+  def RetryDelay(self, attempt):
+    """Seconds to wait before retry number |attempt| (starting at 1).
+
+    The delay grows exponentially and has up to 50% of random jitter added,
+    so that projects failing together do not all retry at the same time.
+    """
+    delay = self.fetchRetryDelay * 2 ** (attempt - 1)
+    return delay + random.uniform(0, delay / 2.0)
 
 
 class RepoHook(object):
@@ -731,23 +765,66 @@ class Project(object):
     self.copyfiles = []
     self.linkfiles = []
     self.annotations = []
-    self.config = GitConfig.ForRepository(gitdir=self.gitdir,
-                                          defaults=self.manifest.globalConfig)
 
-    if self.worktree:
-      self.work_git = self._GitGetByExec(self, bare=False, gitdir=gitdir)
-    else:
-      self.work_git = None
-    self.bare_git = self._GitGetByExec(self, bare=True, gitdir=gitdir)
-    self.bare_ref = GitRefs(gitdir)
-    self.bare_objdir = self._GitGetByExec(self, bare=True, gitdir=objdir)
+    # Created on first use, see the properties below.
+    self._config = None
+    self._work_git = None
+    self._bare_git = None
+    self._bare_ref = None
+    self._bare_objdir = None
+
     self.dest_branch = dest_branch
     self.old_revision = old_revision
 
+    # Whether the last Sync_NetworkHalf() fetched from the remote.
+    self.network_fetched = False
+
     # This will be filled in if a project is later identified to be the
     # project containing repo hooks.
     self.enabled_repo_hooks = []
 
+  # A manifest has many projects, but most commands only run git in a few of
+  # them; the objects to access a project's repository are created when the
+  # project is first used, not when the manifest is loaded.
+
+  @property
+  def config(self):
+    if self._config is None:
+      with _lazy_lock:
+        if self._config is None:
+          self._config = GitConfig.ForRepository(
+              gitdir=self.gitdir,
+              defaults=self.manifest.globalConfig,
+              cache=self.manifest.cache)
+    return self._config
+
+  @property
+  def work_git(self):
+    if self._work_git is None and self.worktree:
+      self._work_git = self._GitGetByExec(self, bare=False, gitdir=self.gitdir)
+    return self._work_git
+
+  @property
+  def bare_git(self):
+    if self._bare_git is None:
+      self._bare_git = self._GitGetByExec(self, bare=True, gitdir=self.gitdir)
+    return self._bare_git
+
+  @property
+  def bare_ref(self):
+    if self._bare_ref is None:
+      with _lazy_lock:
+        if self._bare_ref is None:
+          self._bare_ref = GitRefs(self.gitdir, cache=self.manifest.cache)
+    return self._bare_ref
+
+  @property
+  def bare_objdir(self):
+    if self._bare_objdir is None:
+      self._bare_objdir = self._GitGetByExec(self, bare=True,
+                                             gitdir=self.objdir)
+    return self._bare_objdir
+
   @property
   def Derived(self):
     return self.is_derived
@@ -777,18 +854,62 @@ class Project(object):
   def IsDirty(self, consider_untracked=True):
     """Is the working directory modified in some way?
     """
-    self.work_git.update_index('-q',
-                               '--unmerged',
-                               '--ignore-missing',
-                               '--refresh')
-    if self.work_git.DiffZ('diff-index', '-M', '--cached', HEAD):
+    maybe = self.PossiblyDirty(consider_untracked)
+    if 'worktree' in maybe:
+      self.work_git.update_index('-q',
+                                 '--unmerged',
+                                 '--ignore-missing',
+                                 '--refresh')
+    if 'index' in maybe and \
+       self.work_git.DiffZ('diff-index', '-M', '--cached', HEAD):
       return True
-    if self.work_git.DiffZ('diff-files'):
+    if 'worktree' in maybe and self.work_git.DiffZ('diff-files'):
       return True
-    if consider_untracked and self.work_git.LsOthers():
+    if 'untracked' in maybe and self.work_git.LsOthers():
       return True
     return False
 
+  def PossiblyDirty(self, consider_untracked=True):
+    """Tell which checks git has to make to know if the work tree is dirty.
+
+    Only the index is read and files are stat'ed, git does not run.
+
+    Returns:
+      A set of 'index' if the index may differ from HEAD, 'worktree' if
+      files may differ from the index, and 'untracked' if there may be
+      untracked files.  It is empty if the work tree is certainly clean.
+    """
+    index = git_index.ReadIndex(os.path.join(self.worktree, '.git', 'index'))
+    if index is None:
+      maybe = set(['index', 'worktree', 'untracked'])
+    else:
+      maybe = set()
+      if not index.tree or index.tree != self._HeadTree():
+        maybe.add('index')
+      if git_index.ChangedEntries(self.worktree, index):
+        maybe.add('worktree')
+      if git_index.HasUnknownFiles(self.worktree, index):
+        maybe.add('untracked')
+    if not consider_untracked:
+      maybe.discard('untracked')
+    return maybe
+
+  def _HeadTree(self):
+    """The tree id of the commit checked out in the work tree, or None."""
+    try:
+      head = self.work_git.GetHead()
+    except NoManifestException:
+      return None
+    if not IsId(head):
+      head = self.bare_ref.get(head)
+    if not head:
+      return None
+    obj = git_objects.ReadObject(self.gitdir, head)
+    if obj and obj[0] == 'commit' and obj[1].startswith(b'tree '):
+      return obj[1][5:45].decode('utf-8')
+    info = self._ObjectInfo('%s^{tree}' % head)
+    return info[0] if info else None
+
   _userident_name = None
   _userident_email = None
 
@@ -892,30 +1013,35 @@ class Project(object):
                uncommitted files is detected.
     """
     details = []
-    self.work_git.update_index('-q',
-                               '--unmerged',
-                               '--ignore-missing',
-                               '--refresh')
+    maybe = self.PossiblyDirty()
+    if 'worktree' in maybe:
+      self.work_git.update_index('-q',
+                                 '--unmerged',
+                                 '--ignore-missing',
+                                 '--refresh')
     if self.IsRebaseInProgress():
       details.append("rebase in progress")
       if not get_all:
         return details
 
-    changes = self.work_git.DiffZ('diff-index', '--cached', HEAD).keys()
-    if changes:
-      details.extend(changes)
-      if not get_all:
-        return details
-
-    changes = self.work_git.DiffZ('diff-files').keys()
-    if changes:
-      details.extend(changes)
-      if not get_all:
-        return details
-
-    changes = self.work_git.LsOthers()
-    if changes:
-      details.extend(changes)
+    if 'index' in maybe:
+      changes = self.work_git.DiffZ('diff-index', '--cached', HEAD).keys()
+      if changes:
+        details.extend(changes)
+        if not get_all:
+          return details
+
+    if 'worktree' in maybe:
+      changes = self.work_git.DiffZ('diff-files').keys()
+      if changes:
+        details.extend(changes)
+        if not get_all:
+          return details
+
+    if 'untracked' in maybe:
+      changes = self.work_git.LsOthers()
+      if changes:
+        details.extend(changes)
 
     return details
 
@@ -927,13 +1053,28 @@ class Project(object):
     else:
       return False
 
-  def PrintWorkTreeStatus(self, output_redir=None, quiet=False):
+  def WorkTreeStatusQueries(self):
+    """The git commands whose results PrintWorkTreeStatus() can be given.
+
+    The first one refreshes the index, and must have finished before the
+    others are run.
+    """
+    return [['update-index', '-q', '--unmerged', '--ignore-missing',
+             '--refresh'],
+            _DiffZCommand('diff-index', '-M', '--cached', HEAD),
+            _DiffZCommand('diff-files'),
+            _LS_OTHERS]
+
+  def PrintWorkTreeStatus(self, output_redir=None, quiet=False, results=None):
     """Prints the status of the repository to stdout.
 
     Args:
       output: If specified, redirect the output to this object.
       quiet:  If True then only print the project name.  Do not print
               the modified files, branch name, etc.
+      results: The (exit status, stdout, stderr) of the commands from
+              WorkTreeStatusQueries(), after the first, if they were already
+              run.
     """
     if not platform_utils.isdir(self.worktree):
       if output_redir is None:
@@ -943,14 +1084,26 @@ class Project(object):
       print('  missing (run "repo sync")', file=output_redir)
       return
 
-    self.work_git.update_index('-q',
-                               '--unmerged',
-                               '--ignore-missing',
-                               '--refresh')
+    if results is None:
+      maybe = self.PossiblyDirty()
+      if 'worktree' in maybe:
+        self.work_git.update_index('-q',
+                                   '--unmerged',
+                                   '--ignore-missing',
+                                   '--refresh')
+      di = df = {}
+      do = []
+      if 'index' in maybe:
+        di = self.work_git.DiffZ('diff-index', '-M', '--cached', HEAD)
+      if 'worktree' in maybe:
+        df = self.work_git.DiffZ('diff-files')
+      if 'untracked' in maybe:
+        do = self.work_git.LsOthers()
+    else:
+      di = _ParseDiffZ(_SplitZ(results[0][1]))
+      df = _ParseDiffZ(_SplitZ(results[1][1]))
+      do = _SplitZ(results[2][1]) if results[2][0] == 0 else []
     rb = self.IsRebaseInProgress()
-    di = self.work_git.DiffZ('diff-index', '-M', '--cached', HEAD)
-    df = self.work_git.DiffZ('diff-files')
-    do = self.work_git.LsOthers()
     if not rb and not di and not df and not do and not self.CurrentBranch:
       return 'CLEAN'
 
@@ -1035,14 +1188,13 @@ class Project(object):
                    capture_stdout=True,
                    capture_stderr=True)
     has_diff = False
-    for line in p.process.stdout:
+    for line in p.Records():
       if not has_diff:
         out.nl()
         out.project('project %s/' % self.relpath)
         out.nl()
         has_diff = True
-      print(line[:-1])
-    p.Wait()
+      print(line)
 
 
 # Publish / Upload ##
@@ -1077,10 +1229,12 @@ class Project(object):
       elif name.startswith(R_PUB):
         canrm[name] = ref_id
 
-    for name, ref_id in canrm.items():
+    t = self.bare_git.RefTransaction()
+    for name, ref_id in sorted(canrm.items()):
       n = name[len(R_PUB):]
       if R_HEADS + n not in heads:
-        self.bare_git.DeleteRef(name, ref_id)
+        t.Delete(name, ref_id)
+    t.Commit()
 
   def GetUploadableBranches(self, selected_branch=None):
     """List any branches which can be uploaded for review.
@@ -1226,10 +1380,28 @@ class Project(object):
                        archive=False,
                        optimized_fetch=False,
                        prune=False,
-                       submodules=False):
+                       submodules=False,
+                       remote_refs=None,
+                       retry_fetches=None,
+                       fetched_sibling=None):
     """Perform only the network IO portion of the sync process.
        Local working directory/branch state is not affected.
+
+       If |remote_refs| (see LsRemote()) shows that the remote has nothing
+       new for this project, the fetch itself is skipped.
+
+       Failed fetches are retried |retry_fetches| times, by default as often
+       as the remote's retry policy says.  Callers that would rather retry
+       later themselves (see RemoteSpec.RetryDelay()) pass 0.
+
+       |fetched_sibling| is a project sharing this project's objdir that was
+       just fetched in full (see CanShareFetch()).  Its remote refs are then
+       copied instead of fetching the same objects again.
+
+       Afterwards, |network_fetched| tells whether the remote was fetched
+       from, as opposed to the fetch being skipped or copied from a sibling.
     """
+    self.network_fetched = False
     if archive and not isinstance(self, MetaProject):
       if self.remote.url.startswith(('http://', 'https://')):
         _error("%s: Cannot fetch archives from http/https remotes.", self.name)
@@ -1305,12 +1477,24 @@ class Project(object):
     need_to_fetch = not (optimized_fetch and
                          (ID_RE.match(self.revisionExpr) and
                           self._CheckForImmutableRevision()))
-    if (need_to_fetch and
-        not self._RemoteFetch(initial=is_new, quiet=quiet, alt_dir=alt_dir,
-                              current_branch_only=current_branch_only,
-                              no_tags=no_tags, prune=prune, depth=depth,
-                              submodules=submodules, force_sync=force_sync)):
-      return False
+    if (need_to_fetch and not is_new and remote_refs is not None and
+        self.RemoteTipsMatch(remote_refs,
+                             current_branch_only=current_branch_only,
+                             no_tags=no_tags, prune=prune, depth=depth)):
+      if not quiet:
+        print('Skipped fetching project %s (remote unchanged)' % self.name)
+      need_to_fetch = False
+    if (need_to_fetch and not is_new and fetched_sibling is not None and
+        self._CopyFetchedRefs(fetched_sibling, no_tags=no_tags, prune=prune)):
+      need_to_fetch = False
+    if need_to_fetch:
+      if not self._RemoteFetch(initial=is_new, quiet=quiet, alt_dir=alt_dir,
+                               current_branch_only=current_branch_only,
+                               no_tags=no_tags, prune=prune, depth=depth,
+                               submodules=submodules, force_sync=force_sync,
+                               retry_fetches=retry_fetches):
+        return False
+      self.network_fetched = True
 
     mp = self.manifest.manifestProject
     dissociate = mp.config.GetBoolean('repo.dissociate')
@@ -1353,11 +1537,11 @@ class Project(object):
     if not self.revisionExpr.startswith(R_TAGS):
       return self.GetRevisionId(self._allrefs)
 
-    try:
-      return self.bare_git.rev_list(self.revisionExpr, '-1')[0]
-    except GitError:
+    info = self._ObjectInfo('%s^0' % self.revisionExpr)
+    if info is None:
       raise ManifestInvalidRevisionError('revision %s in %s not found' %
                                          (self.revisionExpr, self.name))
+    return info[0]
 
   def GetRevisionId(self, all_refs=None):
     if self.revisionId:
@@ -1369,11 +1553,95 @@ class Project(object):
     if all_refs is not None and rev in all_refs:
       return all_refs[rev]
 
-    try:
-      return self.bare_git.rev_parse('--verify', '%s^0' % rev)
-    except GitError:
+    info = self._ObjectInfo('%s^0' % rev)
+    if info is None:
       raise ManifestInvalidRevisionError('revision %s in %s not found' %
                                          (self.revisionExpr, self.name))
+    return info[0]
+
+  def PlanNetworkHalf(self, current_branch_only=False, optimized_fetch=False):
+    """Predict what Sync_NetworkHalf() will do, without network access.
+
+    Returns:
+      'clone' for new projects, 'skip' if the revision is an immutable sha1
+      or tag that is already present, 'fetch' otherwise.
+    """
+    if not self.Exists:
+      return 'clone'
+    if not current_branch_only:
+      current_branch_only = bool(self.sync_c or self.manifest.default.sync_c)
+    if (self.clone_depth or
+        self.manifest.manifestProject.config.GetString('repo.depth')):
+      current_branch_only = True
+    is_sha1 = ID_RE.match(self.revisionExpr) is not None
+    is_tag = self.revisionExpr.startswith(R_TAGS)
+    if ((is_sha1 and optimized_fetch) or
+        (current_branch_only and (is_sha1 or is_tag))):
+      if self._CheckForImmutableRevision():
+        return 'skip'
+    return 'fetch'
+
+  def PlanLocalHalf(self, detach_head=False):
+    """Predict what Sync_LocalHalf() will do with the refs fetched so far.
+
+    Only reads the repository; follows the same decisions as
+    Sync_LocalHalf().
+
+    Returns:
+      One of 'checkout', 'untouched', 'fast-forward', 'rebase', 'reset',
+      'detach' or 'fail'; 'unknown' if the revision has not been fetched yet.
+    """
+    if not self.Exists or not os.path.exists(os.path.join(self.worktree,
+                                                          '.git')):
+      return 'checkout'
+    all_refs = self.bare_ref.all
+    try:
+      revid = self.GetRevisionId(all_refs)
+    except ManifestInvalidRevisionError:
+      return 'unknown'
+
+    head = self.work_git.GetHead()
+    if head.startswith(R_HEADS):
+      branch = head[len(R_HEADS):]
+      head = all_refs.get(head)
+    else:
+      branch = None
+
+    if branch is None or detach_head:
+      if self.IsRebaseInProgress():
+        return 'fail'
+      if head == revid and not detach_head:
+        return 'untouched'
+      return 'checkout'
+    if head == revid:
+      return 'untouched'
+
+    branch = self.GetBranch(branch)
+    if not branch.LocalMerge:
+      return 'detach'
+
+    upstream_gain = self._revlist(not_rev(HEAD), revid)
+    pub = self.WasPublished(branch.name, all_refs)
+    if pub:
+      if self._revlist(not_rev(revid), pub):
+        return 'fail' if upstream_gain else 'untouched'
+      elif pub == head:
+        return 'fast-forward'
+
+    local_changes = self._revlist(not_rev(revid), HEAD, format='%H %ce')
+    cnt_mine = 0
+    for commit in local_changes:
+      if commit.split(' ', 1)[1] == self.UserEmail:
+        cnt_mine += 1
+    if not upstream_gain and cnt_mine == len(local_changes):
+      return 'untouched'
+    if self.IsDirty(consider_untracked=False):
+      return 'fail'
+    if cnt_mine > 0 and self.rebase:
+      return 'rebase'
+    if local_changes:
+      return 'reset'
+    return 'fast-forward'
 
   def Sync_LocalHalf(self, syncbuf, force_sync=False, submodules=False):
     """Perform only the local IO portion of the sync process.
@@ -1415,7 +1683,7 @@ class Project(object):
         #
         if not syncbuf.detach_head:
           # The copy/linkfile config may have changed.
-          self._CopyAndLinkFiles()
+          syncbuf.copy_and_link(self)
           return
       else:
         lost = self._revlist(not_rev(revid), HEAD)
@@ -1429,14 +1697,14 @@ class Project(object):
       except GitError as e:
         syncbuf.fail(self, e)
         return
-      self._CopyAndLinkFiles()
+      syncbuf.copy_and_link(self)
       return
 
     if head == revid:
       # No changes; don't do anything further.
       #
       # The copy/linkfile config may have changed.
-      self._CopyAndLinkFiles()
+      syncbuf.copy_and_link(self)
       return
 
     branch = self.GetBranch(branch)
@@ -1455,7 +1723,7 @@ class Project(object):
       except GitError as e:
         syncbuf.fail(self, e)
         return
-      self._CopyAndLinkFiles()
+      syncbuf.copy_and_link(self)
       return
 
     upstream_gain = self._revlist(not_rev(HEAD), revid)
@@ -1488,7 +1756,7 @@ class Project(object):
     last_mine = None
     cnt_mine = 0
     for commit in local_changes:
-      commit_id, committer_email = commit.decode('utf-8').split(' ', 1)
+      commit_id, committer_email = commit.split(' ', 1)
       if committer_email == self.UserEmail:
         last_mine = commit_id
         cnt_mine += 1
@@ -1544,7 +1812,7 @@ class Project(object):
         self._ResetHard(revid)
         if submodules:
           self._SyncSubmodules(quiet=True)
-        self._CopyAndLinkFiles()
+        syncbuf.copy_and_link(self)
       except GitError as e:
         syncbuf.fail(self, e)
         return
@@ -1814,19 +2082,17 @@ class Project(object):
     re_url = re.compile(r'^submodule\.(.+)\.url=(.*)$')
 
     def parse_gitmodules(gitdir, rev):
-      cmd = ['cat-file', 'blob', '%s:.gitmodules' % rev]
       try:
-        p = GitCommand(None, cmd, capture_stdout=True, capture_stderr=True,
-                       bare=True, gitdir=gitdir)
+        blob = cat_file(gitdir).Contents('%s:.gitmodules' % rev)
       except GitError:
         return [], []
-      if p.Wait() != 0:
+      if blob is None:
         return [], []
 
       gitmodules_lines = []
       fd, temp_gitmodules_path = tempfile.mkstemp()
       try:
-        os.write(fd, p.stdout)
+        os.write(fd, blob[2])
         os.close(fd)
         cmd = ['config', '--file', temp_gitmodules_path, '--list']
         p = GitCommand(None, cmd, capture_stdout=True, capture_stderr=True,
@@ -1860,21 +2126,20 @@ class Project(object):
               [urls.get(name, '') for name in names])
 
     def git_ls_tree(gitdir, rev, paths):
-      cmd = ['ls-tree', rev, '--']
-      cmd.extend(paths)
+      # Read the trees holding |paths| instead of running `git ls-tree`.
+      objects = {}
+      trees = {}
       try:
-        p = GitCommand(None, cmd, capture_stdout=True, capture_stderr=True,
-                       bare=True, gitdir=gitdir)
+        for path in paths:
+          parent, _, base = path.strip('/').rpartition('/')
+          if parent not in trees:
+            trees[parent] = cat_file(gitdir).TreeEntries(
+                '%s:%s' % (rev, parent) if parent else '%s^{tree}' % rev)
+          entry = (trees[parent] or {}).get(base)
+          if entry:
+            objects[path] = entry[1]
       except GitError:
-        return []
-      if p.Wait() != 0:
-        return []
-      objects = {}
-      for line in p.stdout.split('\n'):
-        if not line.strip():
-          continue
-        object_rev, object_path = line.split()[2:4]
-        objects[object_path] = object_rev
+        return {}
       return objects
 
     try:
@@ -1904,7 +2169,10 @@ class Project(object):
                           url=url,
                           pushUrl=self.remote.pushUrl,
                           review=self.remote.review,
-                          revision=self.remote.revision)
+                          revision=self.remote.revision,
+                          fetchRetries=self.remote.fetchRetries,
+                          fetchRetryDelay=self.remote.fetchRetryDelay,
+                          syncJ=self.remote.syncJ)
       subproject = Project(manifest=self.manifest,
                            name=name,
                            remote=remote,
@@ -1927,15 +2195,168 @@ class Project(object):
 
 
 # Direct Git Commands ##
+  def _ObjectInfo(self, name):
+    """The (object id, type, size) of |name| in this project, or None.
+
+    None means git answered that there is no such object.  GitError is
+    raised if git could not be asked, even after restarting it.
+    """
+    return cat_file(self.gitdir).Info(name)
+
   def _CheckForImmutableRevision(self):
+    # If the revision (sha or tag) is not present we have to fetch it.
+    return self._ObjectInfo('%s^0' % self.revisionExpr) is not None
+
+  def LsRemote(self, name=None):
+    """List the refs advertised by a remote without fetching anything.
+
+    Returns:
+      A dict mapping ref names to object ids, or None if the remote could
+      not be queried.
+    """
+    if not name:
+      name = self.remote.name
+    ssh_proxy = bool(self.GetRemote(name).PreConnectFetch())
+    p = GitCommand(self, ['ls-remote', name], bare=True,
+                   capture_stdout=True, capture_stderr=True,
+                   ssh_proxy=ssh_proxy)
+    if p.Wait() != 0:
+      return None
+    refs = {}
+    for line in p.stdout.splitlines():
+      ref_id, _, ref = line.partition('\t')
+      if ref_id and ref:
+        refs[ref] = ref_id
+    return refs
+
+  def RemoteTipsMatch(self, remote_refs, name=None, current_branch_only=False,
+                      no_tags=False, prune=False, depth=None):
+    """Check whether _RemoteFetch() would leave all tracked refs unchanged.
+
+    Mirrors the refspecs _RemoteFetch() uses for the same arguments and
+    compares what they would write against the local refs.
+
+    Args:
+      remote_refs: The refs advertised by the remote, see LsRemote().
+      name: The remote to check; defaults to the project's remote.
+      current_branch_only, no_tags, prune, depth: As for _RemoteFetch().
+    """
+    if self.manifest.IsMirror or remote_refs is None:
+      return False
+    if not depth and os.path.exists(os.path.join(self.gitdir, 'shallow')):
+      # The fetch would unshallow the repository.
+      return False
+    if depth:
+      current_branch_only = True
+      no_tags = True
+
+    remote = self.GetRemote(name or self.remote.name)
+    is_sha1 = ID_RE.match(self.revisionExpr) is not None
+    if is_sha1:
+      if not self._CheckForImmutableRevision():
+        return False
+      if current_branch_only and not depth:
+        current_branch_only = bool(self.upstream and
+                                   not ID_RE.match(self.upstream))
+
+    expected = {}
+    pruned = []
+    if not current_branch_only:
+      for ref, ref_id in remote_refs.items():
+        if ref.startswith(R_HEADS):
+          expected[remote.ToLocal(ref)] = ref_id
+      pruned.append(remote.ToLocal(R_HEADS))
+
+    branch = self.upstream if is_sha1 else self.revisionExpr
+    if branch and branch.strip() and not (is_sha1 and depth):
+      if not branch.startswith('refs/'):
+        branch = R_HEADS + branch
+      if branch not in remote_refs:
+        return False
+      expected[remote.ToLocal(branch)] = remote_refs[branch]
+
+    if not no_tags:
+      for ref, ref_id in remote_refs.items():
+        if ref.startswith(R_TAGS) and not ref.endswith('^{}'):
+          expected[ref] = ref_id
+      pruned.append(R_TAGS)
+
+    local_refs = self.bare_ref.all
+    for ref, ref_id in expected.items():
+      if local_refs.get(ref) != ref_id:
+        return False
+    if prune:
+      for ref in local_refs:
+        if (ref not in expected and not ref.endswith('/' + HEAD) and
+            any(ref.startswith(p) for p in pruned)):
+          return False
+    return True
+
+  def CanShareFetch(self, other, current_branch_only=False, no_tags=False):
+    """Whether a full fetch of |other| also fetches everything for us.
+
+    Both projects must store objects in the same objdir, fetch all branches
+    from the same remote, and agree on fetching tags.  The revision must be
+    a branch (or a sha1 with a branch as upstream), so that it is covered by
+    fetching all branches.  A project fixed to a sha1 and one tracking a
+    branch are not fetched alike (see |optimized_fetch|), so they do not
+    share.
+    """
+    if self.manifest.IsMirror or self.objdir != other.objdir:
+      return False
+    if bool(ID_RE.match(self.revisionExpr)) != \
+        bool(ID_RE.match(other.revisionExpr)):
+      return False
+    if not (self.Exists and other.Exists):
+      return False
+    if (current_branch_only or self.manifest.default.sync_c or
+        self.manifest.manifestProject.config.GetString('repo.depth')):
+      return False
+    for p in (self, other):
+      if p.sync_c or p.clone_depth:
+        return False
+      revision = p.revisionExpr
+      if ID_RE.match(revision):
+        revision = p.upstream
+      if revision and revision.startswith('refs/') and \
+          not revision.startswith(R_HEADS):
+        return False
+    if (self.remote.name != other.remote.name or
+        self.remote.url != other.remote.url):
+      return False
+    return ((no_tags or not self.sync_tags) ==
+            (no_tags or not other.sync_tags))
+
+  def _CopyFetchedRefs(self, source, no_tags=False, prune=False):
+    """Update our remote refs (and tags) to those of |source|.
+
+    |source| shares our objdir and has just been fetched, so all objects
+    are already present; only the refs need to be written.
+    """
+    remote = self.GetRemote(self.remote.name)
+    prefixes = [remote.ToLocal(R_HEADS)]
+    if not no_tags and self.sync_tags:
+      prefixes.append(R_TAGS)
+
+    def _Tracked(ref):
+      return (any(ref.startswith(p) for p in prefixes) and
+              not ref.endswith('/' + HEAD))
+
+    src = source.bare_ref.all
+    dst = self.bare_ref.all
+    t = self.bare_git.RefTransaction()
+    for ref in sorted(src):
+      if _Tracked(ref) and dst.get(ref) != src[ref]:
+        t.Update(ref, src[ref])
+    if prune:
+      for ref in sorted(dst):
+        if _Tracked(ref) and ref not in src:
+          t.Delete(ref)
     try:
-      # if revision (sha or tag) is not present then following function
-      # throws an error.
-      self.bare_git.rev_parse('--verify', '%s^0' % self.revisionExpr)
-      return True
+      t.Commit()
     except GitError:
-      # There is no such persistent revision. We have to fetch it.
       return False
+    return True
 
   def _FetchArchive(self, tarpath, cwd=None):
     cmd = ['archive', '-v', '-o', tarpath]
@@ -1959,7 +2380,8 @@ class Project(object):
                    prune=False,
                    depth=None,
                    submodules=False,
-                   force_sync=False):
+                   force_sync=False,
+                   retry_fetches=None):
 
     is_sha1 = False
     tag_name = None
@@ -2105,22 +2527,32 @@ class Project(object):
           spec.append(str((u'+%s:' % branch) + remote.ToLocal(branch)))
     cmd.extend(spec)
 
+    if retry_fetches is None:
+      retry_fetches = self.remote.fetchRetries
+
     ok = False
-    for _i in range(2):
+    pruned = False
+    attempt = 0
+    while True:
       gitcmd = GitCommand(self, cmd, bare=True, ssh_proxy=ssh_proxy)
       ret = gitcmd.Wait()
       if ret == 0:
         ok = True
         break
-      # If needed, run the 'git remote prune' the first time through the loop
-      elif (not _i and
+      # If needed, run the 'git remote prune' once and try again
+      elif (not pruned and
             "error:" in gitcmd.stderr and
             "git remote prune" in gitcmd.stderr):
+        pruned = True
         prunecmd = GitCommand(self, ['remote', 'prune', name], bare=True,
                               ssh_proxy=ssh_proxy)
         ret = prunecmd.Wait()
         if ret:
           break
+        # The fetch after pruning counts as a retry, without a delay.
+        attempt += 1
+        if attempt > retry_fetches:
+          break
         continue
       elif current_branch_only and is_sha1 and ret == 128:
         # Exit code 128 means "couldn't find the ref you asked for"; if we're
@@ -2130,7 +2562,10 @@ class Project(object):
       elif ret < 0:
         # Git died with a signal, exit immediately
         break
-      time.sleep(random.randint(30, 45))
+      attempt += 1
+      if attempt > retry_fetches:
+        break
+      time.sleep(self.remote.RetryDelay(attempt))
 
     if initial:
       if alt_dir:
@@ -2150,12 +2585,12 @@ class Project(object):
           return self._RemoteFetch(name=name,
                                    current_branch_only=current_branch_only,
                                    initial=False, quiet=quiet, alt_dir=alt_dir,
-                                   depth=None)
+                                   depth=None, retry_fetches=retry_fetches)
         else:
           # Avoid infinite recursion: sync all branches with depth set to None
           return self._RemoteFetch(name=name, current_branch_only=False,
                                    initial=False, quiet=quiet, alt_dir=alt_dir,
-                                   depth=None)
+                                   depth=None, retry_fetches=retry_fetches)
 
     return ok
 
@@ -2362,6 +2797,7 @@ class Project(object):
             print("Retrying clone after deleting %s" %
                   self.gitdir, file=sys.stderr)
             try:
+              close_cat_files(self.gitdir)
               platform_utils.rmtree(platform_utils.realpath(self.gitdir))
               if self.worktree and os.path.exists(platform_utils.realpath
                                                   (self.worktree)):
@@ -2401,15 +2837,18 @@ class Project(object):
         self._UpdateHooks()
 
         m = self.manifest.manifestProject.config
-        for key in ['user.name', 'user.email']:
-          if m.Has(key, include_defaults=False):
-            self.config.SetString(key, m.GetString(key))
-        self.config.SetString('filter.lfs.smudge', 'git-lfs smudge --skip -- %f')
-        self.config.SetString('filter.lfs.process', 'git-lfs filter-process --skip')
-        if self.manifest.IsMirror:
-          self.config.SetString('core.bare', 'true')
-        else:
-          self.config.SetString('core.bare', None)
+        with self.config.Transaction():
+          for key in ['user.name', 'user.email']:
+            if m.Has(key, include_defaults=False):
+              self.config.SetString(key, m.GetString(key))
+          self.config.SetString('filter.lfs.smudge',
+                                'git-lfs smudge --skip -- %f')
+          self.config.SetString('filter.lfs.process',
+                                'git-lfs filter-process --skip')
+          if self.manifest.IsMirror:
+            self.config.SetString('core.bare', 'true')
+          else:
+            self.config.SetString('core.bare', None)
     except Exception:
       if init_obj_dir and os.path.exists(self.objdir):
         platform_utils.rmtree(self.objdir)
@@ -2679,72 +3118,28 @@ class Project(object):
 
     def LsOthers(self):
       p = GitCommand(self._project,
-                     ['ls-files',
-                      '-z',
-                      '--others',
-                      '--exclude-standard'],
+                     _LS_OTHERS,
                      bare=False,
                      gitdir=self._gitdir,
                      capture_stdout=True,
                      capture_stderr=True)
-      if p.Wait() == 0:
-        out = p.stdout
-        if out:
-          # Backslash is not anomalous
-          return out[:-1].split('\0')
+      files = list(p.Records('\0'))
+      if p.rc == 0:
+        return files
       return []
 
     def DiffZ(self, name, *args):
-      cmd = [name]
-      cmd.append('-z')
-      cmd.append('--ignore-submodules')
-      cmd.extend(args)
       p = GitCommand(self._project,
-                     cmd,
+                     _DiffZCommand(name, *args),
                      gitdir=self._gitdir,
                      bare=False,
                      capture_stdout=True,
                      capture_stderr=True)
+      out = p.Records('\0')
       try:
-        out = p.process.stdout.read()
-        r = {}
-        if out:
-          out = iter(out[:-1].split('\0'))
-          while out:
-            try:
-              info = next(out)
-              path = next(out)
-            except StopIteration:
-              break
-
-            class _Info(object):
-
-              def __init__(self, path, omode, nmode, oid, nid, state):
-                self.path = path
-                self.src_path = None
-                self.old_mode = omode
-                self.new_mode = nmode
-                self.old_id = oid
-                self.new_id = nid
-
-                if len(state) == 1:
-                  self.status = state
-                  self.level = None
-                else:
-                  self.status = state[:1]
-                  self.level = state[1:]
-                  while self.level.startswith('0'):
-                    self.level = self.level[1:]
-
-            info = info[1:].split(' ')
-            info = _Info(path, *info)
-            if info.status in ('R', 'C'):
-              info.src_path = info.path
-              info.path = next(out)
-            r[info.path] = info
-        return r
+        return _ParseDiffZ(out)
       finally:
-        p.Wait()
+        out.close()
 
     def GetHead(self):
       if self._bare:
@@ -2776,32 +3171,24 @@ class Project(object):
       self.symbolic_ref(*cmdv)
 
     def DetachHead(self, new, message=None):
-      cmdv = ['--no-deref']
-      if message is not None:
-        cmdv.extend(['-m', message])
-      cmdv.append(HEAD)
-      cmdv.append(new)
-      self.update_ref(*cmdv)
+      self.UpdateRef(HEAD, new, message=message, detach=True)
+
+    def RefTransaction(self, message=None, detach=False):
+      """Start collecting ref changes to apply at once; see _RefTransaction.
+      """
+      return _RefTransaction(self, message=message, detach=detach)
 
     def UpdateRef(self, name, new, old=None,
                   message=None,
                   detach=False):
-      cmdv = []
-      if message is not None:
-        cmdv.extend(['-m', message])
-      if detach:
-        cmdv.append('--no-deref')
-      cmdv.append(name)
-      cmdv.append(new)
-      if old is not None:
-        cmdv.append(old)
-      self.update_ref(*cmdv)
+      t = self.RefTransaction(message=message, detach=detach)
+      t.Update(name, new, old)
+      t.Commit()
 
     def DeleteRef(self, name, old=None):
-      if not old:
-        old = self.rev_parse(name)
-      self.update_ref('-d', name, old)
-      self._project.bare_ref.deleted(name)
+      t = self.RefTransaction()
+      t.Delete(name, old)
+      t.Commit()
 
     def rev_list(self, *args, **kw):
       if 'format' in kw:
@@ -2815,10 +3202,11 @@ class Project(object):
                      gitdir=self._gitdir,
                      capture_stdout=True,
                      capture_stderr=True)
-      if p.Wait() != 0:
+      lines = list(p.Records())
+      if p.rc != 0:
         raise GitError('%s rev-list %s: %s' %
                        (self._project.name, str(args), p.stderr))
-      return p.stdout.splitlines()
+      return lines
 
     def __getattr__(self, name):
       """Allow arbitrary git commands using pythonic syntax.
@@ -2876,6 +3264,174 @@ class Project(object):
       return runner
 
 
+_LS_OTHERS = ['ls-files', '-z', '--others', '--exclude-standard']
+
+
+def _DiffZCommand(name, *args):
+  cmd = [name]
+  cmd.append('-z')
+  cmd.append('--ignore-submodules')
+  cmd.extend(args)
+  return cmd
+
+
+def _SplitZ(out):
+  """Split NUL terminated records."""
+  if not out:
+    return []
+  # Backslash is not anomalous
+  return out[:-1].split('\0')
+
+
+def _ParseDiffZ(records):
+  """Parse the records of a raw diff made with -z into a dict by path."""
+
+  class _Info(object):
+
+    def __init__(self, path, omode, nmode, oid, nid, state):
+      self.path = path
+      self.src_path = None
+      self.old_mode = omode
+      self.new_mode = nmode
+      self.old_id = oid
+      self.new_id = nid
+
+      if len(state) == 1:
+        self.status = state
+        self.level = None
+      else:
+        self.status = state[:1]
+        self.level = state[1:]
+        while self.level.startswith('0'):
+          self.level = self.level[1:]
+
+  out = iter(records)
+  r = {}
+  while True:
+    try:
+      info = next(out)
+      path = next(out)
+    except StopIteration:
+      break
+
+    info = info[1:].split(' ')
+    info = _Info(path, *info)
+    if info.status in ('R', 'C'):
+      info.src_path = info.path
+      info.path = next(out)
+    r[info.path] = info
+  return r
+
+
+class _RefTransaction(object):
+  """Ref changes applied together by a single `git update-ref --stdin`.
+
+  Collect changes with Create(), Update() and Delete(), then apply them with
+  Commit(); either all of them succeed or none does.  Values may be any
+  revision expression; they are resolved before the transaction starts so
+  the GitRefs cache of the project can be kept up to date without reloading.
+  """
+
+  def __init__(self, git, message=None, detach=False):
+    self._git = git
+    self._message = message
+    self._detach = detach
+    self._ops = []
+
+  def __len__(self):
+    return len(self._ops)
+
+  def Create(self, name, new):
+    """Create |name|, failing if it exists."""
+    self._ops.append(('create', name, new, None))
+
+  def Update(self, name, new, old=None):
+    """Set |name| to |new|, but only if it is at |old| when given."""
+    self._ops.append(('update', name, new, old))
+
+  def Delete(self, name, old=None):
+    """Delete |name|, but only if it is at |old| when given."""
+    self._ops.append(('delete', name, None, old))
+
+  def Commit(self):
+    """Apply all changes, raising GitError if any of them fails."""
+    if not self._ops:
+      return
+    project = self._git._project
+    ops = self._Resolve(project)
+
+    if git_require((1, 8, 5)):
+      lines = []
+      for op, name, new, old in ops:
+        lines.append(' '.join([op, name] +
+                              [v for v in (new, old) if v is not None]))
+      self._Run(['--stdin'], ('\n'.join(lines) + '\n').encode('utf-8'))
+    else:
+      for op, name, new, old in ops:
+        if op == 'delete':
+          args = ['-d', name]
+        elif op == 'create':
+          args = [name, new, '0' * 40]
+        else:
+          args = [name, new]
+        if old is not None:
+          args.append(old)
+        self._Run(args)
+
+    for op, name, new, _ in ops:
+      if name == HEAD and not self._git._bare:
+        # The HEAD of the work tree is not the one bare_ref knows.
+        continue
+      if op == 'delete':
+        project.bare_ref.deleted(name)
+      else:
+        project.bare_ref.updated(name, new, deref=not self._detach)
+    self._ops = []
+
+  def _Resolve(self, project):
+    """Turn every value into an object id."""
+    if self._git._bare:
+      gitdir = self._git._gitdir
+    else:
+      gitdir = os.path.join(project.worktree, '.git')
+    exprs = set()
+    for _, _, new, old in self._ops:
+      for v in (new, old):
+        if v is not None and not IsId(v):
+          exprs.add(v)
+    exprs = sorted(exprs)
+    ids = {}
+    if exprs:
+      infos = cat_file(gitdir).InfoMany(exprs)
+      for expr, info in zip(exprs, infos):
+        if info is None:
+          raise GitError('%s update-ref: invalid revision %s' %
+                         (project.name, expr))
+        ids[expr] = info[0]
+    return [(op, name, ids.get(new, new), ids.get(old, old))
+            for op, name, new, old in self._ops]
+
+  def _Run(self, args, stdin=None):
+    cmdv = ['update-ref']
+    if self._message is not None:
+      cmdv.extend(['-m', self._message])
+    if self._detach:
+      cmdv.append('--no-deref')
+    cmdv.extend(args)
+    p = GitCommand(self._git._project, cmdv,
+                   bare=self._git._bare,
+                   gitdir=self._git._gitdir,
+                   provide_stdin=stdin is not None,
+                   capture_stdout=True,
+                   capture_stderr=True)
+    if stdin is not None:
+      p.stdin.write(stdin)
+      p.stdin.close()
+    if p.Wait() != 0:
+      raise GitError('%s update-ref: %s' % (self._git._project.name,
+                                            p.stderr))
+
+
 class _PriorSyncFailedError(Exception):
 
   def __str__(self):
@@ -2941,32 +3497,66 @@ class _SyncColoring(Coloring):
 
 
 class SyncBuffer(object):
+  """Collects the results of Sync_LocalHalf() calls.
+
+  Several threads may report into the same buffer.  Messages, failures and
+  deferred actions are replayed in project path order, and actions deferred
+  by a single project keep the order in which that project queued them.
+  """
 
   def __init__(self, config, detach_head=False):
+    self._lock = _threading.Lock()
     self._messages = []
     self._failures = []
     self._later_queue1 = []
     self._later_queue2 = []
+    self._copy_link = None
 
     self.out = _SyncColoring(config)
     self.out.redirect(sys.stderr)
 
     self.detach_head = detach_head
     self.clean = True
-    self.recent_clean = True
+    self._recent = _threading.local()
 
   def info(self, project, fmt, *args):
-    self._messages.append(_InfoMessage(project, fmt % args))
+    with self._lock:
+      self._messages.append(_InfoMessage(project, fmt % args))
 
   def fail(self, project, err=None):
-    self._failures.append(_Failure(project, err))
+    with self._lock:
+      self._failures.append(_Failure(project, err))
     self._MarkUnclean()
 
   def later1(self, project, what):
-    self._later_queue1.append(_Later(project, what))
+    with self._lock:
+      self._later_queue1.append(_Later(project, what))
 
   def later2(self, project, what):
-    self._later_queue2.append(_Later(project, what))
+    with self._lock:
+      self._later_queue2.append(_Later(project, what))
+
+  def copy_and_link(self, project):
+    """Copy and link the files of |project|; see HoldCopyAndLink()."""
+    with self._lock:
+      if self._copy_link is not None:
+        self._copy_link.append(project)
+        return
+    project._CopyAndLinkFiles()
+
+  def HoldCopyAndLink(self):
+    """Keep copy_and_link() calls until RunCopyAndLink() is called."""
+    with self._lock:
+      if self._copy_link is None:
+        self._copy_link = []
+
+  def RunCopyAndLink(self):
+    """Copy and link the files held back, one project after another."""
+    with self._lock:
+      projects = self._copy_link or []
+      self._copy_link = None
+    for project in sorted(projects, key=lambda p: p.relpath or ''):
+      project._CopyAndLinkFiles()
 
   def Finish(self):
     self._PrintMessages()
@@ -2975,13 +3565,14 @@ class SyncBuffer(object):
     return self.clean
 
   def Recently(self):
-    recent_clean = self.recent_clean
-    self.recent_clean = True
+    """Whether nothing failed since the last call from the calling thread."""
+    recent_clean = getattr(self._recent, 'clean', True)
+    self._recent.clean = True
     return recent_clean
 
   def _MarkUnclean(self):
     self.clean = False
-    self.recent_clean = False
+    self._recent.clean = False
 
   def _RunLater(self):
     for q in ['_later_queue1', '_later_queue2']:
@@ -2989,7 +3580,7 @@ class SyncBuffer(object):
         return
 
   def _RunQueue(self, queue):
-    for m in getattr(self, queue):
+    for m in _SortByProject(getattr(self, queue)):
       if not m.Run(self):
         self._MarkUnclean()
         return False
@@ -2997,13 +3588,21 @@ class SyncBuffer(object):
     return True
 
   def _PrintMessages(self):
-    for m in self._messages:
+    with self._lock:
+      messages = _SortByProject(self._messages)
+      failures = _SortByProject(self._failures)
+      self._messages = []
+      self._failures = []
+
+    for m in messages:
       m.Print(self)
-    for m in self._failures:
+    for m in failures:
       m.Print(self)
 
-    self._messages = []
-    self._failures = []
+
+def _SortByProject(entries):
+  """Stable sort of SyncBuffer entries by the path of their project."""
+  return sorted(entries, key=lambda e: e.project.relpath or '')
 
 
 class MetaProject(Project):
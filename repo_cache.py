@@ -0,0 +1,209 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""One cache under .repo/ for data derived from files of the checkout.
+
+All projects share a single sqlite database instead of each keeping small
+cache files next to its sources.  Every entry is stored with a stamp of the
+stat data of the files it was derived from, and is only returned while the
+stamp still matches.
+
+sqlite serializes writers across processes, so `repo forall` workers and
+`repo sync -j` threads can all use the cache.
+"""
+
+import json
+import os
+try:
+  import sqlite3
+except ImportError:
+  sqlite3 = None
+try:
+  import threading as _threading
+except ImportError:
+  import dummy_threading as _threading
+import time
+
+from trace import Trace
+
+CACHE_FILE = '.repo_cache.db'
+
+# Bump when the layout of the database changes; older ones are dropped.
+_VERSION = 1
+
+# Files modified this recently could change again without any change to
+# their stat data, so they are not cached yet.
+_RACY_S = 2
+
+
+def Open(repodir):
+  """The cache of the checkout whose .repo/ directory is |repodir|.
+
+  Returns:
+    A RepoCache, or None if this Python has no sqlite3 module.
+  """
+  if sqlite3 is None:
+    return None
+  return RepoCache(os.path.join(repodir, CACHE_FILE))
+
+
+def FileStamp(*paths):
+  """A stamp of the stat data of |paths|.
+
+  Missing files are part of the stamp too.
+
+  Returns:
+    The stamp, or None if one of the files was modified too recently to
+    be cached.
+  """
+  parts = []
+  now = time.time()
+  for path in paths:
+    try:
+      st = os.stat(path)
+    except OSError:
+      parts.append('-')
+      continue
+    if IsRacy(st.st_mtime, now):
+      return None
+    parts.append('%d:%d:%d' % (_MtimeNs(st), st.st_size, st.st_ino))
+  return ' '.join(parts)
+
+
+def IsRacy(mtime, now=None):
+  """Whether a file modified at |mtime| could change unnoticed."""
+  if now is None:
+    now = time.time()
+  return mtime > now - _RACY_S
+
+
+class RepoCache(object):
+  """A persistent map of (kind, key) to JSON values, validated by stamps."""
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = _threading.Lock()
+    self._db = None
+    self._pid = None
+    self._entries = {}
+
+  def __getstate__(self):
+    # `repo forall` pickles GitConfig objects for its worker processes,
+    # which open their own connection.
+    return {'path': self.path}
+
+  def __setstate__(self, state):
+    self.__init__(state['path'])
+
+  def Get(self, kind, key, stamp):
+    """The value stored for |key| with |stamp|, or None."""
+    if stamp is None:
+      return None
+    with self._lock:
+      entry = self._Entry(kind, key)
+    if entry is None or entry[0] != stamp:
+      return None
+    try:
+      return json.loads(entry[1])
+    except ValueError:
+      return None
+
+  def Put(self, kind, key, stamp, value):
+    """Store |value| for |key|, valid while the files match |stamp|."""
+    if stamp is None:
+      return
+    data = json.dumps(value, sort_keys=True)
+    with self._lock:
+      if self._Entry(kind, key) == (stamp, data):
+        return
+      self._entries[(kind, key)] = (stamp, data)
+      db = self._Connect()
+      if db is None:
+        return
+      try:
+        with db:
+          db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                     (kind, key, stamp, data))
+      except sqlite3.Error as e:
+        self._Disable(e)
+
+  def _Entry(self, kind, key):
+    """The (stamp, data) of |key|, read from the database once per process."""
+    try:
+      return self._entries[(kind, key)]
+    except KeyError:
+      pass
+    entry = None
+    db = self._Connect()
+    if db is not None:
+      try:
+        entry = db.execute(
+            'SELECT stamp, data FROM entries WHERE kind = ? AND key = ?',
+            (kind, key)).fetchone()
+      except sqlite3.Error as e:
+        self._Disable(e)
+    if entry is not None:
+      entry = tuple(entry)
+    self._entries[(kind, key)] = entry
+    return entry
+
+  def _Connect(self):
+    # A connection must not be used across fork(), so forall workers
+    # open their own.
+    if self._pid == os.getpid():
+      return self._db
+    self._pid = os.getpid()
+    self._db = None
+    if not os.path.isdir(os.path.dirname(self.path)):
+      return None
+    try:
+      db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+      try:
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+      except sqlite3.Error:
+        # Not all filesystems support a write-ahead log; keep the default.
+        pass
+      if _Version(db) != _VERSION:
+        with db:
+          # Check again under the write lock; another process may have
+          # created the table meanwhile.
+          db.execute('BEGIN IMMEDIATE')
+          if _Version(db) != _VERSION:
+            db.execute('DROP TABLE IF EXISTS entries')
+            db.execute('CREATE TABLE entries (kind TEXT, key TEXT, '
+                       'stamp TEXT, data TEXT, PRIMARY KEY (kind, key))')
+            db.execute('PRAGMA user_version = %d' % _VERSION)
+    except sqlite3.Error as e:
+      self._Disable(e)
+      return None
+    self._db = db
+    return db
+
+  def _Disable(self, e):
+    Trace(': cache %s disabled: %s', self.path, e)
+    self._db = None
+
+
+def _Version(db):
+  return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _MtimeNs(st):
+  ns = getattr(st, 'st_mtime_ns', None)
+  if ns is None:
+    ns = int(st.st_mtime * 1e9)
+  return ns
@@ -0,0 +1,250 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Worker pool used to run per-project tasks in parallel."""
+
+import heapq
+import itertools
+import sys
+import time
+
+try:
+  import threading as _threading
+except ImportError:
+  import dummy_threading as _threading
+
+
+def Simulate(items, jobs):
+  """Predict how a Scheduler with |jobs| workers would run |items|.
+
+  Args:
+    items: (item, cost) pairs, with cost the expected run time in seconds.
+    jobs: Number of workers.
+
+  Returns:
+    (item, worker, start, end) tuples in the order the items would start.
+  """
+  order = sorted(enumerate(items), key=lambda x: (-x[1][1], x[0]))
+  free = [(0.0, w) for w in range(max(1, jobs))]
+  heapq.heapify(free)
+  result = []
+  for _, (item, cost) in order:
+    start, worker = heapq.heappop(free)
+    end = start + max(0.0, cost)
+    result.append((item, worker, start, end))
+    heapq.heappush(free, (end, worker))
+  return result
+
+
+class WorkerStats(object):
+  """Accounting for a single worker of a Scheduler."""
+
+  def __init__(self, index):
+    self.index = index
+    self.busy = 0.0
+    self.tasks = 0
+
+
+class Scheduler(object):
+  """Runs tasks on a fixed pool of worker threads.
+
+  Tasks are kept in a single shared priority queue and handed out most
+  expensive first.  A worker that finishes a task immediately pulls the next
+  one, so long running tasks started early do not leave the rest of the pool
+  idle at the end of the run.  Running tasks may queue more work with Add(),
+  or with Defer() to have it started only after a delay.
+
+  Tasks may be tagged with keys (e.g. the host they connect to) and the
+  number of tasks running at once for a key limited with SetLimit().  Tasks
+  held back by a limit let cheaper tasks with other keys run in the meantime.
+  """
+
+  def __init__(self, jobs):
+    self.jobs = max(1, jobs)
+    self.workers = []
+    self.elapsed = 0.0
+    self._cond = _threading.Condition()
+    self._heap = []
+    self._delayed = []
+    self._seq = itertools.count()
+    self._active = 0
+    self._limits = {}
+    self._running = {}
+    self._closed = True
+    self._stopped = False
+    self._exc_info = None
+
+  def SetLimit(self, key, limit):
+    """Run at most |limit| tasks tagged with |key| at the same time."""
+    with self._cond:
+      self._limits[key] = max(1, limit)
+      self._cond.notify_all()
+
+  def Add(self, item, cost=0, keys=()):
+    """Queue |item|; items with a higher |cost| are started first.
+
+    |keys| tag the item for the limits set with SetLimit().
+    """
+    with self._cond:
+      heapq.heappush(self._heap, (-cost, next(self._seq), item, tuple(keys)))
+      self._cond.notify()
+
+  def Defer(self, item, delay, cost=0, keys=()):
+    """Queue |item| like Add(), but not before |delay| seconds from now.
+
+    Workers keep running other tasks in the meantime.  Run() does not return
+    while deferred items are pending, unless the scheduler is stopped.
+    """
+    with self._cond:
+      heapq.heappush(self._delayed, (time.time() + delay, next(self._seq),
+                                     cost, item, tuple(keys)))
+      self._cond.notify_all()
+
+  def Hold(self):
+    """Keep workers waiting for more work until Close() is called.
+
+    By default Run() returns as soon as the queue drains.  A held scheduler
+    can be fed from other threads while it runs, e.g. as results of another
+    stage become available.
+    """
+    with self._cond:
+      self._closed = False
+
+  def Close(self):
+    """Let Run() return once the queued work is done.  See Hold()."""
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+
+  def Stop(self):
+    """Do not start any more tasks; running tasks are allowed to finish."""
+    with self._cond:
+      self._stopped = True
+      self._cond.notify_all()
+
+  @property
+  def stopped(self):
+    return self._stopped
+
+  def Run(self, func):
+    """Call func(item) for every queued item and wait for all of them.
+
+    If |func| raises, no new tasks are started and the exception is re-raised
+    here once the running tasks have finished.
+    """
+    start = time.time()
+    self.workers = [WorkerStats(i) for i in range(self.jobs)]
+    if self.jobs == 1:
+      self._Work(self.workers[0], func)
+    else:
+      threads = []
+      for stats in self.workers:
+        t = _threading.Thread(target=self._Work, args=(stats, func))
+        # Ensure that Ctrl-C will not freeze the repo process.
+        t.daemon = True
+        threads.append(t)
+        t.start()
+      for t in threads:
+        t.join()
+    self.elapsed = time.time() - start
+
+    if self._exc_info:
+      exc_info = self._exc_info
+      self._exc_info = None
+      if sys.version_info[0] >= 3:
+        raise exc_info[1].with_traceback(exc_info[2])
+      raise exc_info[1]
+
+  def Utilization(self):
+    """Fraction of the wall time each worker spent running tasks."""
+    if self.elapsed <= 0:
+      return [0.0 for _ in self.workers]
+    return [min(1.0, w.busy / self.elapsed) for w in self.workers]
+
+  def FormatUtilization(self):
+    """One line summary of Utilization(), suitable for end of run output."""
+    util = self.Utilization()
+    if not util:
+      return ''
+    return 'avg %d%%, per worker: %s' % (
+        100 * sum(util) / len(util),
+        ' '.join('%d%%' % (100 * u) for u in util))
+
+  def _Next(self):
+    with self._cond:
+      while not self._stopped:
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+          _, seq, cost, item, keys = heapq.heappop(self._delayed)
+          heapq.heappush(self._heap, (-cost, seq, item, keys))
+        entry = self._PopRunnable()
+        if entry:
+          self._active += 1
+          for key in entry[3]:
+            self._running[key] = self._running.get(key, 0) + 1
+          return entry
+        if (not self._heap and not self._delayed and not self._active and
+            self._closed):
+          return None
+        # Nothing runnable right now, but a running task (or the owner of a
+        # held scheduler) may still add work, a running task may free up a
+        # limited key, or deferred work becomes due.
+        if self._delayed:
+          self._cond.wait(self._delayed[0][0] - now)
+        else:
+          self._cond.wait()
+      return None
+
+  def _PopRunnable(self):
+    """Pop the most expensive queued entry whose keys are below limit."""
+    skipped = []
+    entry = None
+    while self._heap:
+      candidate = heapq.heappop(self._heap)
+      if all(self._running.get(k, 0) < self._limits.get(k, self.jobs)
+             for k in candidate[3]):
+        entry = candidate
+        break
+      skipped.append(candidate)
+    for e in skipped:
+      heapq.heappush(self._heap, e)
+    return entry
+
+  def _Done(self, keys):
+    with self._cond:
+      self._active -= 1
+      for key in keys:
+        self._running[key] -= 1
+      self._cond.notify_all()
+
+  def _Work(self, stats, func):
+    while True:
+      entry = self._Next()
+      if entry is None:
+        return
+      item, keys = entry[2], entry[3]
+      start = time.time()
+      try:
+        func(item)
+      except BaseException:
+        with self._cond:
+          if self._exc_info is None:
+            self._exc_info = sys.exc_info()
+        self.Stop()
+      finally:
+        stats.busy += time.time() - start
+        stats.tasks += 1
+        self._Done(keys)
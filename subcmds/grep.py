@@ -193,27 +193,10 @@ contain a line that matches both expressions:
                      bare = False,
                      capture_stdout = True,
                      capture_stderr = True)
-      if p.Wait() != 0:
-        # no results
-        #
-        if p.stderr:
-          if have_rev and 'fatal: ambiguous argument' in p.stderr:
-            bad_rev = True
-          else:
-            out.project('--- project %s ---' % project.relpath)
-            out.nl()
-            out.write("%s", p.stderr)
-            out.nl()
-        continue
-      have_match = True
-
-      # We cut the last element, to avoid a blank line.
-      #
-      r = p.stdout.split('\n')
-      r = r[0:-1]
 
-      if have_rev and full_name:
-        for line in r:
+      # Print matches as git finds them rather than after it is done.
+      for line in p.Records():
+        if have_rev and full_name:
           rev, line = line.split(':', 1)
           out.write("%s", rev)
           out.write(':')
@@ -221,16 +204,28 @@ contain a line that matches both expressions:
           out.write('/')
           out.write("%s", line)
           out.nl()
-      elif full_name:
-        for line in r:
+        elif full_name:
           out.project(project.relpath)
           out.write('/')
           out.write("%s", line)
           out.nl()
-      else:
-        for line in r:
+        else:
           print(line)
 
+      if p.rc != 0:
+        # no results
+        #
+        if p.stderr:
+          if have_rev and 'fatal: ambiguous argument' in p.stderr:
+            bad_rev = True
+          else:
+            out.project('--- project %s ---' % project.relpath)
+            out.nl()
+            out.write("%s", p.stderr)
+            out.nl()
+        continue
+      have_match = True
+
     if have_match:
       sys.exit(0)
     elif have_rev and bad_rev:
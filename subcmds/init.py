@@ -311,8 +311,9 @@ to update the working directory files.
       if not gc.Has('user.name') or not gc.Has('user.email'):
         return True
 
-      mp.config.SetString('user.name', gc.GetString('user.name'))
-      mp.config.SetString('user.email', gc.GetString('user.email'))
+      with mp.config.Transaction():
+        mp.config.SetString('user.name', gc.GetString('user.name'))
+        mp.config.SetString('user.email', gc.GetString('user.email'))
 
     print()
     print('Your identity is: %s <%s>' % (mp.config.GetString('user.name'),
@@ -337,10 +338,11 @@ to update the working directory files.
       if a in ('yes', 'y', 't', 'true'):
         break
 
-    if name != mp.UserName:
-      mp.config.SetString('user.name', name)
-    if email != mp.UserEmail:
-      mp.config.SetString('user.email', email)
+    with mp.config.Transaction():
+      if name != mp.UserName:
+        mp.config.SetString('user.name', name)
+      if email != mp.UserEmail:
+        mp.config.SetString('user.email', email)
 
   def _HasColorSet(self, gc):
     for n in ['ui', 'diff', 'status']:
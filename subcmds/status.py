@@ -18,11 +18,6 @@ from __future__ import print_function
 
 from command import PagedCommand
 
-try:
-  import threading as _threading
-except ImportError:
-  import dummy_threading as _threading
-
 import glob
 
 import itertools
@@ -30,6 +25,7 @@ import os
 
 from color import Coloring
 import platform_utils
+from scheduler import Scheduler
 
 class Status(PagedCommand):
   common = True
@@ -95,26 +91,6 @@ the following meanings:
     p.add_option('-q', '--quiet', action='store_true',
                  help="only print the name of modified projects")
 
-  def _StatusHelper(self, project, clean_counter, sem, quiet):
-    """Obtains the status for a specific project.
-
-    Obtains the status for a project, redirecting the output to
-    the specified object. It will release the semaphore
-    when done.
-
-    Args:
-      project: Project to get status of.
-      clean_counter: Counter for clean projects.
-      sem: Semaphore, will call release() when complete.
-      output: Where to output the status.
-    """
-    try:
-      state = project.PrintWorkTreeStatus(quiet=quiet)
-      if state == 'CLEAN':
-        next(clean_counter)
-    finally:
-      sem.release()
-
   def _FindOrphans(self, dirs, proj_dirs, proj_dirs_parents, outstring):
     """find 'dirs' that are present in 'proj_dirs_parents' but not in 'proj_dirs'"""
     status_header = ' --\t'
@@ -141,18 +117,33 @@ the following meanings:
         if state == 'CLEAN':
           next(counter)
     else:
-      sem = _threading.Semaphore(opt.jobs)
-      threads = []
+      # Query all projects that may be dirty at once, then print them in
+      # order.  Telling which ones may be dirty stats every file, so the
+      # workers do that too.
+      dirty = [False] * len(all_projects)
+      def _Check(i):
+        p = all_projects[i]
+        dirty[i] = bool(platform_utils.isdir(p.worktree) and p.PossiblyDirty())
+      scheduler = Scheduler(max(1, min(opt.jobs, len(all_projects))))
+      for i in range(len(all_projects)):
+        scheduler.Add(i)
+      scheduler.Run(_Check)
+      present = [p for p, d in zip(all_projects, dirty) if d]
+      queries = [p.WorkTreeStatusQueries() for p in present]
+      self.GatherGit([(p, q[0]) for p, q in zip(present, queries)], opt.jobs)
+      results = self.GatherGit([(p, cmdv) for p, q in zip(present, queries)
+                                for cmdv in q[1:]], opt.jobs)
+      by_project = {}
+      i = 0
+      for p, q in zip(present, queries):
+        by_project[p.relpath] = results[i:i + len(q) - 1]
+        i += len(q) - 1
+      clean = [(0, '', '')] * 3
       for project in all_projects:
-        sem.acquire()
-
-        t = _threading.Thread(target=self._StatusHelper,
-                              args=(project, counter, sem, opt.quiet))
-        threads.append(t)
-        t.daemon = True
-        t.start()
-      for t in threads:
-        t.join()
+        state = project.PrintWorkTreeStatus(
+            quiet=opt.quiet, results=by_project.get(project.relpath, clean))
+        if state == 'CLEAN':
+          next(counter)
     if not opt.quiet and len(all_projects) == next(counter):
       print('nothing to commit (working directory clean)')
 
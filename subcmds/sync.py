@@ -65,8 +65,10 @@ except ImportError:
   multiprocessing = None
 
 import event_log
-from git_command import GIT, git_require
-from git_config import GetUrlCookieFile
+from git_command import GIT, git_require, close_cat_files
+from git_config import GetHostFromUrl, GetUrlCookieFile
+from git_objects import ObjectStats
+import gc_planner
 from git_refs import R_HEADS, HEAD
 import gitc_utils
 from project import Project
@@ -76,6 +78,7 @@ from error import RepoChangedException, GitError, ManifestParseError
 import platform_utils
 from project import SyncBuffer
 from progress import Progress
+from scheduler import Scheduler, Simulate
 from wrapper import Wrapper
 from manifest_xml import GitcManifest
 
@@ -161,6 +164,45 @@ exist locally.
 The --prune option can be used to remove any refs that no longer
 exist on the remote.
 
+The --precheck option lists the refs of every remote (git ls-remote)
+before fetching, and skips the fetch of projects whose tracked refs
+already match the remote.  This is cheaper than a full fetch
+negotiation when only a few projects have changed.
+
+The --jobs-checkout option sets how many work trees are updated in
+parallel once their projects have been fetched.
+
+Out of the -j/--jobs fetches, at most the sync-j attribute of a
+manifest remote fetch from that remote at the same time, and at most
+the git config option sync.<host>.jobs fetch from that host, e.g.:
+
+  git config --global sync.review.example.com.jobs 2
+
+The remaining jobs are used to fetch projects from other remotes.
+
+The --interleaved option updates the working tree of a project as soon
+as its fetch has completed, instead of waiting for every project to be
+fetched first.  Network and disk work then overlap.
+
+After fetching, repo runs git gc in the projects that have more loose
+objects or packs than the gc.auto and gc.autoPackLimit git config
+options allow.  With --background-gc this happens in a detached
+process (logged to .repo/gc.log), so that '%prog' returns right away.
+
+The --plan option does not sync anything either.  It lists what
+'%prog' would do with every project: clone or fetch it, or skip the
+fetch of an immutable revision that is already present, and then check
+out, fast-forward, rebase, reset or leave its work tree untouched.
+Work tree actions are predicted from the refs fetched so far.  Every
+project gets an estimated fetch time from the history of previous
+syncs, and the plan shows how the fetches would be spread over the -j
+jobs.  Add --json for machine readable output.
+
+The --stats option does not sync anything.  It prints the projects
+that took the longest to fetch, that failed to fetch most often and
+that changed least recently, according to the history recorded by
+previous syncs.
+
 # SSH Connections
 
 If at least one project remote URL uses an SSH connection (ssh://,
@@ -214,6 +256,24 @@ later is required to fix a server side protocol bug.
     p.add_option('-n', '--network-only',
                  dest='network_only', action='store_true',
                  help="fetch only, don't update working tree")
+    p.add_option('--background-gc',
+                 dest='background_gc', action='store_true',
+                 help='run git gc in a detached background process')
+    p.add_option('--plan',
+                 dest='plan', action='store_true',
+                 help='show what a sync would do and how long fetching would '
+                      'take, without network access, and exit')
+    p.add_option('--json',
+                 dest='json', action='store_true',
+                 help='with --plan, print the plan as JSON')
+    p.add_option('--stats',
+                 dest='stats', action='store_true',
+                 help='show the slowest and flakiest projects of past syncs '
+                      'and exit')
+    p.add_option('--interleaved',
+                 dest='interleaved', action='store_true',
+                 help='update the working tree of each project as soon as '
+                      'it has been fetched')
     p.add_option('-d', '--detach',
                  dest='detach_head', action='store_true',
                  help='detach projects back to manifest revision')
@@ -226,6 +286,10 @@ later is required to fix a server side protocol bug.
     p.add_option('-j', '--jobs',
                  dest='jobs', action='store', type='int',
                  help="projects to fetch simultaneously (default %d)" % self.jobs)
+    p.add_option('--jobs-checkout',
+                 dest='jobs_checkout', action='store', type='int',
+                 help='number of work trees to update simultaneously '
+                      '(default: -j, at most the number of CPUs)')
     p.add_option('-m', '--manifest-name',
                  dest='manifest_name',
                  help='temporary manifest to use for this sync', metavar='NAME.xml')
@@ -249,6 +313,9 @@ later is required to fix a server side protocol bug.
                  help='only fetch projects fixed to sha1 if revision does not exist locally')
     p.add_option('--prune', dest='prune', action='store_true',
                  help='delete refs that no longer exist on the remote')
+    p.add_option('--precheck', dest='precheck', action='store_true',
+                 help="skip fetching projects whose remote refs "
+                      "haven't changed")
     if show_smart:
       p.add_option('-s', '--smart-sync',
                    dest='smart_sync', action='store_true',
@@ -265,28 +332,61 @@ later is required to fix a server side protocol bug.
                  dest='repo_upgraded', action='store_true',
                  help=SUPPRESS_HELP)
 
-  def _FetchProjectList(self, opt, projects, sem, *args, **kwargs):
-    """Main function of the fetch threads when jobs are > 1.
+  def _FetchProjectList(self, opt, projects, scheduler, retries,
+                        *args, **kwargs):
+    """Main function of the fetch workers.
 
-    Delegates most of the work to _FetchHelper.
+    Projects in |projects| share an object directory, so they are fetched one
+    after another.  When possible, only the first one is fetched from the
+    network and the others copy its refs, since the objects are already
+    there (see Project.CanShareFetch()).  Delegates most of the work to
+    _FetchHelper.
 
     Args:
       opt: Program options returned from optparse.  See _Options().
       projects: Projects to fetch.
-      sem: We'll release() this semaphore when we exit so that another thread
-          can be started up.
+      scheduler: The Scheduler running this task.  We'll stop it if a fetch
+          fails and --force-broken was not given.
+      retries: _FetchRetries deciding whether and when a failed fetch is
+          retried.  The retry is deferred on |scheduler|, so that this worker
+          can fetch other projects in the meantime.
       *args, **kwargs: Remaining arguments to pass to _FetchHelper. See the
           _FetchHelper docstring for details.
     """
-    try:
-        for project in projects:
-          success = self._FetchHelper(opt, project, *args, **kwargs)
-          if not success and not opt.force_broken:
-            break
-    finally:
-        sem.release()
+    fetched_sibling = None
+    for i, project in enumerate(projects):
+      sibling = None
+      if fetched_sibling and project.CanShareFetch(
+          fetched_sibling, current_branch_only=opt.current_branch_only,
+          no_tags=opt.no_tags):
+        sibling = fetched_sibling
+      can_retry = retries.CanRetry(project)
+      success = self._FetchHelper(opt, project, *args, can_retry=can_retry,
+                                  fetched_sibling=sibling,
+                                  is_new=retries.IsNew(project), **kwargs)
+      if success:
+        # Only a project that was fetched from the network has refs worth
+        # copying; see --optimized-fetch and --precheck.
+        if fetched_sibling is None and project.network_fetched:
+          fetched_sibling = project
+        continue
+      if can_retry and not scheduler.stopped:
+        # Retry the remaining projects too: they share an object directory
+        # with the failed one and must not be fetched concurrently with it.
+        delay = retries.Schedule(project)
+        print('warn: Cannot fetch %s, retrying in %d seconds'
+              % (project.name, delay), file=sys.stderr)
+        remaining = projects[i:]
+        scheduler.Defer(remaining, delay,
+                        keys=self._FetchKeys(scheduler, remaining))
+        break
+      if not opt.force_broken:
+        scheduler.Stop()
+        break
 
-  def _FetchHelper(self, opt, project, lock, fetched, pm, err_event):
+  def _FetchHelper(self, opt, project, lock, fetched, pm, err_event,
+                   on_fetched=None, remote_refs=None, can_retry=False,
+                   fetched_sibling=None, is_new=None):
     """Fetch git objects for a single project.
 
     Args:
@@ -300,6 +400,15 @@ later is required to fix a server side protocol bug.
           lock held).
       err_event: We'll set this event in the case of an error (after printing
           out info about the error).
+      on_fetched: If set, called with |project| after a successful fetch.
+      remote_refs: dict of the refs advertised by each project's remote,
+          keyed by gitdir; see _ListRemoteRefs().
+      can_retry: Whether the caller will retry the fetch if it fails.  If
+          so, a failure is not reported as an error.
+      fetched_sibling: Project sharing the objdir of |project| that was just
+          fetched; see Project.Sync_NetworkHalf().
+      is_new: Whether to fetch |project| as a new clone, by default if it
+          does not exist yet.
 
     Returns:
       Whether the fetch was successful.
@@ -312,12 +421,12 @@ later is required to fix a server side protocol bug.
 
     # Encapsulate everything in a try/except/finally so that:
     # - We always set err_event in the case of an exception.
-    # - We always make sure we call sem.release().
     # - We always make sure we unlock the lock if we locked it.
     start = time.time()
     success = False
     try:
       try:
+        refs_before = dict(project.bare_ref.all) if project.Exists else {}
         success = project.Sync_NetworkHalf(
           quiet=opt.quiet,
           current_branch_only=opt.current_branch_only,
@@ -325,14 +434,22 @@ later is required to fix a server side protocol bug.
           clone_bundle=not opt.no_clone_bundle,
           no_tags=opt.no_tags, archive=self.manifest.IsArchive,
           optimized_fetch=opt.optimized_fetch,
-          prune=opt.prune)
-        self._fetch_times.Set(project, time.time() - start)
+          prune=opt.prune,
+          remote_refs=(remote_refs or {}).get(project.gitdir),
+          retry_fetches=0,
+          fetched_sibling=fetched_sibling,
+          is_new=is_new)
+        changed = success and project.bare_ref.all != refs_before
+        self._fetch_history.Record(project, time.time() - start, success,
+                                   changed=changed)
 
         # Lock around all the rest of the code, since printing, updating a set
         # and Progress.update() are not thread safe.
         lock.acquire()
         did_lock = True
 
+        if not success and can_retry:
+          raise _FetchError()
         if not success:
           err_event.set()
           print('error: Cannot fetch %s from %s'
@@ -345,7 +462,11 @@ later is required to fix a server side protocol bug.
             raise _FetchError()
 
         fetched.add(project.gitdir)
+        if changed:
+          self._fetch_changed.append((project, start))
         pm.update()
+        if on_fetched and success:
+          on_fetched(project)
       except _FetchError:
         pass
       except Exception as e:
@@ -356,15 +477,94 @@ later is required to fix a server side protocol bug.
     finally:
       if did_lock:
         lock.release()
+      if (opt.network_only or self.manifest.IsMirror or
+          self.manifest.IsArchive):
+        # No working tree update follows, the project is done.
+        close_cat_files(project.gitdir)
       finish = time.time()
       self.event_log.AddSync(project, event_log.TASK_SYNC_NETWORK,
                              start, finish, success)
 
     return success
 
-  def _Fetch(self, projects, opt):
+  def _FetchKeys(self, scheduler, projects):
+    """Tag |projects| with their remote and host for concurrency limits.
+
+    The limits come from the sync-j attribute of the manifest <remote> and
+    from the sync.<host>.jobs git config option; they are set on |scheduler|
+    as a side effect.
+
+    Returns:
+      The keys to queue |projects| with, see Scheduler.Add().
+    """
+    keys = set()
+    for project in projects:
+      remote = project.remote
+      if remote.syncJ:
+        key = 'remote:%s' % (remote.orig_name or remote.name)
+        scheduler.SetLimit(key, remote.syncJ)
+        keys.add(key)
+      host = GetHostFromUrl(remote.url or '')
+      jobs = self._HostJobs(host) if host else None
+      if jobs:
+        key = 'host:%s' % host
+        scheduler.SetLimit(key, jobs)
+        keys.add(key)
+    return keys
+
+  def _HostJobs(self, host):
+    """The sync.<host>.jobs limit of concurrent fetches from |host|."""
+    if host not in self._host_jobs:
+      config = self.manifest.manifestProject.config
+      name = 'sync.%s.jobs' % host
+      jobs = config.GetInt(name)
+      if config.GetString(name) is not None and (jobs is None or jobs < 1):
+        print('warning: ignoring invalid %s %s'
+              % (name, config.GetString(name)), file=sys.stderr)
+        jobs = None
+      self._host_jobs[host] = jobs
+    return self._host_jobs[host]
+
+  def _ListRemoteRefs(self, opt, projects):
+    """Query the remote refs of existing projects, once per gitdir.
+
+    Returns:
+      dict mapping gitdir to the result of Project.LsRemote().  Projects that
+      could not be queried are left out; they will simply be fetched.
+    """
+    by_gitdir = {}
+    for project in projects:
+      if project.Exists:
+        by_gitdir.setdefault(project.gitdir, project)
+
+    remote_refs = {}
+    lock = _threading.Lock()
+    pm = Progress('Checking remotes', len(by_gitdir),
+                  print_newline=not(opt.quiet),
+                  always_print_percentage=opt.quiet)
+
+    def _LsRemote(project):
+      refs = project.LsRemote()
+      with lock:
+        if refs is not None:
+          remote_refs[project.gitdir] = refs
+        pm.update()
+
+    scheduler = Scheduler(self.jobs)
+    for project in by_gitdir.values():
+      scheduler.Add(project, keys=self._FetchKeys(scheduler, [project]))
+    scheduler.Run(_LsRemote)
+    pm.end()
+    return remote_refs
+
+  def _Fetch(self, projects, opt, on_fetched=None):
     fetched = set()
     lock = _threading.Lock()
+
+    remote_refs = None
+    if opt.precheck and not self.manifest.IsArchive:
+      remote_refs = self._ListRemoteRefs(opt, projects)
+
     pm = Progress('Fetching projects', len(projects),
                   print_newline=not(opt.quiet),
                   always_print_percentage=opt.quiet)
@@ -373,56 +573,66 @@ later is required to fix a server side protocol bug.
     for project in projects:
       objdir_project_map.setdefault(project.objdir, []).append(project)
 
-    threads = set()
-    sem = _threading.Semaphore(self.jobs)
-    err_event = _threading.Event()
+    # Projects sharing an object directory are fetched serially by a single
+    # worker; hand out the most expensive groups first so that the long tail
+    # of a sync is spread over all workers.
+    scheduler = Scheduler(self.jobs)
     for project_list in objdir_project_map.values():
-      # Check for any errors before running any more tasks.
-      # ...we'll let existing threads finish, though.
-      if err_event.isSet() and not opt.force_broken:
-        break
+      cost = sum(self._fetch_history.Get(p) for p in project_list)
+      scheduler.Add(project_list, cost,
+                    keys=self._FetchKeys(scheduler, project_list))
 
-      sem.acquire()
-      kwargs = dict(opt=opt,
-                    projects=project_list,
-                    sem=sem,
-                    lock=lock,
-                    fetched=fetched,
-                    pm=pm,
-                    err_event=err_event)
-      if self.jobs > 1:
-        t = _threading.Thread(target = self._FetchProjectList,
-                              kwargs = kwargs)
-        # Ensure that Ctrl-C will not freeze the repo process.
-        t.daemon = True
-        threads.add(t)
-        t.start()
-      else:
-        self._FetchProjectList(**kwargs)
+    err_event = _threading.Event()
+    retries = _FetchRetries()
+    def _FetchTask(project_list):
+      self._FetchProjectList(opt, project_list, scheduler, retries,
+                             lock=lock,
+                             fetched=fetched,
+                             pm=pm,
+                             err_event=err_event,
+                             on_fetched=on_fetched,
+                             remote_refs=remote_refs)
+    scheduler.Run(_FetchTask)
+    pm.end()
 
-    for t in threads:
-      t.join()
+    # Save the history before giving up, so that it keeps the failures.
+    self._RecordReceived()
+    self._fetch_history.Save()
 
     # If we saw an error, exit with code 1 so that other scripts can check.
     if err_event.isSet() and not opt.force_broken:
       print('\nerror: Exited sync due to fetch errors', file=sys.stderr)
       sys.exit(1)
 
-    pm.end()
-    self._fetch_times.Save()
+    if not opt.quiet and scheduler.jobs > 1:
+      print('Fetch worker utilization: %s' % scheduler.FormatUtilization(),
+            file=sys.stderr)
+    if retries.count:
+      print('Fetch retries: %s' % retries.Format(), file=sys.stderr)
 
     if not self.manifest.IsArchive:
-      self._GCProjects(projects)
+      self._GCProjects(projects, opt)
 
     return fetched
 
-  def _GCProjects(self, projects):
+  def _RecordReceived(self):
+    """Add what the fetches that changed refs received to the history.
+
+    Object directories are only scanned now, once, for the files written
+    since each of these fetches started.
+    """
+    for project, start in self._fetch_changed:
+      stats = ObjectStats(project.objdir, since=start)
+      self._fetch_history.RecordReceived(project, stats.size, stats.objects)
+    self._fetch_changed = []
+
+  def _GCProjects(self, projects, opt):
     gc_gitdirs = {}
     for project in projects:
       if len(project.manifest.GetProjectsWithName(project.name)) > 1:
         print('Shared project %s found, disabling pruning.' % project.name)
         project.bare_git.config('--replace-all', 'gc.pruneExpire', 'never')
-      gc_gitdirs[project.gitdir] = project.bare_git
+      gc_gitdirs[project.gitdir] = project
 
     has_dash_c = git_require((1, 7, 2))
     if multiprocessing and has_dash_c:
@@ -431,45 +641,127 @@ later is required to fix a server side protocol bug.
       cpu_count = 1
     jobs = min(self.jobs, cpu_count)
 
-    if jobs < 2:
-      for bare_git in gc_gitdirs.values():
-        bare_git.gc('--auto')
+    # Only repositories past git's own gc --auto thresholds get a git gc.
+    repos = []
+    for gitdir, project in gc_gitdirs.items():
+      repos.append((gitdir,
+                    project.config.GetInt('gc.auto'),
+                    project.config.GetInt('gc.autoPackLimit')))
+    tasks = gc_planner.Plan(repos, cpu_count)
+    if not tasks:
       return
 
-    config = {'pack.threads': cpu_count // jobs if cpu_count > jobs else 1}
+    if opt.background_gc:
+      lock_path = os.path.join(self.manifest.repodir, 'gc.lock')
+      log_path = os.path.join(self.manifest.repodir, 'gc.log')
+      if gc_planner.IsLocked(lock_path):
+        if not opt.quiet:
+          print('Background gc already running, not starting another one.',
+                file=sys.stderr)
+        return
+      if gc_planner.RunInBackground(tasks, lock_path, log_path):
+        if not opt.quiet:
+          print('Running gc of %d projects in the background, see %s'
+                % (len(tasks), log_path), file=sys.stderr)
+        return
 
-    threads = set()
-    sem = _threading.Semaphore(jobs)
     err_event = _threading.Event()
 
-    def GC(bare_git):
-      try:
-        try:
-          bare_git.gc('--auto', config=config)
-        except GitError:
-          err_event.set()
-        except:
-          err_event.set()
-          raise
-      finally:
-        sem.release()
-
-    for bare_git in gc_gitdirs.values():
+    def GC(task):
       if err_event.isSet():
-        break
-      sem.acquire()
-      t = _threading.Thread(target=GC, args=(bare_git,))
-      t.daemon = True
-      threads.add(t)
-      t.start()
+        return
+      project = gc_gitdirs[task.gitdir]
+      config = None
+      if has_dash_c:
+        config = {'pack.threads': task.threads}
+      try:
+        project.bare_git.gc('--auto', config=config)
+      except GitError:
+        err_event.set()
 
-    for t in threads:
-      t.join()
+    scheduler = Scheduler(jobs)
+    for task in tasks:
+      scheduler.Add(task, task.size)
+    scheduler.Run(GC)
 
     if err_event.isSet():
       print('\nerror: Exited sync due to gc errors', file=sys.stderr)
       sys.exit(1)
 
+  def _Plan(self, opt, args):
+    """Print what a sync would do, without network access or changes."""
+    all_projects = self.GetProjects(args,
+                                    missing_ok=True,
+                                    submodules_ok=opt.fetch_submodules)
+    history = _FetchHistory(self.manifest).Entries()
+    # Projects that were never fetched are assumed to take a typical time.
+    known = sorted(e['time'] for e in history.values())
+    typical = known[len(known) // 2] if known else None
+
+    entries = []
+    groups = {}
+    for project in all_projects:
+      if opt.local_only:
+        network = None
+      else:
+        network = project.PlanNetworkHalf(
+            current_branch_only=opt.current_branch_only,
+            optimized_fetch=opt.optimized_fetch)
+      local = None
+      if project.worktree and not opt.network_only:
+        if network == 'clone':
+          local = 'checkout'
+        else:
+          local = project.PlanLocalHalf(detach_head=opt.detach_head)
+
+      estimate = 0.0
+      if network in ('clone', 'fetch'):
+        entry = history.get(project.name)
+        estimate = entry['time'] if entry else typical
+      entry = {
+          'path': project.relpath,
+          'name': project.name,
+          'network': network,
+          'local': local,
+          'estimate': estimate,
+          'worker': None,
+          'start': None,
+      }
+      entries.append(entry)
+      if network in ('clone', 'fetch'):
+        groups.setdefault(project.objdir, []).append(entry)
+
+    total = 0.0
+    schedule = Simulate(
+        [(g, sum(e['estimate'] or 0 for e in g)) for g in groups.values()],
+        self.jobs)
+    for group, worker, start, end in schedule:
+      # Projects sharing an objdir are fetched one after another.
+      for entry in group:
+        entry['worker'] = worker
+        entry['start'] = start
+        start += entry['estimate'] or 0
+      total = max(total, end)
+
+    if opt.json:
+      json.dump({'jobs': self.jobs,
+                 'estimated_fetch_time': total,
+                 'projects': entries}, sys.stdout, indent=2, sort_keys=True)
+      print()
+      return
+
+    print('Sync plan for %d projects with -j%d, estimated fetch time %s:'
+          % (len(entries), self.jobs, _FormatDuration(total)))
+    width = max([len('PROJECT')] + [len(e['path']) for e in entries])
+    fmt = '  %%-%ds  %%-7s  %%-12s  %%8s  %%6s  %%8s' % width
+    print(fmt % ('PROJECT', 'NETWORK', 'WORK TREE', 'ESTIMATE', 'WORKER',
+                 'START'))
+    for e in entries:
+      print(fmt % (e['path'], e['network'] or '-', e['local'] or '-',
+                   _FormatDuration(e['estimate']),
+                   '-' if e['worker'] is None else '#%d' % (e['worker'] + 1),
+                   '-' if e['start'] is None else _FormatDuration(e['start'])))
+
   def _ReloadManifest(self, manifest_name=None):
     if manifest_name:
       # Override calls _Unload already
@@ -594,6 +886,11 @@ later is required to fix a server side protocol bug.
     return 0
 
   def Execute(self, opt, args):
+    if opt.stats:
+      for line in _FetchHistory(self.manifest).FormatStats():
+        print(line)
+      return
+
     if opt.jobs:
       self.jobs = opt.jobs
     if self.jobs > 1:
@@ -624,6 +921,10 @@ later is required to fix a server side protocol bug.
     if opt.manifest_name:
       self.manifest.Override(opt.manifest_name)
 
+    if opt.plan:
+      self._Plan(opt, args)
+      return
+
     manifest_name = opt.manifest_name
     smart_sync_manifest_name = "smart_sync_override.xml"
     smart_sync_manifest_path = os.path.join(
@@ -803,16 +1104,37 @@ later is required to fix a server side protocol bug.
                                     missing_ok=True,
                                     submodules_ok=opt.fetch_submodules)
 
-    self._fetch_times = _FetchTimes(self.manifest)
+    syncbuf = SyncBuffer(mp.config,
+                         detach_head = opt.detach_head)
+    local_stage = None
+
+    self._fetch_history = _FetchHistory(self.manifest)
+    self._fetch_changed = []
+    self._host_jobs = {}
     if not opt.local_only:
       to_fetch = []
       now = time.time()
       if _ONE_DAY_S <= (now - rp.LastFetch):
         to_fetch.append(rp)
       to_fetch.extend(all_projects)
-      to_fetch.sort(key=self._fetch_times.Get, reverse=True)
+      to_fetch.sort(key=self._fetch_history.Get, reverse=True)
+
+      on_fetched = None
+      if (opt.interleaved and not opt.network_only and
+          not self.manifest.IsMirror and not self.manifest.IsArchive):
+        # Obsolete projects have to be out of the way before any work tree is
+        # touched.
+        if self.UpdateProjectList(opt):
+          sys.exit(1)
+        local_stage = _LocalHalfStage(self, opt, all_projects, syncbuf,
+                                      self._CheckoutJobs(opt))
+        on_fetched = local_stage.Add
 
-      fetched = self._Fetch(to_fetch, opt)
+      try:
+        fetched = self._Fetch(to_fetch, opt, on_fetched=on_fetched)
+      finally:
+        if local_stage:
+          local_stage.Finish()
       _PostRepoFetch(rp, opt.no_repo_verify)
       if opt.network_only:
         # bail out now; the rest touches the working tree
@@ -846,17 +1168,15 @@ later is required to fix a server side protocol bug.
     if self.UpdateProjectList(opt):
       sys.exit(1)
 
-    syncbuf = SyncBuffer(mp.config,
-                         detach_head = opt.detach_head)
-    pm = Progress('Syncing work tree', len(all_projects))
-    for project in all_projects:
-      pm.update()
-      if project.worktree:
-        start = time.time()
-        project.Sync_LocalHalf(syncbuf, force_sync=opt.force_sync)
-        self.event_log.AddSync(project, event_log.TASK_SYNC_LOCAL,
-                               start, time.time(), syncbuf.Recently())
-    pm.end()
+    done = set()
+    if local_stage:
+      done = local_stage.done
+    remaining = [p for p in all_projects if p.gitdir not in done]
+    local_stage = _LocalHalfStage(self, opt, remaining, syncbuf,
+                                  self._CheckoutJobs(opt))
+    for project in remaining:
+      local_stage.Add(project)
+    local_stage.Finish()
     print(file=sys.stderr)
     if not syncbuf.Finish():
       sys.exit(1)
@@ -866,6 +1186,135 @@ later is required to fix a server side protocol bug.
     if self.manifest.notice:
       print(self.manifest.notice)
 
+  def _CheckoutJobs(self, opt):
+    """Number of work trees to update in parallel."""
+    if opt.jobs_checkout:
+      return opt.jobs_checkout
+    # Work tree updates are disk and CPU bound; don't go beyond the number of
+    # CPUs just because a high -j was picked for the network.
+    if multiprocessing:
+      return max(1, min(self.jobs, multiprocessing.cpu_count()))
+    return 1
+
+  def _SyncLocalHalf(self, opt, project, syncbuf):
+    """Update the working tree of a single project."""
+    start = time.time()
+    try:
+      project.Sync_LocalHalf(syncbuf, force_sync=opt.force_sync)
+    finally:
+      close_cat_files(project.gitdir)
+    self.event_log.AddSync(project, event_log.TASK_SYNC_LOCAL,
+                           start, time.time(), syncbuf.Recently())
+
+
+class _LocalHalfStage(object):
+  """Updates working trees on a pool of worker threads.
+
+  Projects are handed to Add() once they are ready, e.g. as their fetch
+  completes.  A project nested inside the working tree of another project
+  waits until the enclosing project has been updated, so checkouts happen in
+  the same parent before child order as a serial sync.  With more than one
+  worker, copied and linked files are written one project at a time once all
+  checkouts are done.
+  """
+
+  def __init__(self, cmd, opt, projects, syncbuf, jobs=1):
+    self._cmd = cmd
+    self._opt = opt
+    self._syncbuf = syncbuf
+    self._lock = _threading.Lock()
+    self._waiting = {}
+    self._queued = set()
+    self._finishing = False
+    self._exc_info = None
+    self.done = set()
+
+    projects = [p for p in projects if p.worktree]
+    self._order = dict((p.gitdir, i) for i, p in enumerate(projects))
+    self._parents = _EnclosingProjects(projects)
+
+    self._pm = Progress('Syncing work tree', len(projects))
+    if jobs > 1:
+      # Copied and linked files may land in the working tree of any project;
+      # only write them once all checkouts are done.
+      syncbuf.HoldCopyAndLink()
+    self._scheduler = Scheduler(jobs)
+    self._scheduler.Hold()
+    self._thread = _threading.Thread(target=self._Main)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Add(self, project):
+    """Queue the working tree update of a freshly fetched project."""
+    if project.gitdir not in self._order:
+      return
+    with self._lock:
+      self._waiting[project.gitdir] = project
+      self._QueueReady()
+
+  def Finish(self):
+    """Wait for all queued updates, including ones still blocked.
+
+    Projects whose enclosing project was never added are no longer held back,
+    but still wait for enclosing projects that were.
+    """
+    with self._lock:
+      self._finishing = True
+      self._QueueReady()
+    self._scheduler.Close()
+    self._thread.join()
+    self._pm.end()
+    self._syncbuf.RunCopyAndLink()
+    if self._exc_info:
+      if sys.version_info[0] >= 3:
+        raise self._exc_info[1].with_traceback(self._exc_info[2])
+      raise self._exc_info[1]
+
+  def _Main(self):
+    try:
+      self._scheduler.Run(self._Run)
+    except BaseException:
+      self._exc_info = sys.exc_info()
+
+  def _Ready(self, parent):
+    if parent in self.done:
+      return True
+    return (self._finishing and parent not in self._waiting and
+            parent not in self._queued)
+
+  def _QueueReady(self):
+    for gitdir, project in list(self._waiting.items()):
+      if all(self._Ready(p) for p in self._parents[gitdir]):
+        del self._waiting[gitdir]
+        self._queued.add(gitdir)
+        self._scheduler.Add(project, -self._order[gitdir])
+
+  def _Run(self, project):
+    try:
+      with self._lock:
+        self._pm.update()
+      self._cmd._SyncLocalHalf(self._opt, project, self._syncbuf)
+    finally:
+      with self._lock:
+        self._queued.discard(project.gitdir)
+        self.done.add(project.gitdir)
+        self._QueueReady()
+
+
+def _EnclosingProjects(projects):
+  """Map each project's gitdir to the gitdirs of projects containing it."""
+  result = {}
+  stack = []
+  # Sort by path components so that 'a/b' directly follows 'a' (and not
+  # 'a-b'), which keeps every project right after its ancestors.
+  for project in sorted(projects, key=lambda p: p.relpath.split('/')):
+    while stack and not project.relpath.startswith(stack[-1].relpath + '/'):
+      stack.pop()
+    result[project.gitdir] = [p.gitdir for p in stack]
+    stack.append(project)
+  return result
+
+
 def _PostRepoUpgrade(manifest, quiet=False):
   wrapper = Wrapper()
   if wrapper.NeedSetupGnuPG():
@@ -940,64 +1389,236 @@ def _VerifyTag(project):
   return True
 
 
-class _FetchTimes(object):
+class _FetchRetries(object):
+  """Counts the failed fetches of a sync and when to retry them.
+
+  The retry policy comes from the project's remote, see
+  RemoteSpec.RetryDelay().
+  """
+
+  def __init__(self):
+    self._lock = _threading.Lock()
+    self._attempts = {}
+    self._new = {}
+    self.count = 0
+    self.backoff = 0.0
+
+  def IsNew(self, project):
+    """Whether |project| had not been cloned when it was first fetched.
+
+    A failed clone leaves a git directory behind; its retry still has to
+    be fetched like a new project.
+    """
+    with self._lock:
+      if project.gitdir not in self._new:
+        self._new[project.gitdir] = not project.Exists
+      return self._new[project.gitdir]
+
+  def CanRetry(self, project):
+    with self._lock:
+      return self._attempts.get(project.gitdir, 0) < project.remote.fetchRetries
+
+  def Schedule(self, project):
+    """Record a retry of |project|; returns the seconds to wait first."""
+    with self._lock:
+      attempt = self._attempts.get(project.gitdir, 0) + 1
+      self._attempts[project.gitdir] = attempt
+      delay = project.remote.RetryDelay(attempt)
+      self.count += 1
+      self.backoff += delay
+      return delay
+
+  def Format(self):
+    """One line summary of the retries, suitable for end of run output."""
+    return '%d retries of %d projects, %d seconds of backoff' % (
+        self.count, len(self._attempts), self.backoff)
+
+
+class _FetchHistory(object):
+  """Persistent record of past fetches, per project name.
+
+  For every project this keeps a smoothed fetch time (used to schedule the
+  slowest fetches first), what the last fetch received, how many fetches
+  failed and when the remote last had changes.  Entries of projects that
+  were not fetched for a while are kept, so that syncing a subset of the
+  projects does not lose the history of the others.
+  """
   _ALPHA = 0.5
+  _EXPIRE_S = 90 * _ONE_DAY_S
 
   def __init__(self, manifest):
-    self._path = os.path.join(manifest.repodir, '.repo_fetchtimes.json')
-    self._times = None
-    self._seen = set()
+    self._path = os.path.join(manifest.repodir, '.repo_fetchhistory.json')
+    # Fetch times written by older versions of repo seed the history.
+    self._old_path = os.path.join(manifest.repodir, '.repo_fetchtimes.json')
+    self._lock = _threading.Lock()
+    self._history = None
 
   def Get(self, project):
-    self._Load()
-    return self._times.get(project.name, _ONE_DAY_S)
-
-  def Set(self, project, t):
-    self._Load()
-    name = project.name
-    old = self._times.get(name, t)
-    self._seen.add(name)
-    a = self._ALPHA
-    self._times[name] = (a*t) + ((1-a) * old)
+    """Expected time to fetch |project|, in seconds."""
+    with self._lock:
+      self._Load()
+      entry = self._history.get(project.name)
+    if not entry:
+      return _ONE_DAY_S
+    return entry['time']
+
+  def Record(self, project, duration, success, changed=False):
+    """Add the outcome of one fetch of |project| to its history.
+
+    What the fetch received is left at nothing until RecordReceived() is
+    called.
+    """
+    now = time.time()
+    with self._lock:
+      self._Load()
+      entry = self._history.setdefault(project.name, {
+          'time': duration,
+          'fetches': 0,
+          'failures': 0,
+          'bytes': 0,
+          'objects': 0,
+          'last_fetch': now,
+          'last_changed': None,
+      })
+      entry['fetches'] += 1
+      entry['last_fetch'] = now
+      if not success:
+        entry['failures'] += 1
+        return
+      a = self._ALPHA
+      entry['time'] = (a * duration) + ((1 - a) * entry['time'])
+      entry['bytes'] = 0
+      entry['objects'] = 0
+      if changed:
+        entry['last_changed'] = now
+
+  def RecordReceived(self, project, received_bytes, received_objects):
+    """Set what the last fetch of |project| received."""
+    with self._lock:
+      self._Load()
+      entry = self._history.get(project.name)
+      if entry:
+        entry['bytes'] = received_bytes
+        entry['objects'] = received_objects
+
+  def Entries(self):
+    """The history as a dict mapping project names to their entry."""
+    with self._lock:
+      self._Load()
+      return dict(self._history)
 
   def _Load(self):
-    if self._times is None:
-      try:
-        f = open(self._path)
-        try:
-          self._times = json.load(f)
-        finally:
-          f.close()
-      except (IOError, ValueError):
-        try:
-          platform_utils.remove(self._path)
-        except OSError:
-          pass
-        self._times = {}
+    if self._history is not None:
+      return
+    self._history = self._Read(self._path)
+    if self._history is None:
+      old = self._Read(self._old_path) or {}
+      self._history = {}
+      for name, t in old.items():
+        if isinstance(t, (int, float)):
+          self._history[name] = {
+              'time': t, 'fetches': 0, 'failures': 0, 'bytes': 0,
+              'objects': 0, 'last_fetch': time.time(), 'last_changed': None}
+
+  def _Read(self, path):
+    try:
+      with open(path) as f:
+        data = json.load(f)
+      if isinstance(data, dict):
+        return data
+    except (IOError, ValueError):
+      pass
+    return None
 
   def Save(self):
-    if self._times is None:
-      return
+    with self._lock:
+      if self._history is None:
+        return
 
-    to_delete = []
-    for name in self._times:
-      if name not in self._seen:
-        to_delete.append(name)
-    for name in to_delete:
-      del self._times[name]
+      cutoff = time.time() - self._EXPIRE_S
+      for name in list(self._history):
+        if self._history[name].get('last_fetch', 0) < cutoff:
+          del self._history[name]
 
-    try:
-      f = open(self._path, 'w')
       try:
-        json.dump(self._times, f, indent=2)
-      finally:
-        f.close()
-    except (IOError, TypeError):
+        with open(self._path, 'w') as f:
+          json.dump(self._history, f, indent=2, sort_keys=True)
+      except (IOError, TypeError):
+        try:
+          platform_utils.remove(self._path)
+        except OSError:
+          pass
+        return
       try:
-        platform_utils.remove(self._path)
+        platform_utils.remove(self._old_path)
       except OSError:
         pass
 
+  def FormatStats(self, limit=10):
+    """Report of the slowest and flakiest projects, as a list of lines."""
+    entries = self.Entries()
+    lines = []
+    if not entries:
+      return ['No fetch history recorded yet.']
+
+    lines.append('Slowest projects (smoothed fetch time):')
+    slowest = sorted(entries.items(), key=lambda x: (-x[1]['time'], x[0]))
+    for name, entry in slowest[:limit]:
+      lines.append('  %8.1fs  %s (%d objects, %s last fetch)' % (
+          entry['time'], name, entry['objects'],
+          _FormatBytes(entry['bytes'])))
+
+    flaky = [(name, entry) for name, entry in entries.items()
+             if entry['failures']]
+    flaky.sort(key=_FailureRate)
+    lines.append('')
+    if not flaky:
+      lines.append('No failed fetches recorded.')
+    else:
+      lines.append('Flakiest projects (failed / total fetches):')
+      for name, entry in flaky[:limit]:
+        lines.append('  %4d/%-4d  %s' % (entry['failures'], entry['fetches'],
+                                         name))
+
+    stale = [(entry['last_changed'] or 0, name)
+             for name, entry in entries.items()]
+    stale.sort()
+    lines.append('')
+    lines.append('Least recently changed projects:')
+    for last_changed, name in stale[:limit]:
+      if last_changed:
+        when = time.strftime('%Y-%m-%d %H:%M', time.localtime(last_changed))
+      else:
+        when = 'unknown'
+      lines.append('  %16s  %s' % (when, name))
+    return lines
+
+
+def _FailureRate(item):
+  """Sort key putting the (name, entry) items that fail most often first."""
+  name, entry = item
+  return (-float(entry['failures']) / max(1, entry['fetches']), name)
+
+
+def _FormatDuration(seconds):
+  if seconds is None:
+    return '?'
+  if seconds < 60:
+    return '%.1fs' % seconds
+  minutes, seconds = divmod(int(seconds), 60)
+  if minutes < 60:
+    return '%dm%02ds' % (minutes, seconds)
+  return '%dh%02dm' % divmod(minutes, 60)
+
+
+def _FormatBytes(n):
+  for unit in ('B', 'KiB', 'MiB'):
+    if n < 1024:
+      return '%d %s' % (n, unit)
+    n /= 1024.0
+  return '%.1f GiB' % n
+
+
 # This is a replacement for xmlrpc.client.Transport using urllib2
 # and supporting persistent-http[s]. It cannot change hosts from
 # request to request like the normal transport, the real url
@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the command.py module."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+
+import command
+
+
+class _FakeProject(object):
+  def __init__(self, path):
+    self.relpath = os.path.basename(path)
+    self.worktree = path
+    self.gitdir = os.path.join(path, '.git')
+
+
+class GatherGitUnitTest(unittest.TestCase):
+  """Tests Command.GatherGit() with and without asyncio."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.projects = []
+    for i in range(5):
+      path = os.path.join(self.tempdir, 'p%d' % i)
+      subprocess.check_call(['git', 'init', '-q', path])
+      subprocess.check_call(['git', 'config', 'test.id', str(i)], cwd=path)
+      self.projects.append(_FakeProject(path))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Check(self):
+    queries = [(p, ['config', 'test.id']) for p in self.projects]
+    queries.append((self.projects[0], ['config', 'test.nope']))
+    results = command.Command().GatherGit(queries, 2)
+    self.assertEqual([(0, '%d\n' % i, '') for i in range(5)], results[:5])
+    self.assertEqual(1, results[5][0])
+
+  def test_default(self):
+    """Results come back in the order of the queries."""
+    self._Check()
+
+  def test_other_thread(self):
+    """Commands gathered from another thread run as well."""
+    errors = []
+    def _Run():
+      try:
+        self._Check()
+      except Exception as e:
+        errors.append(e)
+    t = threading.Thread(target=_Run)
+    t.start()
+    t.join()
+    self.assertEqual([], errors)
+
+  @unittest.skipIf(command.git_command_async is None, 'no asyncio')
+  def test_wait(self):
+    """An AsyncGitCommand also runs when waited for."""
+    p = command.git_command_async.AsyncGitCommand(
+        self.projects[1], ['config', 'test.id'])
+    self.assertEqual(0, p.Wait())
+    self.assertEqual('1\n', p.stdout)
+
+  def test_threads(self):
+    """Without asyncio threads run the commands."""
+    saved = command.git_command_async
+    command.git_command_async = None
+    try:
+      self._Check()
+    finally:
+      command.git_command_async = saved
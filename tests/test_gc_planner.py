@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the gc_planner.py module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import gc_planner
+
+
+class GcPlannerUnitTest(unittest.TestCase):
+  """Tests the gc planner against fake object directories."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Repo(self, name, loose_in_17=0, packs=0, pack_size=1):
+    """Create a fake gitdir with the given objects."""
+    gitdir = os.path.join(self.tempdir, name)
+    os.makedirs(os.path.join(gitdir, 'objects', '17'))
+    os.makedirs(os.path.join(gitdir, 'objects', 'pack'))
+    for i in range(loose_in_17):
+      with open(os.path.join(gitdir, 'objects', '17', '%038x' % i), 'w') as f:
+        f.write('x')
+    for i in range(packs):
+      path = os.path.join(gitdir, 'objects', 'pack', 'pack-%040x.pack' % i)
+      with open(path, 'w') as f:
+        f.write('x' * pack_size)
+    return gitdir
+
+  def test_clean_repo(self):
+    """Repositories below the thresholds need no gc."""
+    gitdir = self._Repo('clean', loose_in_17=1, packs=1)
+    self.assertIsNone(gc_planner.NeedsGc(gitdir))
+
+  def test_loose_objects(self):
+    """Too many loose objects need gc, unless gc.auto is 0."""
+    gitdir = self._Repo('loose', loose_in_17=3)
+    self.assertIsNone(gc_planner.NeedsGc(gitdir, gc_auto=1024))
+    self.assertTrue(gc_planner.NeedsGc(gitdir, gc_auto=512))
+    self.assertIsNone(gc_planner.NeedsGc(gitdir, gc_auto=0))
+
+  def test_packs(self):
+    """Too many packs need gc, unless gc.autoPackLimit is 0."""
+    gitdir = self._Repo('packs', packs=3)
+    self.assertIsNone(gc_planner.NeedsGc(gitdir, pack_limit=3))
+    self.assertTrue(gc_planner.NeedsGc(gitdir, pack_limit=2))
+    self.assertIsNone(gc_planner.NeedsGc(gitdir, pack_limit=0))
+
+  def test_plan(self):
+    """Only repositories needing gc are planned, big ones get more threads."""
+    big = self._Repo('big', packs=3, pack_size=3000)
+    small = self._Repo('small', packs=3, pack_size=1000)
+    clean = self._Repo('clean', packs=1, pack_size=1000)
+    tasks = gc_planner.Plan([(small, None, 2), (big, None, 2),
+                             (clean, None, 2)], 8)
+    self.assertEqual([big, small], [t.gitdir for t in tasks])
+    self.assertEqual([6, 2], [t.threads for t in tasks])
+
+  def test_lock(self):
+    """The background lock is exclusive and stale locks are taken over."""
+    lock = os.path.join(self.tempdir, 'gc.lock')
+    self.assertFalse(gc_planner.IsLocked(lock))
+    self.assertTrue(gc_planner._AcquireLock(lock))
+    self.assertTrue(gc_planner.IsLocked(lock))
+    self.assertFalse(gc_planner._AcquireLock(lock))
+
+    with open(lock, 'w') as f:
+      f.write('not a pid')
+    self.assertFalse(gc_planner.IsLocked(lock))
+    self.assertTrue(gc_planner._AcquireLock(lock))
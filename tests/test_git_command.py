@@ -14,9 +14,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import shutil
+import subprocess
+import tempfile
 import unittest
 
 import git_command
+from pyversion import is_python3
 
 
 class GitCallUnitTest(unittest.TestCase):
@@ -43,3 +48,145 @@ class GitCallUnitTest(unittest.TestCase):
     self.assertLess(ver, (9999, 9999, 9999))
 
     self.assertNotEqual('', ver.full)
+
+
+class CatFileBatchUnitTest(unittest.TestCase):
+  """Tests the CatFileBatch class against a real repository."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self._Git('init', '-q')
+    os.mkdir(os.path.join(self.tempdir, 'dir'))
+    with open(os.path.join(self.tempdir, 'dir', 'file'), 'w') as f:
+      f.write('hello\n')
+    self._Git('add', '.')
+    self._Git('-c', 'user.name=n', '-c', 'user.email=e', 'commit', '-q',
+              '-m', 'msg')
+    self.gitdir = os.path.join(self.tempdir, '.git')
+    self.head = subprocess.check_output(
+        ['git', 'rev-parse', 'HEAD'], cwd=self.tempdir).decode().strip()
+
+  def tearDown(self):
+    git_command.close_cat_files()
+    shutil.rmtree(self.tempdir)
+
+  def _Git(self, *args):
+    subprocess.check_call(('git',) + args, cwd=self.tempdir)
+
+  def test_info(self):
+    """Names are resolved, missing objects give None."""
+    c = git_command.cat_file(self.gitdir)
+    self.assertEqual(self.head, c.Info('HEAD^0')[0])
+    self.assertEqual('commit', c.Info('HEAD')[1])
+    self.assertEqual(('blob', 6), c.Info('HEAD:dir/file')[1:])
+    self.assertIsNone(c.Info('refs/heads/nope'))
+    self.assertIsNone(c.Info('HEAD:no such file'))
+
+  def test_info_many(self):
+    """Answers come back in order, across several chunks."""
+    c = git_command.cat_file(self.gitdir)
+    names = ['HEAD', 'nope'] * (c._CHUNK + 5)
+    result = c.InfoMany(names)
+    self.assertEqual(len(names), len(result))
+    self.assertEqual(self.head, result[0][0])
+    self.assertIsNone(result[1])
+    self.assertEqual(self.head, result[-2][0])
+
+  def test_contents(self):
+    """Objects are read as bytes, trees are listed."""
+    c = git_command.cat_file(self.gitdir)
+    self.assertEqual(b'hello\n', c.Contents('HEAD:dir/file')[2])
+    self.assertIsNone(c.Contents('nope'))
+    entries = c.TreeEntries('HEAD^{tree}')
+    self.assertEqual(['dir'], list(entries))
+    self.assertEqual('40000', entries['dir'][0])
+    self.assertEqual(c.Info('HEAD:dir')[0], entries['dir'][1])
+    self.assertIsNone(c.TreeEntries('HEAD:dir/file'))
+
+  def test_shared(self):
+    """One instance per gitdir, restarted after it is closed or killed."""
+    c = git_command.cat_file(self.gitdir)
+    self.assertIs(c, git_command.cat_file(self.gitdir + '/'))
+    self.assertEqual(self.head, c.Info('HEAD')[0])
+    c._procs['--batch-check'].kill()
+    self.assertEqual(self.head, c.Info('HEAD')[0])
+    git_command.close_cat_files(self.gitdir)
+    self.assertIsNot(c, git_command.cat_file(self.gitdir))
+
+  def test_limit(self):
+    """Only the most recently used gitdirs keep their processes."""
+    gitdirs = [self.gitdir]
+    for i in range(git_command._MAX_CAT_FILES):
+      gitdir = os.path.join(self.tempdir, 'r%d.git' % i)
+      self._Git('init', '-q', '--bare', gitdir)
+      gitdirs.append(gitdir)
+    first = git_command.cat_file(self.gitdir)
+    first.Info('HEAD')
+    for gitdir in gitdirs[1:]:
+      git_command.cat_file(gitdir).Info('HEAD')
+    self.assertEqual(git_command._MAX_CAT_FILES,
+                     len(git_command._cat_files))
+    self.assertEqual({}, first._procs)
+
+    # An instance dropped from the cache still answers, without keeping its
+    # processes.
+    self.assertEqual(self.head, first.Info('HEAD')[0])
+    self.assertEqual({}, first._procs)
+    self.assertIsNot(first, git_command.cat_file(self.gitdir))
+
+  def test_bad_gitdir(self):
+    """A directory that is no repository raises GitError."""
+    c = git_command.CatFileBatch(os.path.join(self.tempdir, 'dir'))
+    self.assertRaises(git_command.GitError, c.Info, 'HEAD')
+
+
+class GitCommandOutputUnitTest(unittest.TestCase):
+  """Tests capturing and streaming the output of GitCommand."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    subprocess.check_call(['git', 'init', '-q'], cwd=self.tempdir)
+    # Enough names for the output to arrive in several chunks.
+    names = [(u'fé-%04d' % i).encode('utf-8') for i in range(1000)]
+    for name in names:
+      # Bytes, so the names do not depend on the encoding of the locale.
+      open(os.path.join(self.tempdir.encode('utf-8'), name), 'w').close()
+    # GitCommand returns text as native strings.
+    if is_python3():
+      names = [n.decode('utf-8') for n in names]
+    self.names = sorted(names)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Cmd(self, *args):
+    return git_command.GitCommand(None, list(args), cwd=self.tempdir,
+                                  capture_stdout=True, capture_stderr=True)
+
+  def test_wait(self):
+    """Wait() captures everything as text."""
+    p = self._Cmd('-c', 'core.quotePath=false', 'ls-files', '--others')
+    self.assertEqual(0, p.Wait())
+    self.assertEqual(self.names, p.stdout.splitlines())
+    self.assertEqual('', p.stderr)
+
+  def test_records(self):
+    """Records() splits the output at NUL and reports the exit status."""
+    p = self._Cmd('ls-files', '-z', '--others')
+    self.assertEqual(self.names, list(p.Records('\0')))
+    self.assertEqual(0, p.rc)
+
+  def test_records_error(self):
+    """Errors leave no records, the status and standard error."""
+    p = self._Cmd('rev-list', 'no-such-rev')
+    self.assertEqual([], list(p.Records()))
+    self.assertNotEqual(0, p.rc)
+    self.assertIn('no-such-rev', p.stderr)
+
+  def test_records_stop(self):
+    """Stopping early ends the command."""
+    p = self._Cmd('ls-files', '-z', '--others')
+    records = p.Records('\0')
+    self.assertEqual(self.names[0], next(records))
+    records.close()
+    self.assertIsNotNone(p.process.returncode)
@@ -15,9 +15,13 @@
 # limitations under the License.
 
 import os
+import shutil
+import subprocess
+import tempfile
 import unittest
 
 import git_config
+import git_config_file
 
 def fixture(*paths):
   """Return a path relative to test/fixtures.
@@ -63,6 +67,120 @@ class GitConfigUnitTest(unittest.TestCase):
     config = git_config.GitConfig(config_fixture)
     val = config.GetString('empty')
     self.assertEqual(val, None)
+  def test_GetInt(self):
+    """
+    Test config entries with integer values.
+
+    [int]
+        plain = 42
+        kilo = 6k
+        hex = 0x10
+        invalid = true
+
+    """
+    self.assertEqual(self.config.GetInt('int.plain'), 42)
+    self.assertEqual(self.config.GetInt('int.kilo'), 6 * 1024)
+    self.assertEqual(self.config.GetInt('int.hex'), 16)
+    self.assertEqual(self.config.GetInt('int.invalid'), None)
+    self.assertEqual(self.config.GetInt('int.missing'), None)
+
+
+class GitConfigWriteUnitTest(unittest.TestCase):
+  """Tests that GitConfig writes files the way `git config` does."""
+
+  CONFIG = (
+      '# A comment\n'
+      '[core]\n'
+      '\tbare = false ; trailing comment\n'
+      '[remote "origin"]\n'
+      '\turl = https://example.com/a \\\n'
+      '  b\n'
+      '\tfetch = +refs/heads/*:refs/remotes/origin/*\n'
+      '\tfetch = +refs/tags/*:refs/tags/*\n'
+      '[branch "Main"]\n'
+      '\tremote = origin\n'
+      '\tmerge = refs/heads/main\n')
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Config(self, name, text=None):
+    path = os.path.join(self.tempdir, name)
+    if text is not None:
+      with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+  def _GitList(self, path):
+    return subprocess.check_output(
+        ['git', 'config', '--file', path, '--list']).decode('utf-8')
+
+  def test_native_matches_git(self):
+    """The native writer leaves files that read back like git's."""
+    changes = [
+        ('core.bare', ['true']),
+        ('remote.origin.url', ['https://example.com/c']),
+        ('remote.origin.fetch', ['+refs/heads/*:refs/remotes/origin/*']),
+        ('remote.origin.review', ['a;b', ' spaced ', 'tab\there "q" \\']),
+        ('branch.Main.merge', None),
+        ('branch.Main.remote', None),
+        ('branch.new.remote', ['origin']),
+        ('user.name', ['Jane']),
+        ('missing.key', None),
+    ]
+    native = self._Config('native', self.CONFIG)
+    ref = self._Config('ref', self.CONFIG)
+    git_config_file.EditConfig(native, changes)
+    for name, values in changes:
+      if values is None:
+        subprocess.call(['git', 'config', '--file', ref, '--unset-all', name])
+        continue
+      subprocess.check_call(['git', 'config', '--file', ref, '--replace-all',
+                             name, values[0]])
+      for v in values[1:]:
+        subprocess.check_call(['git', 'config', '--file', ref, '--add',
+                               name, v])
+    self.assertEqual(self._GitList(ref), self._GitList(native))
+    with open(ref) as f:
+      ref_text = f.read()
+    with open(native) as f:
+      self.assertEqual(ref_text, f.read())
+    self.assertFalse(os.path.exists(native + '.lock'))
+
+  def test_transaction(self):
+    """Changes in a transaction are written when it ends."""
+    path = self._Config('config', self.CONFIG)
+    config = git_config.GitConfig(path)
+    with config.Transaction():
+      config.SetString('core.bare', 'true')
+      with config.Transaction():
+        config.SetString('user.email', 'jane@example.com')
+      self.assertNotIn('jane@', self._GitList(path))
+    self.assertIn('core.bare=true', self._GitList(path))
+    self.assertIn('user.email=jane@example.com', self._GitList(path))
+    self.assertTrue(config.HasSection('user'))
+
+    config = git_config.GitConfig(path)
+    self.assertEqual(config.GetString('user.email'), 'jane@example.com')
+
+  def test_missing_file(self):
+    """Writing to a missing file creates it."""
+    path = self._Config('new')
+    config = git_config.GitConfig(path)
+    config.SetString('remote.origin.fetch', ['a', 'b'])
+    self.assertEqual(self._GitList(path),
+                     'remote.origin.fetch=a\nremote.origin.fetch=b\n')
+
+  def test_locked(self):
+    """A locked file is not written."""
+    path = self._Config('config', self.CONFIG)
+    open(path + '.lock', 'w').close()
+    self.assertRaises(git_config.GitError, git_config_file.EditConfig,
+                      path, [('core.bare', ['true'])])
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,167 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the git_config_file.py module.
+
+The parser is checked against `git config --list` on the same files.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import git_config_file
+
+# Config files that git accepts.
+VALID = [
+    '',
+    '\n\n# only a comment\n; another\n',
+    '[core]\n\tbare = false\n\tfilemode\n\tempty =\n',
+    '[Core]\n\tBare = true\n[core]\n\tbare = false\n',
+    '[remote "Origin"]\n\turl = a\n\tfetch = 1\n\tfetch = 2\n',
+    '[remote "with \\"quote\\" and \\\\ \\x"]\n\turl = a\n',
+    '[Sec.Sub]\n\tkey = deprecated subsection\n',
+    '[a.b "c"]\n\tkey = v\n',
+    '[sec] key = on the header line\n',
+    '[sec]\n\tkey = v # comment\n\tkey2 = v ; comment\n',
+    '[sec]\n\tkey = "quoted # not a comment ; "\n',
+    '[sec]\n\tkey = a"b"c  "d  e"  f   \n',
+    '[sec]\n\tkey = \t leading and trailing \t \n',
+    '[sec]\n\tkey = tab\\there\\nnewline \\\\ \\" \\b\n',
+    '[sec]\n\tkey = first \\\n  second \\\n\tthird\n',
+    '[sec]\n\tkey = "in quotes \\\ncontinued"\n',
+    '[sec]\n\tkey = no newline at end',
+    '[sec]\r\n\tkey = crlf\r\n\tother = x\r\n',
+    '\xef\xbb\xbf[sec]\n\tkey = bom\n',
+    '[sec]\n  key=tight\n\tkey2   =   spaced\n',
+    '[sec]\n\tkey-with-dash0 = 1\n',
+    '[sec]\n\tkey = caf\xc3\xa9\n',
+    '[sec]\n\tkey = ""\n\tkey2 = "" x\n',
+    'key = before any section\n[sec]\n\tkey = v\n',
+    '[a][b "c"] ; two headers\n\tkey = v\n',
+    '[sec]\n\tkey = backslash at the end \\',
+]
+
+# Config files that git rejects.
+INVALID = [
+    '[sec\n',
+    '[sec "sub\n',
+    '[sec "sub" ]\n',
+    '[sec]\n\t0key = bad\n',
+    '[sec]\n\tkey bad\n',
+    '[sec]\n\tkey = "unterminated\n',
+    '[sec]\n\tkey = bad \\q escape\n',
+    '[se_c]\n\tkey = v\n',
+    '[sec]\n\tkey = "backslash at the end \\',
+]
+
+
+class ParserUnitTest(unittest.TestCase):
+  """Compares ReadConfig() against `git config --list`."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.path = os.path.join(self.tempdir, 'config')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Write(self, path, text):
+    if not isinstance(text, bytes):
+      text = text.encode('latin-1')
+    with open(path, 'wb') as f:
+      f.write(text)
+
+  def _GitList(self, path, *args):
+    """Run `git config --list` like GitConfig._ReadGit() parses it."""
+    cmd = ['git', 'config', '--file', path] + list(args) + ['--null', '--list']
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         cwd=self.tempdir)
+    out, _ = p.communicate()
+    if p.returncode:
+      return None
+    if str is not bytes:
+      out = out.decode('utf-8')
+    config = {}
+    for line in out.rstrip('\0').split('\0'):
+      if not line:
+        continue
+      if '\n' in line:
+        key, val = line.split('\n', 1)
+      else:
+        key, val = line, None
+      config.setdefault(key, []).append(val)
+    return config
+
+  def test_valid(self):
+    """Files git accepts parse to the same variables."""
+    for text in VALID:
+      self._Write(self.path, text)
+      expected = self._GitList(self.path)
+      self.assertIsNotNone(expected, text)
+      self.assertEqual(expected, git_config_file.ReadConfig(self.path), text)
+
+  def test_invalid(self):
+    """Files git rejects are rejected."""
+    for text in INVALID:
+      self._Write(self.path, text)
+      self.assertIsNone(self._GitList(self.path), text)
+      self.assertRaises(git_config_file.ConfigSyntaxError,
+                        git_config_file.ReadConfig, self.path)
+
+  def test_missing(self):
+    """A missing file has no variables."""
+    self.assertEqual({}, git_config_file.ReadConfig(self.path))
+
+  def test_includes(self):
+    """include.path is followed like `git config --includes`."""
+    os.mkdir(os.path.join(self.tempdir, 'sub'))
+    self._Write(os.path.join(self.tempdir, 'sub', 'inc'),
+                '[user]\n\tname = included\n[include]\n\tpath = ../inc2\n')
+    self._Write(os.path.join(self.tempdir, 'inc2'), '[user]\n\temail = e\n')
+    self._Write(self.path,
+                '[user]\n\tname = first\n'
+                '[include]\n\tpath = sub/inc\n\tpath = missing\n'
+                '[user]\n\tname = last\n')
+    self.assertEqual(self._GitList(self.path, '--includes'),
+                     git_config_file.ReadConfig(self.path, includes=True))
+    self.assertEqual(self._GitList(self.path),
+                     git_config_file.ReadConfig(self.path))
+
+  def test_include_if(self):
+    """includeIf conditions are checked against the given gitdir."""
+    gitdir = os.path.join(self.tempdir, 'work', 'proj', '.git')
+    subprocess.check_call(['git', 'init', '-q', '-b', 'topic/x',
+                           os.path.dirname(gitdir)])
+    for name in ('a', 'b', 'c', 'd', 'e'):
+      self._Write(os.path.join(self.tempdir, name),
+                  '[inc]\n\tfrom = %s\n' % name)
+    self._Write(self.path,
+                '[includeIf "gitdir:work/"]\n\tpath = a\n'
+                '[includeIf "gitdir/i:WORK/PROJ/"]\n\tpath = b\n'
+                '[includeIf "gitdir:other/"]\n\tpath = c\n'
+                '[includeIf "onbranch:topic/"]\n\tpath = d\n'
+                '[includeIf "onbranch:main"]\n\tpath = e\n')
+    env = dict(os.environ, GIT_DIR=gitdir)
+    out = subprocess.check_output(
+        ['git', 'config', '--file', self.path, '--includes', '--get-all',
+         'inc.from'], env=env).decode('utf-8').split()
+    config = git_config_file.ReadConfig(self.path, includes=True,
+                                        gitdir=gitdir)
+    self.assertEqual(out, config['inc.from'])
+    self.assertEqual(['a', 'b', 'd'], out)
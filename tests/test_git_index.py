@@ -0,0 +1,134 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the git_index.py module."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+import git_index
+
+
+class IndexUnitTest(unittest.TestCase):
+  """Tests reading indexes written by git."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self._Git('init', '-q')
+    for name in ('a', 'dir/b', 'dir/sub/c', 'long/' + 'x' * 100):
+      self._Write(name, name)
+    os.symlink('a', os.path.join(self.tempdir, 'link'))
+    self._Git('add', '.')
+    self._Git('-c', 'user.name=n', '-c', 'user.email=e', 'commit', '-q',
+              '-m', 'msg')
+    self.index_path = os.path.join(self.tempdir, '.git', 'index')
+    self._Settle()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Git(self, *args):
+    return subprocess.check_output(('git',) + args,
+                                   cwd=self.tempdir).decode('utf-8')
+
+  def _Write(self, name, content):
+    path = os.path.join(self.tempdir, name)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+      f.write(content)
+
+  def _Settle(self):
+    """Make the index newer than the files so they are not racily clean."""
+    later = time.time() + 2
+    os.utime(self.index_path, (later, later))
+
+  def _Read(self):
+    index = git_index.ReadIndex(self.index_path)
+    self.assertIsNotNone(index)
+    return index
+
+  def _CheckEntries(self, version):
+    self._Git('update-index', '--index-version', str(version))
+    self._Settle()
+    index = self._Read()
+    self.assertEqual(version, index.version)
+    expected = []
+    for line in self._Git('ls-files', '-s').splitlines():
+      info, name = line.split('\t')
+      mode, oid, _ = info.split(' ')
+      expected.append((name, int(mode, 8), oid))
+    self.assertEqual(expected, [(e.name, e.mode, e.oid)
+                                for e in index.entries])
+    self.assertEqual([], git_index.ChangedEntries(self.tempdir, index))
+
+  def test_versions(self):
+    """Versions 2, 3 and 4 of the index are read."""
+    self._CheckEntries(2)
+    # git only writes version 3 when there are extended flags.
+    self._Git('update-index', '--skip-worktree', 'a')
+    self._CheckEntries(3)
+    self._CheckEntries(4)
+
+  def test_cache_tree(self):
+    """The cache-tree tells the tree of the whole index until it changes."""
+    self.assertEqual(self._Git('rev-parse', 'HEAD^{tree}').strip(),
+                     self._Read().tree)
+    self._Write('a', 'changed')
+    self._Git('add', 'a')
+    self.assertIsNone(self._Read().tree)
+
+  def test_modified(self):
+    """Changed stat data is noticed."""
+    self._Write('dir/b', 'changed')
+    self._Settle()
+    changed = git_index.ChangedEntries(self.tempdir, self._Read())
+    self.assertEqual(['dir/b'], [e.name for e in changed])
+    os.remove(os.path.join(self.tempdir, 'a'))
+    changed = git_index.ChangedEntries(self.tempdir, self._Read())
+    self.assertEqual(['a', 'dir/b'], [e.name for e in changed])
+
+  def test_racy(self):
+    """Files modified when the index was written need a closer look."""
+    now = time.time()
+    os.utime(self.index_path, (now, now))
+    os.utime(os.path.join(self.tempdir, 'a'), (now, now))
+    self._Git('update-index', '--refresh')
+    index = self._Read()
+    changed = git_index.ChangedEntries(self.tempdir, index)
+    self.assertIn('a', [e.name for e in changed])
+
+  def test_unknown_files(self):
+    """Untracked files and directories are noticed."""
+    index = self._Read()
+    self.assertFalse(git_index.HasUnknownFiles(self.tempdir, index))
+    os.mkdir(os.path.join(self.tempdir, 'empty'))
+    self.assertFalse(git_index.HasUnknownFiles(self.tempdir, index))
+    self._Write('dir/sub/new', '')
+    self.assertTrue(git_index.HasUnknownFiles(self.tempdir, index))
+    os.remove(os.path.join(self.tempdir, 'dir/sub/new'))
+    self._Write('other/deep/new', '')
+    self.assertTrue(git_index.HasUnknownFiles(self.tempdir, index))
+
+  def test_missing(self):
+    """No or a bad index gives None."""
+    self.assertIsNone(git_index.ReadIndex(
+        os.path.join(self.tempdir, 'nope')))
+    self.assertIsNone(git_index.ReadIndex(os.path.join(self.tempdir, 'a')))
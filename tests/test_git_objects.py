@@ -0,0 +1,124 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the git_objects.py module."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+import git_objects
+
+
+class ObjectStatsUnitTest(unittest.TestCase):
+  """Tests the ObjectStats class against repositories made by git."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.gitdir = os.path.join(self.tempdir, 'repo.git')
+    self._Git('init', '-q', '--bare', self.gitdir)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Git(self, *args):
+    subprocess.check_call(('git',) + args, cwd=self.tempdir)
+
+  def _Run(self, args, data):
+    p = subprocess.Popen(['git', '--git-dir', self.gitdir] + args,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, _ = p.communicate(data)
+    self.assertEqual(0, p.returncode)
+    return out
+
+  def _AddBlobs(self, count, start=0):
+    """Write |count| loose blobs and return their ids."""
+    return [self._Run(['hash-object', '-w', '--stdin'],
+                      ('blob %d\n' % i).encode('utf-8')).strip()
+            for i in range(start, start + count)]
+
+  def test_empty(self):
+    """A new repository has no objects."""
+    stats = git_objects.ObjectStats(self.gitdir)
+    self.assertEqual(0, stats.objects)
+    self.assertEqual(0, stats.size)
+
+  def test_missing(self):
+    """Missing directories count as empty."""
+    stats = git_objects.ObjectStats(os.path.join(self.tempdir, 'nope'))
+    self.assertEqual(0, stats.objects)
+
+  def test_loose(self):
+    """Loose objects are counted and sized."""
+    self._AddBlobs(5)
+    stats = git_objects.ObjectStats(self.gitdir)
+    self.assertEqual(5, stats.loose_objects)
+    self.assertEqual(0, stats.packs)
+    self.assertGreater(stats.loose_size, 0)
+
+  def test_packed(self):
+    """Pack indexes give the number of packed objects."""
+    ids = self._AddBlobs(7)
+    self._Run(['pack-objects', '-q',
+               os.path.join(self.gitdir, 'objects', 'pack', 'pack')],
+              b'\n'.join(ids) + b'\n')
+    self._Git('--git-dir', self.gitdir, 'prune-packed')
+    self._AddBlobs(1, start=100)
+    stats = git_objects.ObjectStats(self.gitdir)
+    self.assertEqual(1, stats.packs)
+    self.assertEqual(0, stats.kept_packs)
+    self.assertEqual(7, stats.packed_objects)
+    self.assertEqual(1, stats.loose_objects)
+    self.assertEqual(8, stats.objects)
+
+  def test_since(self):
+    """Only objects written since a point in time are counted."""
+    ids = self._AddBlobs(3)
+    self._Run(['pack-objects', '-q',
+               os.path.join(self.gitdir, 'objects', 'pack', 'pack')],
+              b'\n'.join(ids) + b'\n')
+    self._Git('--git-dir', self.gitdir, 'prune-packed')
+    self._AddBlobs(2, start=100)
+    old = time.time() - 60
+    for dirpath, dirnames, filenames in os.walk(self.gitdir):
+      for name in dirnames + filenames:
+        os.utime(os.path.join(dirpath, name), (old, old))
+    since = time.time() - 30
+    stats = git_objects.ObjectStats(self.gitdir, since=since)
+    self.assertEqual(0, stats.objects)
+
+    self._AddBlobs(4, start=200)
+    stats = git_objects.ObjectStats(self.gitdir, since=since)
+    self.assertEqual(4, stats.loose_objects)
+    self.assertEqual(0, stats.packs)
+    self.assertEqual(9, git_objects.ObjectStats(self.gitdir).objects)
+
+  def test_read_object(self):
+    """Loose and packed objects are read, unknown ones are not."""
+    ids = [i.decode('utf-8') for i in self._AddBlobs(3)]
+    self.assertEqual(('blob', b'blob 0\n'),
+                     git_objects.ReadObject(self.gitdir, ids[0]))
+    self._Run(['pack-objects', '-q',
+               os.path.join(self.gitdir, 'objects', 'pack', 'pack')],
+              '\n'.join(ids).encode('utf-8') + b'\n')
+    self._Git('--git-dir', self.gitdir, 'prune-packed')
+    for i, oid in enumerate(ids):
+      self.assertEqual(('blob', ('blob %d\n' % i).encode('utf-8')),
+                       git_objects.ReadObject(self.gitdir, oid))
+    self.assertIsNone(git_objects.ReadObject(self.gitdir, '0' * 40))
@@ -0,0 +1,192 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the git_refs.py module."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+import git_refs
+import repo_cache
+
+
+def _git(*args, **kwargs):
+  return subprocess.check_output(['git'] + list(args), **kwargs).decode('utf-8')
+
+
+class _RepositoryTestCase(unittest.TestCase):
+  """Sets up a bare repository with two commits."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.gitdir = os.path.join(self.tempdir, 'repo.git')
+    _git('init', '-q', '--bare', '-b', 'main', self.gitdir)
+    env = dict(os.environ, GIT_AUTHOR_NAME='a', GIT_AUTHOR_EMAIL='a@b',
+               GIT_COMMITTER_NAME='a', GIT_COMMITTER_EMAIL='a@b')
+    # The empty tree is always known to git.
+    tree = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+    self.c1 = _git('--git-dir', self.gitdir, 'commit-tree', '-m', '1', tree,
+                   env=env).strip()
+    self.c2 = _git('--git-dir', self.gitdir, 'commit-tree', '-m', '2', tree,
+                   env=env).strip()
+    self.env = env
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Git(self, *args):
+    return _git('--git-dir', self.gitdir, *args, env=self.env)
+
+  def _ShowRef(self):
+    refs = {}
+    for line in self._Git('show-ref', '--head').splitlines():
+      ref_id, name = line.split(' ', 1)
+      refs[name] = ref_id
+    return refs
+
+  def _Tick(self):
+    # Modification times must differ for changes to be noticed.
+    time.sleep(0.01)
+
+
+class GitRefsUnitTest(_RepositoryTestCase):
+  """Tests GitRefs against `git show-ref` on a real repository."""
+
+  def test_incremental(self):
+    """Only changed files are re-read, and the result matches git."""
+    self._Git('update-ref', 'refs/heads/main', self.c1)
+    self._Git('update-ref', 'refs/tags/v1', self.c1)
+    self._Git('pack-refs', '--all')
+    self._Git('update-ref', 'refs/heads/topic', self.c1)
+    refs = git_refs.GitRefs(self.gitdir)
+    self.assertEqual(self._ShowRef(), refs.all)
+
+    reads = []
+    orig_packed = refs._ReadPackedRefs
+    def _CountPacked():
+      reads.append('packed-refs')
+      orig_packed()
+    refs._ReadPackedRefs = _CountPacked
+
+    self._Tick()
+    self._Git('update-ref', 'refs/heads/topic', self.c2)
+    self._Git('update-ref', 'refs/heads/new/nested', self.c2)
+    self._Git('update-ref', 'refs/changes/01/1/1', self.c1)
+    self.assertEqual(self._ShowRef(), refs.all)
+    self.assertEqual([], reads)
+
+    self._Tick()
+    self._Git('update-ref', '-d', 'refs/heads/new/nested')
+    self._Git('update-ref', '-d', 'refs/changes/01/1/1')
+    self._Git('symbolic-ref', 'HEAD', 'refs/heads/topic')
+    self.assertEqual(self._ShowRef(), refs.all)
+    self.assertEqual('refs/heads/topic', refs.symref('HEAD'))
+
+    self._Tick()
+    self._Git('pack-refs', '--all')
+    self.assertEqual(self._ShowRef(), refs.all)
+    self.assertEqual(['packed-refs'], reads)
+
+    self._Tick()
+    self._Git('update-ref', '-d', 'refs/tags/v1')
+    self.assertEqual(self._ShowRef(), refs.all)
+    self.assertNotIn('refs/tags/v1', refs.all)
+
+  def test_get(self):
+    """get() finds loose and packed refs before anything is loaded."""
+    self._Git('update-ref', 'refs/heads/main', self.c1)
+    for i in range(50):
+      self._Git('update-ref', 'refs/tags/t%02d' % i, self.c1)
+    self._Git('tag', '-a', '-m', 'annotated', 'refs/tags/t25a', self.c2)
+    self._Git('pack-refs', '--all')
+    self._Git('update-ref', 'refs/tags/t10', self.c2)
+
+    expected = self._ShowRef()
+    names = list(expected) + ['refs/tags/missing', 'refs/tags/t',
+                              'refs/tags/zz', 'refs/a', 'HEAD']
+    for name in names:
+      refs = git_refs.GitRefs(self.gitdir)
+      self.assertEqual(expected.get(name, ''), refs.get(name), name)
+      self.assertIsNone(refs._phyref)
+
+  def test_get_unsorted(self):
+    """packed-refs without the sorted trait are searched in full."""
+    with open(os.path.join(self.gitdir, 'packed-refs'), 'w') as f:
+      f.write('# pack-refs with: peeled\n'
+              '%s refs/tags/b\n%s refs/tags/a\n' % (self.c1, self.c2))
+    refs = git_refs.GitRefs(self.gitdir)
+    self.assertEqual(self.c2, refs.get('refs/tags/a'))
+    self.assertEqual(self.c1, refs.get('refs/tags/b'))
+
+
+@unittest.skipIf(repo_cache.sqlite3 is None, 'sqlite3 is not available')
+class RefSnapshotUnitTest(_RepositoryTestCase):
+  """Tests the ref snapshots kept across repo commands."""
+
+  def _Age(self):
+    """Make all files of the repository old enough to be trusted."""
+    t = time.time() - 60
+    for top, dirs, files in os.walk(self.gitdir):
+      for name in dirs + files:
+        os.utime(os.path.join(top, name), (t, t))
+    os.utime(self.gitdir, (t, t))
+
+  def _Refs(self):
+    """A GitRefs as a new repo command would create it."""
+    return git_refs.GitRefs(self.gitdir, cache=repo_cache.Open(self.tempdir))
+
+  def test_snapshot(self):
+    """A later command reads only the ref files that changed."""
+    self._Git('update-ref', 'refs/heads/main', self.c1)
+    self._Git('update-ref', 'refs/tags/v1', self.c1)
+    self._Git('pack-refs', '--all')
+    self._Git('update-ref', 'refs/heads/topic', self.c1)
+    self._Git('update-ref', 'refs/heads/other', self.c1)
+    self._Age()
+    self.assertEqual(self._ShowRef(), self._Refs().all)
+
+    reads = []
+    orig_read = git_refs._ReadRefFile
+    def _CountReads(path):
+      reads.append(os.path.relpath(path, self.gitdir))
+      return orig_read(path)
+    git_refs._ReadRefFile = _CountReads
+    try:
+      refs = self._Refs()
+      refs._ReadPackedRefs = lambda: reads.append('packed-refs')
+      self.assertEqual(self._ShowRef(), refs.all)
+      self.assertEqual('refs/heads/main', refs.symref('HEAD'))
+      self.assertEqual([], reads)
+
+      self._Git('update-ref', 'refs/heads/topic', self.c2)
+      refs = self._Refs()
+      self.assertEqual(self._ShowRef(), refs.all)
+      self.assertEqual([os.path.join('refs', 'heads', 'topic')], reads)
+    finally:
+      git_refs._ReadRefFile = orig_read
+
+  def test_missing_gitdir(self):
+    """Snapshots taken before a clone do not hide its refs."""
+    moved = os.path.join(self.tempdir, 'moved')
+    shutil.move(self.gitdir, moved)
+    self.assertEqual({}, self._Refs().all)
+    shutil.move(moved, self.gitdir)
+    self._Git('update-ref', 'refs/heads/main', self.c1)
+    self.assertEqual(self._ShowRef(), self._Refs().all)
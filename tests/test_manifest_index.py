@@ -0,0 +1,113 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the manifest_index.py module."""
+
+import re
+import unittest
+
+import manifest_index
+import project
+
+
+class _FakeProject(project.Project):
+  """Only the attributes the index looks at."""
+
+  def __init__(self, name, relpath, groups):
+    self.name = name
+    self.relpath = relpath
+    self.worktree = '/top/%s' % relpath
+    self.groups = groups + ['all', 'name:%s' % name, 'path:%s' % relpath]
+
+
+PROJECTS = [
+    _FakeProject('platform/build', 'build', ['pdk']),
+    _FakeProject('platform/art', 'art', ['notdefault', 'pdk']),
+    _FakeProject('platform/art-tests', 'art/tests', ['notdefault', '-x']),
+    _FakeProject('device/a', 'device/a', ['default', 'notdefault', 'x']),
+    _FakeProject('tools/repo', 'tools/repo', []),
+    _FakeProject('tools/repo', 'tools/repo-old', ['x']),
+]
+
+GROUPS = [
+    [],
+    ['default'],
+    ['all'],
+    ['notdefault'],
+    ['pdk'],
+    ['-pdk'],
+    ['all', '-notdefault'],
+    ['default', '-x', 'x'],
+    ['x', '-x'],
+    ['-x', 'pdk'],
+    ['name:tools/repo'],
+    ['path:art/tests', '-notdefault'],
+    ['missing'],
+]
+
+
+class ManifestIndexUnitTest(unittest.TestCase):
+  """Compares the index against looking at each project."""
+
+  def setUp(self):
+    self.index = manifest_index.ManifestIndex(PROJECTS)
+
+  def _Relpaths(self, mask):
+    return [p.relpath for p in self.index.Select(mask)]
+
+  def test_groups(self):
+    """Group expressions select what Project.MatchesGroups() accepts."""
+    for groups in GROUPS:
+      expected = [p.relpath for p in PROJECTS if p.MatchesGroups(groups)]
+      mask = self.index.MatchGroups(groups)
+      self.assertEqual(expected, self._Relpaths(mask), groups)
+      for p in PROJECTS:
+        self.assertEqual(p.MatchesGroups(groups),
+                         self.index.Contains(mask, p), groups)
+      self.assertEqual(mask, self.index.MatchGroups(groups))
+
+  def test_search(self):
+    """Patterns match names and paths anywhere, ignoring case."""
+    for patterns in (['repo'], ['^ART'], ['tests$', 'build'], ['zzz'],
+                     [r'(o)\1'], ['(?i)x', 'device'], ['a/'],
+                     ['tools/repo -old', '(?x)zzz'],
+                     ['(?P<n>art)', '(?P<n>build)']):
+      regexes = [re.compile(p, re.IGNORECASE) for p in patterns]
+      expected = [p.relpath for p in PROJECTS
+                  if any(r.search(p.name) or r.search(p.relpath)
+                         for r in regexes)]
+      self.assertEqual(expected, self._Relpaths(self.index.Search(patterns)),
+                       patterns)
+
+  def test_path(self):
+    """Paths find the project at or above them."""
+    by_path = self.index.ByPath
+    self.assertEqual('art', by_path('/top/art').relpath)
+    self.assertEqual('art/tests', by_path('/top/art/tests').relpath)
+    self.assertIsNone(by_path('/top/art/src'))
+    self.assertIsNone(by_path('/top'))
+    self.assertEqual('art', by_path('/top/art/src/x', inside=True).relpath)
+    self.assertEqual('art/tests',
+                     by_path('/top/art/tests/x', inside=True).relpath)
+    self.assertEqual('tools/repo', by_path('/top/tools/repo').relpath)
+    self.assertIsNone(by_path('/top/tools', inside=True))
+    self.assertIsNone(by_path('/elsewhere', inside=True))
+
+  def test_contains(self):
+    """Projects outside of the index are in no set."""
+    other = _FakeProject('other', 'other', [])
+    self.assertFalse(self.index.Contains(self.index.MatchGroups(['all']),
+                                         other))
@@ -0,0 +1,233 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the manifest_xml.py module."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+import command
+import error
+import manifest_xml
+import repo_cache
+
+MANIFEST = """<?xml version="1.0" encoding="UTF-8"?>
+<manifest>
+  <remote name="origin" fetch=".." review="review.example.com" />
+  <remote name="other" fetch="https://other.example.com" alias="o" />
+  <default remote="origin" revision="main" sync-j="4" />
+  <notice>
+    A notice.
+  </notice>
+  <project name="platform/a" path="a" groups="g1">
+    <copyfile src="x" dest="x-copy" />
+    <linkfile src="y" dest="y-link" />
+    <annotation name="k" value="v" keep="false" />
+    <project name="sub" path="s" />
+  </project>
+  <project name="platform/b" remote="other" revision="dev" clone-depth="2" />
+  <include name="inc.xml" />
+</manifest>
+"""
+
+INCLUDE = """<manifest>
+  <project name="platform/c" groups="notdefault" />
+  <repo-hooks in-project="platform/c" enabled-list="pre-upload" />
+</manifest>
+"""
+
+LOCAL = """<manifest>
+  <remove-project name="platform/b" />
+  <extend-project name="platform/a" groups="g2" revision="topic" />
+  <project name="platform/d" path="d" />
+</manifest>
+"""
+
+
+def _Summary(manifest):
+  """The parts of a loaded manifest the tests compare."""
+  projects = []
+  for p in manifest.projects:
+    projects.append((p.relpath, p.name, p.remote.name, p.remote.url,
+                     p.revisionExpr, sorted(p.groups), p.clone_depth,
+                     [(c.src, c.dest) for c in p.copyfiles],
+                     [(l.src, l.dest) for l in p.linkfiles],
+                     [(a.name, a.value, a.keep) for a in p.annotations],
+                     [s.relpath for s in p.subprojects], p.gitdir,
+                     p.worktree, p.enabled_repo_hooks))
+  return (sorted(projects), sorted(manifest.remotes),
+          manifest.default.remote.name, manifest.default.sync_j,
+          manifest.notice, manifest.repo_hooks_project.name)
+
+
+class _ManifestTestCase(unittest.TestCase):
+  """Sets up a .repo/ directory with a manifest and a local manifest."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.repodir = os.path.join(self.tempdir, '.repo')
+    self.manifests = os.path.join(self.repodir, 'manifests')
+    os.makedirs(os.path.join(self.repodir, 'manifests.git'))
+    with open(os.path.join(self.repodir, 'manifests.git', 'config'), 'w') as f:
+      f.write('[remote "origin"]\n\turl = https://example.com/manifest\n')
+    subprocess.check_call(['git', 'init', '-q', self.manifests])
+    self._Write('manifests/default.xml', MANIFEST)
+    self._Write('manifests/inc.xml', INCLUDE)
+    os.symlink(os.path.join('manifests', 'default.xml'),
+               os.path.join(self.repodir, 'manifest.xml'))
+    os.mkdir(os.path.join(self.repodir, 'local_manifests'))
+    self._Write('local_manifests/local.xml', LOCAL)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Write(self, name, text):
+    """Write a file of the .repo/ directory, old enough to be cached."""
+    path = os.path.join(self.repodir, name)
+    created = not os.path.exists(path)
+    with open(path, 'w') as f:
+      f.write(text)
+    t = time.time() - 60
+    os.utime(path, (t, t))
+    if created:
+      os.utime(os.path.dirname(path), (t, t))
+
+  def _Manifest(self, parse=True):
+    """A manifest as a new repo command would load it."""
+    manifest = manifest_xml.XmlManifest(self.repodir)
+    if not parse:
+      def _Fail(*args, **kwargs):
+        self.fail('manifest parsed again')
+      manifest._ParseManifestXml = _Fail
+    return manifest
+
+
+class ParserUnitTest(_ManifestTestCase):
+  """Tests reading the manifest files."""
+
+  def _Manifest(self):
+    manifest = super(ParserUnitTest, self)._Manifest()
+    manifest.cache = None
+    return manifest
+
+  def test_parse(self):
+    """Elements are read across includes and local manifests."""
+    manifest = self._Manifest()
+    self.assertEqual('A notice.', manifest.notice)
+    self.assertEqual(['origin', 'other'], sorted(manifest.remotes))
+    a = manifest.paths['a']
+    self.assertEqual('topic', a.revisionExpr)
+    self.assertEqual(['all', 'g1', 'g2', 'name:platform/a', 'path:a'],
+                     sorted(a.groups))
+    self.assertEqual(['a/s'], [s.relpath for s in a.subprojects])
+    self.assertEqual('platform/a/sub', manifest.paths['a/s'].name)
+    self.assertEqual(['pre-upload'],
+                     manifest.repo_hooks_project.enabled_repo_hooks)
+
+  def test_lazy(self):
+    """Projects are selected without creating their git objects."""
+    cmd = command.Command()
+    cmd.manifest = self._Manifest()
+    projects = cmd.GetProjects(['platform/a', os.path.join(self.tempdir, 'd'),
+                                'platform/c'], missing_ok=True, groups='all')
+    self.assertEqual(['a', 'd', 'platform/c'], [p.relpath for p in projects])
+    self.assertEqual(['a', 'a/s', 'd'],
+                     [p.relpath for p in cmd.GetProjects([], missing_ok=True)])
+    for p in cmd.manifest.projects:
+      self.assertIsNone(p._config)
+      self.assertIsNone(p._bare_ref)
+      self.assertIsNone(p._bare_git)
+
+    a = cmd.manifest.paths['a']
+    self.assertIs(a.config, a.config)
+    self.assertEqual(os.path.join(a.gitdir, 'config'), a.config.file)
+    self.assertEqual(a.gitdir, a.bare_ref._gitdir)
+    self.assertIsNotNone(a.work_git)
+
+  def test_order(self):
+    """Remotes and defaults apply to projects listed before them."""
+    self._Write('local_manifests/local.xml',
+                '<manifest>\n'
+                '  <project name="e" remote="late" />\n'
+                '  <remote name="late" fetch="https://late.example.com" />\n'
+                '</manifest>\n')
+    manifest = self._Manifest()
+    self.assertEqual('https://late.example.com/e',
+                     manifest.paths['e'].remote.url)
+
+  def test_errors(self):
+    """Bad manifests are reported with the file they are in."""
+    for text, message in (
+        ('<manifest><project', 'error parsing manifest'),
+        ('<other />', 'no <manifest> in'),
+        ('<manifest><notice>a</notice><notice>b</notice></manifest>',
+         'duplicate notice in'),
+        ('<manifest><remote name="origin" fetch="a" /></manifest>',
+         'remote origin already exists with different attributes'),
+        ('<manifest><project name="x" path="a" /></manifest>',
+         'duplicate path a in'),
+    ):
+      self._Write('local_manifests/local.xml', text)
+      try:
+        self._Manifest().projects
+      except error.ManifestParseError as e:
+        self.assertIn(message, str(e))
+      else:
+        self.fail('%s parsed' % text)
+
+
+@unittest.skipIf(repo_cache.sqlite3 is None, 'sqlite3 is not available')
+class ManifestCacheUnitTest(_ManifestTestCase):
+  """Tests the compiled manifests kept in the repo cache."""
+
+  def test_cache(self):
+    """Cached manifests load the same projects without parsing XML."""
+    fresh = self._Manifest()
+    fresh.cache = None
+    expected = _Summary(fresh)
+    self.assertEqual(['a', 'a/s', 'd', 'platform/c'],
+                     sorted(p[0] for p in expected[0]))
+
+    self.assertEqual(expected, _Summary(self._Manifest()))
+    self.assertEqual(expected, _Summary(self._Manifest(parse=False)))
+
+  def test_changes(self):
+    """Changes to any file of the manifest are noticed."""
+    self.assertIn('platform/c', self._Manifest().paths)
+
+    self._Write('manifests/inc.xml',
+                INCLUDE.replace('platform/c', 'platform/e'))
+    self.assertIn('platform/e', self._Manifest().paths)
+
+    self._Write('local_manifests/more.xml',
+                '<manifest><project name="f" /></manifest>')
+    self.assertIn('f', self._Manifest().paths)
+
+    self._Write('local_manifests/local.xml', '<manifest />')
+    self.assertIn('platform/b', self._Manifest().paths)
+    self.assertIn('f', self._Manifest(parse=False).paths)
+
+  def test_errors(self):
+    """Manifests that do not parse are not cached."""
+    self._Write('manifests/inc.xml', '<manifest><project /></manifest>')
+    self.assertRaises(error.ManifestParseError,
+                      lambda: self._Manifest().projects)
+    self.assertRaises(error.ManifestParseError,
+                      lambda: self._Manifest().projects)
@@ -0,0 +1,529 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the project.py module."""
+
+from __future__ import print_function
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+
+import error
+import project
+
+
+def _git(*args, **kwargs):
+  """Run git quietly and return its stripped stdout."""
+  env = dict(os.environ,
+             GIT_AUTHOR_NAME='Test', GIT_AUTHOR_EMAIL='test@example.com',
+             GIT_COMMITTER_NAME='Test', GIT_COMMITTER_EMAIL='test@example.com')
+  out = subprocess.check_output(('git',) + args, env=env,
+                                stderr=subprocess.STDOUT, **kwargs)
+  return out.decode('utf-8').strip()
+
+
+class _FakeManifest(object):
+  """The bits of XmlManifest that Project needs for these tests."""
+
+  IsMirror = False
+  globalConfig = None
+  cache = None
+
+
+class RemoteTipsUnitTest(unittest.TestCase):
+  """Tests LsRemote() and RemoteTipsMatch() against a local bare remote."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.remote = os.path.join(self.tempdir, 'remote.git')
+    self.upstream = os.path.join(self.tempdir, 'upstream')
+    self.work = os.path.join(self.tempdir, 'work')
+
+    _git('init', '-q', '--bare', self.remote)
+    _git('init', '-q', self.upstream)
+    self._Commit('first')
+    self.branch = _git('symbolic-ref', '--short', 'HEAD', cwd=self.upstream)
+    _git('tag', '-a', '-m', 'v1', 'v1', cwd=self.upstream)
+    _git('push', '-q', self.remote, self.branch, 'v1', cwd=self.upstream)
+    _git('clone', '-q', 'file://' + self.remote, self.work)
+
+    gitdir = os.path.join(self.work, '.git')
+    self.project = project.Project(
+        manifest=_FakeManifest(), name='work',
+        remote=project.RemoteSpec('origin'), gitdir=gitdir, objdir=gitdir,
+        worktree=self.work, relpath='work', revisionExpr=self.branch,
+        revisionId=None)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Commit(self, msg):
+    _git('commit', '-q', '--allow-empty', '-m', msg, cwd=self.upstream)
+
+  def _Push(self, *refs):
+    _git('push', '-q', self.remote, *refs, cwd=self.upstream)
+
+  def test_ls_remote(self):
+    """LsRemote() returns the heads and tags of the remote."""
+    refs = self.project.LsRemote()
+    head = _git('rev-parse', 'HEAD', cwd=self.upstream)
+    self.assertEqual(head, refs['refs/heads/' + self.branch])
+    self.assertIn('refs/tags/v1', refs)
+
+  def test_unchanged(self):
+    """A freshly fetched project matches its remote."""
+    self.assertTrue(self.project.RemoteTipsMatch(self.project.LsRemote()))
+
+  def test_new_commit(self):
+    """A new commit on the tracked branch needs a fetch."""
+    self._Commit('second')
+    self._Push(self.branch)
+    refs = self.project.LsRemote()
+    self.assertFalse(self.project.RemoteTipsMatch(refs))
+    self.assertFalse(self.project.RemoteTipsMatch(refs,
+                                                  current_branch_only=True))
+
+  def test_other_branch(self):
+    """Other branches only matter when all branches are fetched."""
+    self._Commit('second')
+    self._Push('HEAD:refs/heads/other')
+    refs = self.project.LsRemote()
+    self.assertFalse(self.project.RemoteTipsMatch(refs))
+    self.assertTrue(self.project.RemoteTipsMatch(refs,
+                                                 current_branch_only=True,
+                                                 no_tags=True))
+
+  def test_new_tag(self):
+    """New tags need a fetch unless tags are skipped."""
+    _git('tag', 'v2', cwd=self.upstream)
+    self._Push('v2')
+    refs = self.project.LsRemote()
+    self.assertFalse(self.project.RemoteTipsMatch(refs))
+    self.assertTrue(self.project.RemoteTipsMatch(refs, no_tags=True))
+
+  def test_prune(self):
+    """Deleted remote branches only need a fetch when pruning."""
+    self._Push('HEAD:refs/heads/gone')
+    _git('fetch', '-q', 'origin', cwd=self.work)
+    self._Push(':refs/heads/gone')
+    refs = self.project.LsRemote()
+    self.assertTrue(self.project.RemoteTipsMatch(refs))
+    self.assertFalse(self.project.RemoteTipsMatch(refs, prune=True))
+
+  def test_unreachable_remote(self):
+    """LsRemote() returns None when the remote cannot be queried."""
+    shutil.rmtree(self.remote)
+    self.assertIsNone(self.project.LsRemote())
+    self.assertFalse(self.project.RemoteTipsMatch(None))
+
+  def test_prune_retry(self):
+    """The fetch after `git remote prune` counts as a retry."""
+    calls = []
+
+    class _GitCommand(object):
+      def __init__(self, project, cmdv, **kwargs):
+        calls.append(cmdv[0])
+        self.stderr = 'error: some refs are stale, try "git remote prune"'
+        self.cmdv = cmdv
+
+      def Wait(self):
+        return 0 if self.cmdv[0] == 'remote' else 1
+
+    saved = project.GitCommand
+    project.GitCommand = _GitCommand
+    try:
+      self.assertFalse(self.project._RemoteFetch(retry_fetches=1))
+      self.assertEqual(['fetch', 'remote', 'fetch'], calls)
+      del calls[:]
+      self.assertFalse(self.project._RemoteFetch(retry_fetches=0))
+      self.assertEqual(['fetch', 'remote'], calls)
+    finally:
+      project.GitCommand = saved
+
+  def test_immutable_revision(self):
+    """Only revisions git says are missing have to be fetched."""
+    self.project.revisionExpr = _git('rev-parse', 'HEAD', cwd=self.work)
+    self.assertTrue(self.project._CheckForImmutableRevision())
+    self.project.revisionExpr = '0' * 40
+    self.assertFalse(self.project._CheckForImmutableRevision())
+
+    # git failing is not the same as the revision missing.
+    self.project.gitdir = os.path.join(self.tempdir, 'nope')
+    self.assertRaises(error.GitError, self.project._CheckForImmutableRevision)
+
+  def test_share_fetch(self):
+    """Only projects fetched alike share a fetch."""
+    class _Config(object):
+      def GetString(self, name):
+        return None
+
+    class _ManifestProject(object):
+      config = _Config()
+
+    class _Default(object):
+      sync_c = False
+
+    class _Manifest(_FakeManifest):
+      default = _Default()
+      manifestProject = _ManifestProject()
+
+    def _Project(revision):
+      return project.Project(
+          manifest=_Manifest(), name='work',
+          remote=project.RemoteSpec('origin'), gitdir=self.project.gitdir,
+          objdir=self.project.objdir, worktree=self.work, relpath='work',
+          revisionExpr=revision, revisionId=None, upstream=self.branch)
+
+    head = _git('rev-parse', 'HEAD', cwd=self.work)
+    branch = _Project(self.branch)
+    other = _Project('other')
+    sha1 = _Project(head)
+    self.assertTrue(branch.CanShareFetch(other))
+    self.assertTrue(sha1.CanShareFetch(_Project(head)))
+    self.assertFalse(branch.CanShareFetch(sha1))
+    self.assertFalse(sha1.CanShareFetch(branch))
+    self.assertFalse(branch.CanShareFetch(other, current_branch_only=True))
+
+
+class RefTransactionUnitTest(unittest.TestCase):
+  """Tests ref transactions and the GitRefs cache they maintain."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.work = os.path.join(self.tempdir, 'work')
+    _git('init', '-q', self.work)
+    _git('commit', '-q', '--allow-empty', '-m', 'first', cwd=self.work)
+    self.first = _git('rev-parse', 'HEAD', cwd=self.work)
+    _git('commit', '-q', '--allow-empty', '-m', 'second', cwd=self.work)
+    self.second = _git('rev-parse', 'HEAD', cwd=self.work)
+    self.branch = _git('symbolic-ref', 'HEAD', cwd=self.work)
+
+    gitdir = os.path.join(self.work, '.git')
+    self.project = project.Project(
+        manifest=_FakeManifest(), name='work',
+        remote=project.RemoteSpec('origin'), gitdir=gitdir, objdir=gitdir,
+        worktree=self.work, relpath='work', revisionExpr=self.branch,
+        revisionId=None)
+    self.refs = self.project.bare_ref
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Ref(self, name):
+    return _git('for-each-ref', '--format=%(objectname)', name,
+                cwd=self.work)
+
+  def test_commit(self):
+    """All changes are applied and the cache follows without a reload."""
+    self.assertEqual(self.second, self.refs.all[self.branch])
+    t = self.project.bare_git.RefTransaction(message='test')
+    t.Create('refs/published/a', self.first)
+    t.Update('refs/heads/b', self.branch + '~1')
+    t.Update(self.branch, self.first, self.second)
+    t.Commit()
+    self.assertEqual(0, len(t))
+
+    self.assertFalse(self.refs._Refresh())
+    for name in ('refs/published/a', 'refs/heads/b', self.branch, 'HEAD'):
+      self.assertEqual(self.first, self.refs.get(name))
+    self.assertEqual(self.first, self._Ref('refs/heads/b'))
+
+    self.project.bare_git.DeleteRef('refs/published/a')
+    self.assertEqual('', self._Ref('refs/published/a'))
+    self.assertEqual('', self.refs.get('refs/published/a'))
+
+  def test_atomic(self):
+    """A failing change leaves all refs alone."""
+    t = self.project.bare_git.RefTransaction()
+    t.Update('refs/heads/b', self.first)
+    t.Update(self.branch, self.second, self.first)
+    self.assertRaises(project.GitError, t.Commit)
+    self.assertEqual('', self._Ref('refs/heads/b'))
+    self.assertEqual(self.second, self._Ref(self.branch))
+
+  def test_invalid_revision(self):
+    """Values that do not resolve are refused before git runs."""
+    t = self.project.bare_git.RefTransaction()
+    t.Update('refs/heads/b', 'no-such-rev')
+    self.assertRaises(project.GitError, t.Commit)
+
+  def test_detach(self):
+    """Detaching HEAD leaves the branch alone."""
+    self.project.work_git.DetachHead(self.first)
+    self.assertEqual(self.first, _git('rev-parse', 'HEAD', cwd=self.work))
+    self.assertEqual(self.second, self._Ref(self.branch))
+
+  def test_clean_published_cache(self):
+    """Published refs of deleted branches are removed at once."""
+    t = self.project.bare_git.RefTransaction()
+    t.Update('refs/published/gone1', self.first)
+    t.Update('refs/published/gone2', self.first)
+    t.Update('refs/published/' + self.branch[len('refs/heads/'):],
+             self.first)
+    t.Commit()
+    self.project.CleanPublishedCache()
+    self.assertEqual(self.first, self._Ref('refs/published/'))
+
+
+class _PlanConfig(object):
+  def __init__(self, depth=None):
+    self.depth = depth
+
+  def GetString(self, name):
+    return self.depth if name == 'repo.depth' else None
+
+
+class _PlanManifestProject(object):
+  def __init__(self):
+    self.config = _PlanConfig()
+
+
+class _PlanDefault(object):
+  sync_c = False
+
+
+class _PlanManifest(_FakeManifest):
+  """A manifest with the settings that the sync plan reads."""
+
+  def __init__(self):
+    self.default = _PlanDefault()
+    self.manifestProject = _PlanManifestProject()
+
+
+class PlanUnitTest(unittest.TestCase):
+  """Tests PlanNetworkHalf() and PlanLocalHalf() against real repositories."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.remote = os.path.join(self.tempdir, 'remote.git')
+    self.upstream = os.path.join(self.tempdir, 'upstream')
+    self.work = os.path.join(self.tempdir, 'work')
+
+    _git('init', '-q', '--bare', self.remote)
+    _git('init', '-q', self.upstream)
+    self._Commit(self.upstream, 'first')
+    self.branch = _git('symbolic-ref', '--short', 'HEAD', cwd=self.upstream)
+    _git('tag', '-a', '-m', 'v1', 'v1', cwd=self.upstream)
+    _git('push', '-q', self.remote, self.branch, 'v1', cwd=self.upstream)
+    _git('clone', '-q', 'file://' + self.remote, self.work)
+    _git('config', 'user.name', 'Test', cwd=self.work)
+    _git('config', 'user.email', 'test@example.com', cwd=self.work)
+    self.project = self._Project(self.work, self.branch)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Project(self, worktree, revision):
+    gitdir = os.path.join(worktree, '.git')
+    return project.Project(
+        manifest=_PlanManifest(), name='work',
+        remote=project.RemoteSpec('origin'), gitdir=gitdir, objdir=gitdir,
+        worktree=worktree, relpath='work', revisionExpr=revision,
+        revisionId=None)
+
+  def _Commit(self, cwd, msg):
+    """Commit a change to the file "f" in |cwd|."""
+    with open(os.path.join(cwd, 'f'), 'a') as f:
+      f.write(msg + '\n')
+    _git('add', 'f', cwd=cwd)
+    _git('commit', '-q', '-m', msg, cwd=cwd)
+
+  def _Upstream(self):
+    """Land a new upstream commit and fetch it into the work tree."""
+    self._Commit(self.upstream, 'upstream')
+    _git('push', '-q', self.remote, self.branch, cwd=self.upstream)
+    _git('fetch', '-q', 'origin', cwd=self.work)
+
+  def test_network_clone(self):
+    """Projects without a git directory are cloned."""
+    p = self._Project(os.path.join(self.tempdir, 'new'), self.branch)
+    self.assertEqual('clone', p.PlanNetworkHalf())
+    self.assertEqual('clone', p.PlanNetworkHalf(optimized_fetch=True))
+
+  def test_network_branch(self):
+    """Branches are always fetched."""
+    self.assertEqual('fetch', self.project.PlanNetworkHalf())
+    self.assertEqual('fetch', self.project.PlanNetworkHalf(
+        current_branch_only=True, optimized_fetch=True))
+
+  def test_network_sha1(self):
+    """Present sha1s are skipped with --optimized-fetch or -c."""
+    head = _git('rev-parse', 'HEAD', cwd=self.work)
+    p = self._Project(self.work, head)
+    self.assertEqual('fetch', p.PlanNetworkHalf())
+    self.assertEqual('skip', p.PlanNetworkHalf(optimized_fetch=True))
+    self.assertEqual('skip', p.PlanNetworkHalf(current_branch_only=True))
+
+    p = self._Project(self.work, '0' * 40)
+    self.assertEqual('fetch', p.PlanNetworkHalf(optimized_fetch=True))
+
+  def test_network_tag(self):
+    """Present tags are skipped when only the current branch is fetched."""
+    p = self._Project(self.work, 'refs/tags/v1')
+    self.assertEqual('fetch', p.PlanNetworkHalf(optimized_fetch=True))
+    self.assertEqual('skip', p.PlanNetworkHalf(current_branch_only=True))
+    p.manifest.manifestProject.config.depth = '1'
+    self.assertEqual('skip', p.PlanNetworkHalf())
+
+  def test_local_checkout(self):
+    """New and detached work trees are checked out."""
+    p = self._Project(os.path.join(self.tempdir, 'new'), self.branch)
+    self.assertEqual('checkout', p.PlanLocalHalf())
+
+    self._Upstream()
+    _git('checkout', '-q', '--detach', 'HEAD', cwd=self.work)
+    self.assertEqual('checkout', self.project.PlanLocalHalf())
+
+  def test_local_untouched(self):
+    """Work trees at the revision, or only ahead of it, are left alone."""
+    self.assertEqual('untouched', self.project.PlanLocalHalf())
+    self.assertEqual('checkout',
+                     self.project.PlanLocalHalf(detach_head=True))
+    self._Commit(self.work, 'mine')
+    self.assertEqual('untouched', self.project.PlanLocalHalf())
+
+  def test_local_fast_forward(self):
+    """Branches without local commits are fast-forwarded."""
+    self._Upstream()
+    self.assertEqual('fast-forward', self.project.PlanLocalHalf())
+
+  def test_local_rebase(self):
+    """Local commits are rebased onto new upstream commits."""
+    self._Commit(self.work, 'mine')
+    self._Upstream()
+    self.assertEqual('rebase', self.project.PlanLocalHalf())
+
+  def test_local_dirty(self):
+    """Local commits cannot be rebased in a dirty work tree."""
+    self._Commit(self.work, 'mine')
+    self._Upstream()
+    with open(os.path.join(self.work, 'f'), 'a') as f:
+      f.write('dirty\n')
+    self.assertEqual('fail', self.project.PlanLocalHalf())
+
+  def test_local_unknown(self):
+    """Revisions that were not fetched yet cannot be planned."""
+    p = self._Project(self.work, 'refs/heads/nope')
+    self.assertEqual('unknown', p.PlanLocalHalf())
+
+
+class _Config(object):
+  """A config without any color settings."""
+
+  def GetString(self, name):
+    return None
+
+
+class _Output(object):
+  """Collects what a SyncBuffer prints."""
+
+  def __init__(self):
+    self.text = []
+
+  def write(self, s):
+    self.text.append(s)
+
+  def flush(self):
+    pass
+
+
+class _SyncProject(object):
+  """The bits of Project that SyncBuffer looks at."""
+
+  def __init__(self, relpath, log):
+    self.relpath = relpath
+    self._log = log
+
+  def _CopyAndLinkFiles(self):
+    self._log.append(('copy', self.relpath))
+
+
+class SyncBufferUnitTest(unittest.TestCase):
+  """Tests SyncBuffer with several projects reporting at once."""
+
+  def setUp(self):
+    self.log = []
+    self.syncbuf = project.SyncBuffer(_Config())
+    self.out = _Output()
+    self.syncbuf.out.redirect(self.out)
+
+  def _Project(self, relpath):
+    return _SyncProject(relpath, self.log)
+
+  def _Action(self, name):
+    return lambda: self.log.append(name)
+
+  def test_threads(self):
+    """Reports of many threads are all kept, and replayed in path order."""
+    projects = [self._Project('p%02d' % i) for i in range(20)]
+
+    def _Report(p):
+      for i in range(50):
+        self.syncbuf.info(p, 'message %d', i)
+        self.syncbuf.later1(p, self._Action((p.relpath, i)))
+      self.syncbuf.fail(p, 'failed')
+
+    threads = [threading.Thread(target=_Report, args=(p,))
+               for p in reversed(projects)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+    self.assertFalse(self.syncbuf.Finish())
+    text = ''.join(self.out.text)
+    self.assertEqual(20 * 50, text.count('message'))
+    self.assertEqual(20, text.count('failed'))
+    infos = [line.split('/')[0] for line in text.splitlines()
+             if 'message' in line]
+    self.assertEqual(sorted(infos), infos)
+    self.assertEqual([(p.relpath, i) for p in projects for i in range(50)],
+                     self.log)
+
+  def test_later_order(self):
+    """Later actions run by path, each project in the order it queued them.
+    """
+    a, b, c = self._Project('a'), self._Project('b'), self._Project('c')
+    self.syncbuf.later2(c, self._Action('c2'))
+    self.syncbuf.later1(c, self._Action('c1'))
+    self.syncbuf.later1(a, self._Action('a1'))
+    self.syncbuf.later2(a, self._Action('a2'))
+    self.syncbuf.later1(b, self._Action('b1'))
+    self.syncbuf.later1(a, self._Action('a1 again'))
+    self.assertTrue(self.syncbuf.Finish())
+    self.assertEqual(['a1', 'a1 again', 'b1', 'c1', 'a2', 'c2'], self.log)
+
+  def test_copy_and_link(self):
+    """Copied and linked files may be held back until all are checked out.
+    """
+    a, b = self._Project('a'), self._Project('b')
+    self.syncbuf.copy_and_link(b)
+    self.assertEqual([('copy', 'b')], self.log)
+
+    self.syncbuf.HoldCopyAndLink()
+    self.syncbuf.copy_and_link(b)
+    self.syncbuf.copy_and_link(a)
+    self.assertEqual([('copy', 'b')], self.log)
+    self.syncbuf.RunCopyAndLink()
+    self.assertEqual([('copy', 'b'), ('copy', 'a'), ('copy', 'b')], self.log)
+
+    # Once run, files are written right away again.
+    self.syncbuf.copy_and_link(a)
+    self.assertEqual(('copy', 'a'), self.log[-1])
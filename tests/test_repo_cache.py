@@ -0,0 +1,146 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the repo_cache.py module."""
+
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import git_config
+import repo_cache
+
+
+def _Age(path, seconds=60):
+  """Make |path| old enough to be cached."""
+  t = time.time() - seconds
+  os.utime(path, (t, t))
+
+
+def _PutMany(args):
+  repodir, worker = args
+  cache = repo_cache.Open(repodir)
+  for i in range(20):
+    cache.Put('test', '%d-%d' % (worker, i), 'stamp', [worker, i])
+  return worker
+
+
+@unittest.skipIf(repo_cache.sqlite3 is None, 'sqlite3 is not available')
+class RepoCacheUnitTest(unittest.TestCase):
+  """Tests the cache against a temporary .repo/ directory."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _File(self, name, text, age=60):
+    path = os.path.join(self.tempdir, name)
+    with open(path, 'w') as f:
+      f.write(text)
+    if age:
+      _Age(path, age)
+    return path
+
+  def test_stamp(self):
+    """Stamps follow the stat data; recent files get none."""
+    path = self._File('f', 'a')
+    stamp = repo_cache.FileStamp(path)
+    self.assertIsNotNone(stamp)
+    self.assertEqual(stamp, repo_cache.FileStamp(path))
+    self.assertNotEqual(stamp, repo_cache.FileStamp(path, path + '.x'))
+
+    self._File('f', 'ab', age=0)
+    self.assertIsNone(repo_cache.FileStamp(path))
+    _Age(path, 30)
+    self.assertNotEqual(stamp, repo_cache.FileStamp(path))
+
+  def test_persist(self):
+    """Entries are kept across instances and checked against the stamp."""
+    cache = repo_cache.Open(self.tempdir)
+    cache.Put('config', 'a', 's1', {'k': ['v']})
+    cache.Put('config', 'b', None, {'k': ['v']})
+    self.assertEqual({'k': ['v']}, cache.Get('config', 'a', 's1'))
+
+    cache = repo_cache.Open(self.tempdir)
+    self.assertEqual({'k': ['v']}, cache.Get('config', 'a', 's1'))
+    self.assertIsNone(cache.Get('config', 'a', 's2'))
+    self.assertIsNone(cache.Get('config', 'a', None))
+    self.assertIsNone(cache.Get('config', 'b', None))
+    self.assertIsNone(cache.Get('refs', 'a', 's1'))
+
+  def test_threads(self):
+    """Threads can share one cache."""
+    cache = repo_cache.Open(self.tempdir)
+    def _Put(worker):
+      for i in range(20):
+        cache.Put('test', '%d-%d' % (worker, i), 'stamp', [worker, i])
+    threads = [threading.Thread(target=_Put, args=(w,)) for w in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    cache = repo_cache.Open(self.tempdir)
+    for w in range(8):
+      self.assertEqual([w, 19], cache.Get('test', '%d-19' % w, 'stamp'))
+
+  def test_processes(self):
+    """Processes can write to the cache at the same time."""
+    cache = repo_cache.Open(self.tempdir)
+    cache.Put('test', 'parent', 'stamp', 1)
+    pool = multiprocessing.Pool(4)
+    try:
+      pool.map(_PutMany, [(self.tempdir, w) for w in range(4)])
+    finally:
+      pool.close()
+      pool.join()
+    cache = repo_cache.Open(self.tempdir)
+    self.assertEqual(1, cache.Get('test', 'parent', 'stamp'))
+    for w in range(4):
+      self.assertEqual([w, 19], cache.Get('test', '%d-19' % w, 'stamp'))
+
+  def test_pickle(self):
+    """Pickled caches open their own connection."""
+    cache = repo_cache.Open(self.tempdir)
+    cache.Put('test', 'a', 'stamp', 1)
+    cache = pickle.loads(pickle.dumps(cache))
+    self.assertEqual(1, cache.Get('test', 'a', 'stamp'))
+
+  def test_git_config(self):
+    """GitConfig keeps parsed files in the cache instead of sidecars."""
+    path = self._File('config', '[core]\n\tbare = true\n')
+    cache = repo_cache.Open(self.tempdir)
+    config = git_config.GitConfig(path, cache=cache)
+    self.assertEqual('true', config.GetString('core.bare'))
+    self.assertFalse(os.path.exists(os.path.join(self.tempdir,
+                                                 '.repo_config.json')))
+
+    # Served from the cache as long as the file does not change.
+    self.assertEqual({'core.bare': ['true']},
+                     cache.Get('config', os.path.abspath(path),
+                               repo_cache.FileStamp(path)))
+    config = git_config.GitConfig(path, cache=repo_cache.Open(self.tempdir))
+    self.assertEqual('true', config.GetString('core.bare'))
+
+    config.SetString('core.bare', 'false')
+    config = git_config.GitConfig(path, cache=repo_cache.Open(self.tempdir))
+    self.assertEqual('false', config.GetString('core.bare'))
@@ -0,0 +1,158 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the scheduler.py module."""
+
+import threading
+import time
+import unittest
+
+import scheduler
+
+
+class SchedulerUnitTest(unittest.TestCase):
+  """Tests the Scheduler class."""
+
+  def test_longest_first(self):
+    """A single worker runs tasks in order of decreasing cost."""
+    s = scheduler.Scheduler(1)
+    for name, cost in (('a', 1), ('b', 5), ('c', 3), ('d', 5)):
+      s.Add(name, cost)
+    order = []
+    s.Run(order.append)
+    self.assertEqual(['b', 'd', 'c', 'a'], order)
+
+  def test_tasks_can_add_work(self):
+    """Work queued by a running task is picked up before Run() returns."""
+    s = scheduler.Scheduler(4)
+    s.Add(3)
+    seen = []
+    lock = threading.Lock()
+
+    def func(n):
+      with lock:
+        seen.append(n)
+      if n:
+        s.Add(n - 1)
+    s.Run(func)
+    self.assertEqual([3, 2, 1, 0], seen)
+
+  def test_stop(self):
+    """No new tasks start once Stop() has been called."""
+    s = scheduler.Scheduler(1)
+    for i in range(5):
+      s.Add(i, -i)
+    seen = []
+
+    def func(n):
+      seen.append(n)
+      if n == 1:
+        s.Stop()
+    s.Run(func)
+    self.assertEqual([0, 1], seen)
+
+  def test_exception(self):
+    """Exceptions in tasks are re-raised by Run()."""
+    s = scheduler.Scheduler(2)
+    s.Add('x')
+
+    def func(_item):
+      raise ValueError('boom')
+    self.assertRaises(ValueError, s.Run, func)
+
+  def test_utilization(self):
+    """Every worker reports its busy time."""
+    s = scheduler.Scheduler(2)
+    for i in range(4):
+      s.Add(i)
+    s.Run(lambda _: time.sleep(0.05))
+    self.assertEqual(2, len(s.Utilization()))
+    self.assertEqual(4, sum(w.tasks for w in s.workers))
+    for u in s.Utilization():
+      self.assertGreater(u, 0)
+      self.assertLessEqual(u, 1)
+
+  def test_hold(self):
+    """A held scheduler keeps running until closed."""
+    s = scheduler.Scheduler(2)
+    s.Hold()
+    seen = []
+    t = threading.Thread(target=s.Run, args=(seen.append,))
+    t.start()
+    time.sleep(0.05)
+    self.assertTrue(t.is_alive())
+    s.Add('late')
+    s.Close()
+    t.join()
+    self.assertEqual(['late'], seen)
+
+  def test_defer(self):
+    """Deferred work waits for its delay while other tasks keep running."""
+    s = scheduler.Scheduler(1)
+    s.Add('first')
+    seen = []
+
+    def func(item):
+      seen.append((item, time.time()))
+      if item == 'first':
+        s.Defer('retry', 0.1)
+        s.Add('other')
+    start = time.time()
+    s.Run(func)
+    self.assertEqual(['first', 'other', 'retry'], [x[0] for x in seen])
+    self.assertGreaterEqual(seen[2][1] - start, 0.1)
+
+  def test_limit(self):
+    """Limited keys never exceed their limit, other work fills the pool."""
+    s = scheduler.Scheduler(4)
+    s.SetLimit('slow', 1)
+    for i in range(4):
+      s.Add(('slow', i), 10, keys=['slow'])
+    for i in range(4):
+      s.Add(('fast', i), 1, keys=['fast'])
+    lock = threading.Lock()
+    running = {'slow': 0, 'fast': 0}
+    peak = {'slow': 0, 'fast': 0}
+
+    def func(item):
+      key = item[0]
+      with lock:
+        running[key] += 1
+        peak[key] = max(peak[key], running[key])
+      time.sleep(0.02)
+      with lock:
+        running[key] -= 1
+    s.Run(func)
+    self.assertEqual(1, peak['slow'])
+    self.assertEqual(3, peak['fast'])
+    self.assertEqual(8, sum(w.tasks for w in s.workers))
+
+
+class SimulateUnitTest(unittest.TestCase):
+  """Tests the Simulate function."""
+
+  def test_schedule(self):
+    """Items start most expensive first on the earliest free worker."""
+    plan = scheduler.Simulate([('a', 1), ('b', 4), ('c', 3), ('d', 2)], 2)
+    self.assertEqual([('b', 0, 0.0, 4.0),
+                      ('c', 1, 0.0, 3.0),
+                      ('d', 1, 3.0, 5.0),
+                      ('a', 0, 4.0, 5.0)], plan)
+
+  def test_single_worker(self):
+    """One worker runs everything back to back."""
+    plan = scheduler.Simulate([('a', 1), ('b', 2)], 1)
+    self.assertEqual(3.0, plan[-1][3])
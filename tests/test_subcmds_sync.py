@@ -0,0 +1,514 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the subcmds/sync.py module."""
+
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import project
+
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+
+try:
+  from subcmds import sync
+except ImportError:
+  # Loading the subcommands needs the formatter module, gone in Python 3.10.
+  sync = None
+
+
+def _git(*args, **kwargs):
+  """Run git quietly and return its stripped stdout."""
+  env = dict(os.environ,
+             GIT_AUTHOR_NAME='Test', GIT_AUTHOR_EMAIL='test@example.com',
+             GIT_COMMITTER_NAME='Test', GIT_COMMITTER_EMAIL='test@example.com')
+  out = subprocess.check_output(('git',) + args, env=env,
+                                stderr=subprocess.STDOUT, **kwargs)
+  return out.decode('utf-8').strip()
+
+
+class _Config(object):
+  """A config without any settings."""
+
+  def GetString(self, name):
+    return None
+
+
+class _Output(object):
+  def write(self, s):
+    pass
+
+  def flush(self):
+    pass
+
+
+class _Project(object):
+  """The bits of Project that the checkout stage looks at."""
+
+  def __init__(self, relpath, log):
+    self.relpath = relpath
+    self.gitdir = '/gitdirs/%s.git' % relpath
+    self.worktree = '/top/%s' % relpath
+    self._log = log
+
+  def _CopyAndLinkFiles(self):
+    self._log.append(('copy', self.relpath))
+
+
+class _Sync(object):
+  """Stands in for the sync command; checkouts only record what they did."""
+
+  def __init__(self, log):
+    self._log = log
+    self._lock = threading.Lock()
+
+  def _SyncLocalHalf(self, opt, p, syncbuf):
+    with self._lock:
+      self._log.append(('start', p.relpath))
+    time.sleep(random.random() * 0.005)
+    syncbuf.copy_and_link(p)
+    with self._lock:
+      self._log.append(('end', p.relpath))
+
+
+@unittest.skipIf(sync is None, 'subcommands cannot be loaded')
+class LocalHalfStageUnitTest(unittest.TestCase):
+  """Tests the order in which _LocalHalfStage updates work trees."""
+
+  RELPATHS = ['a', 'a/b', 'a/b/c', 'a-b', 'd', 'd/e', 'f']
+
+  def setUp(self):
+    self.log = []
+    self.projects = dict((r, _Project(r, self.log)) for r in self.RELPATHS)
+    self.syncbuf = project.SyncBuffer(_Config())
+    self.syncbuf.out.redirect(_Output())
+
+  def _Stage(self, jobs=4):
+    return sync._LocalHalfStage(_Sync(self.log), None,
+                                [self.projects[r] for r in self.RELPATHS],
+                                self.syncbuf, jobs)
+
+  def _Index(self, kind, relpath):
+    return self.log.index((kind, relpath))
+
+  def _Started(self):
+    return [r for kind, r in self.log if kind == 'start']
+
+  def test_enclosing(self):
+    """Enclosing projects are found by path, not by name prefix."""
+    parents = sync._EnclosingProjects(
+        [self.projects[r] for r in self.RELPATHS])
+    self.assertEqual(['/gitdirs/a.git', '/gitdirs/a/b.git'],
+                     parents['/gitdirs/a/b/c.git'])
+    self.assertEqual([], parents['/gitdirs/a-b.git'])
+    self.assertEqual(['/gitdirs/d.git'], parents['/gitdirs/d/e.git'])
+
+  def test_nested(self):
+    """Nested projects are only checked out after their enclosing project,
+    whatever order they are added in."""
+    for _ in range(20):
+      del self.log[:]
+      stage = self._Stage()
+      for r in reversed(self.RELPATHS):
+        stage.Add(self.projects[r])
+      stage.Finish()
+      self.assertEqual(sorted(self.RELPATHS), sorted(self._Started()))
+      for parent, child in (('a', 'a/b'), ('a/b', 'a/b/c'), ('d', 'd/e')):
+        self.assertLess(self._Index('end', parent),
+                        self._Index('start', child), self.log)
+
+  def test_missing_parent(self):
+    """Projects whose enclosing project never comes are still checked out,
+    and the ones whose enclosing project comes late still wait for it."""
+    for _ in range(20):
+      del self.log[:]
+      stage = self._Stage()
+      for r in ('a/b/c', 'a/b', 'd/e', 'f'):
+        stage.Add(self.projects[r])
+      stage.Finish()
+      self.assertEqual(['a/b', 'a/b/c', 'd/e', 'f'],
+                       sorted(self._Started()))
+      self.assertLess(self._Index('end', 'a/b'),
+                      self._Index('start', 'a/b/c'), self.log)
+
+  def test_copy_and_link(self):
+    """With several workers, files are copied once all checkouts are done."""
+    stage = self._Stage()
+    for r in self.RELPATHS:
+      stage.Add(self.projects[r])
+    stage.Finish()
+    copies = [r for kind, r in self.log if kind == 'copy']
+    self.assertEqual(sorted(self.RELPATHS), copies)
+    last_end = max(i for i, (kind, _) in enumerate(self.log) if kind == 'end')
+    first_copy = min(i for i, (kind, _) in enumerate(self.log)
+                     if kind == 'copy')
+    self.assertLess(last_end, first_copy)
+
+  def test_serial(self):
+    """A single worker copies the files of each project right away."""
+    stage = self._Stage(jobs=1)
+    for r in self.RELPATHS:
+      stage.Add(self.projects[r])
+    stage.Finish()
+    self.assertEqual(('copy', 'a'), self.log[1])
+
+  def test_error(self):
+    """Errors of a checkout are raised by Finish()."""
+    def _Fail(opt, p, syncbuf):
+      raise ValueError(p.relpath)
+    cmd = _Sync(self.log)
+    cmd._SyncLocalHalf = _Fail
+    stage = sync._LocalHalfStage(cmd, None, [self.projects['f']],
+                                 self.syncbuf, 1)
+    stage.Add(self.projects['f'])
+    self.assertRaises(ValueError, stage.Finish)
+
+
+class _Remote(object):
+  fetchRetries = 2
+  fetchRetryDelay = 30
+
+  def RetryDelay(self, attempt):
+    return self.fetchRetryDelay * 2 ** (attempt - 1)
+
+
+class _FetchProject(object):
+  def __init__(self, exists):
+    self.gitdir = '/gitdirs/p.git'
+    self.remote = _Remote()
+    self.Exists = exists
+
+
+@unittest.skipIf(sync is None, 'subcommands cannot be loaded')
+class FetchRetriesUnitTest(unittest.TestCase):
+  """Tests _FetchRetries."""
+
+  def test_retries(self):
+    """Retries follow the policy of the remote."""
+    retries = sync._FetchRetries()
+    p = _FetchProject(True)
+    self.assertTrue(retries.CanRetry(p))
+    self.assertEqual(30, retries.Schedule(p))
+    self.assertTrue(retries.CanRetry(p))
+    self.assertEqual(60, retries.Schedule(p))
+    self.assertFalse(retries.CanRetry(p))
+    self.assertEqual(2, retries.count)
+
+  def test_new(self):
+    """A failed clone is retried as a clone."""
+    retries = sync._FetchRetries()
+    p = _FetchProject(False)
+    self.assertTrue(retries.IsNew(p))
+    # The failed clone left a git directory behind.
+    p.Exists = True
+    self.assertTrue(retries.IsNew(p))
+    self.assertFalse(sync._FetchRetries().IsNew(p))
+
+
+class _Manifest(object):
+  IsArchive = True
+
+  def __init__(self, repodir):
+    self.repodir = repodir
+
+
+class _Named(object):
+  def __init__(self, name):
+    self.name = name
+    self.objdir = '/objdirs/%s.git' % name
+
+
+class _Options(object):
+  precheck = False
+  quiet = True
+  force_broken = False
+
+
+@unittest.skipIf(sync is None, 'subcommands cannot be loaded')
+class FetchHistoryUnitTest(unittest.TestCase):
+  """Tests _FetchHistory."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.manifest = _Manifest(self.tempdir)
+    self.path = os.path.join(self.tempdir, '.repo_fetchhistory.json')
+    self.old_path = os.path.join(self.tempdir, '.repo_fetchtimes.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Write(self, path, data):
+    with open(path, 'w') as f:
+      json.dump(data, f)
+
+  def _Saved(self):
+    with open(self.path) as f:
+      return json.load(f)
+
+  def test_empty(self):
+    """Projects without history are expected to take long."""
+    history = sync._FetchHistory(self.manifest)
+    self.assertEqual(sync._ONE_DAY_S, history.Get(_Named('a')))
+    self.assertEqual(['No fetch history recorded yet.'],
+                     history.FormatStats())
+
+  def test_seed(self):
+    """The fetch times of older versions seed the history."""
+    self._Write(self.old_path, {'a': 12.0, 'b': 'junk'})
+    history = sync._FetchHistory(self.manifest)
+    self.assertEqual(12.0, history.Get(_Named('a')))
+    self.assertEqual(['a'], list(history.Entries()))
+    history.Save()
+    self.assertEqual(['a'], list(self._Saved()))
+    self.assertFalse(os.path.exists(self.old_path))
+
+  def test_seed_ignored(self):
+    """The old fetch times are not used once there is a history."""
+    self._Write(self.old_path, {'a': 12.0})
+    self._Write(self.path, {})
+    history = sync._FetchHistory(self.manifest)
+    self.assertEqual(sync._ONE_DAY_S, history.Get(_Named('a')))
+
+  def test_corrupt(self):
+    """A history that cannot be read is started over."""
+    with open(self.path, 'w') as f:
+      f.write('{')
+    history = sync._FetchHistory(self.manifest)
+    self.assertEqual({}, history.Entries())
+
+  def test_record(self):
+    """Fetch times are smoothed; failures are counted but not timed."""
+    history = sync._FetchHistory(self.manifest)
+    a = _Named('a')
+    history.Record(a, 10, True)
+    history.Record(a, 20, True, changed=True)
+    history.Record(a, 100, False)
+    self.assertEqual(15, history.Get(a))
+    entry = history.Entries()['a']
+    self.assertEqual(3, entry['fetches'])
+    self.assertEqual(1, entry['failures'])
+    self.assertIsNotNone(entry['last_changed'])
+
+  def test_received(self):
+    """What a fetch received is reset by the next successful fetch."""
+    history = sync._FetchHistory(self.manifest)
+    a = _Named('a')
+    history.RecordReceived(a, 1000, 10)
+    self.assertEqual({}, history.Entries())
+    history.Record(a, 10, True, changed=True)
+    history.RecordReceived(a, 1000, 10)
+    entry = history.Entries()['a']
+    self.assertEqual((1000, 10), (entry['bytes'], entry['objects']))
+    history.Record(a, 10, False)
+    entry = history.Entries()['a']
+    self.assertEqual((1000, 10), (entry['bytes'], entry['objects']))
+    history.Record(a, 10, True)
+    entry = history.Entries()['a']
+    self.assertEqual((0, 0), (entry['bytes'], entry['objects']))
+
+  def test_expire(self):
+    """Projects not fetched for 90 days are dropped when saving."""
+    history = sync._FetchHistory(self.manifest)
+    history.Record(_Named('old'), 10, True)
+    history.Record(_Named('new'), 10, True)
+    history._history['old']['last_fetch'] -= 91 * sync._ONE_DAY_S
+    history._history['new']['last_fetch'] -= 89 * sync._ONE_DAY_S
+    history.Save()
+    self.assertEqual(['new'], list(self._Saved()))
+    self.assertEqual(['new'],
+                     list(sync._FetchHistory(self.manifest).Entries()))
+
+  def test_stats(self):
+    """The report lists the slowest, flakiest and stalest projects."""
+    history = sync._FetchHistory(self.manifest)
+    for name, duration, failures in (('a', 5, 0), ('b', 50, 1), ('c', 20, 3)):
+      p = _Named(name)
+      history.Record(p, duration, True, changed=name != 'c')
+      for _ in range(failures):
+        history.Record(p, duration, False)
+    history.RecordReceived(_Named('b'), 2048, 7)
+    lines = history.FormatStats(limit=2)
+    self.assertEqual('Slowest projects (smoothed fetch time):', lines[0])
+    self.assertIn('b (7 objects', lines[1])
+    self.assertIn('c (0 objects', lines[2])
+    flaky = lines.index('Flakiest projects (failed / total fetches):')
+    self.assertEqual(['3/4', '1/2'],
+                     [l.split()[0] for l in lines[flaky + 1:flaky + 3]])
+    self.assertTrue(lines[flaky + 2].endswith(' b'))
+    stale = lines.index('Least recently changed projects:')
+    self.assertEqual(['unknown', 'c'], lines[stale + 1].split())
+    self.assertEqual(stale + 3, len(lines))
+
+  def test_failed_sync(self):
+    """A sync that exits because of fetch errors still saves the history."""
+    cmd = sync.Sync()
+    cmd.manifest = self.manifest
+    cmd.jobs = 2
+    cmd._fetch_history = sync._FetchHistory(self.manifest)
+    cmd._fetch_changed = []
+    cmd._FetchKeys = lambda scheduler, projects: ()
+
+    def _FetchProjectList(opt, projects, scheduler, retries, **kwargs):
+      for project in projects:
+        cmd._fetch_history.Record(project, 1, project.name != 'bad')
+      if any(p.name == 'bad' for p in projects):
+        kwargs['err_event'].set()
+    cmd._FetchProjectList = _FetchProjectList
+
+    self.assertRaises(SystemExit, cmd._Fetch,
+                      [_Named('good'), _Named('bad')], _Options())
+    saved = self._Saved()
+    self.assertEqual(1, saved['bad']['failures'])
+    self.assertEqual(0, saved['good']['failures'])
+
+
+class _PlanManifestProject(object):
+  config = _Config()
+
+
+class _PlanDefault(object):
+  sync_c = False
+
+
+class _PlanManifest(_Manifest):
+  """A manifest with the settings that the sync plan reads."""
+
+  IsMirror = False
+  globalConfig = None
+  cache = None
+  default = _PlanDefault()
+  manifestProject = _PlanManifestProject()
+
+
+class _PlanOptions(object):
+  fetch_submodules = False
+  local_only = False
+  network_only = False
+  current_branch_only = False
+  optimized_fetch = False
+  detach_head = False
+  json = False
+
+
+@unittest.skipIf(sync is None, 'subcommands cannot be loaded')
+class PlanUnitTest(unittest.TestCase):
+  """Tests the output of sync --plan for a checked out and a new project."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    remote = os.path.join(self.tempdir, 'remote.git')
+    seed = os.path.join(self.tempdir, 'seed')
+    _git('init', '-q', '--bare', remote)
+    _git('init', '-q', seed)
+    _git('commit', '-q', '--allow-empty', '-m', 'first', cwd=seed)
+    branch = _git('symbolic-ref', 'HEAD', cwd=seed)
+    _git('push', '-q', remote, branch, cwd=seed)
+    _git('clone', '-q', 'file://' + remote, os.path.join(self.tempdir, 'work'))
+
+    manifest = _PlanManifest(self.tempdir)
+    with open(os.path.join(self.tempdir, '.repo_fetchhistory.json'),
+              'w') as f:
+      json.dump({'work': {'time': 8.0, 'fetches': 1, 'failures': 0,
+                          'bytes': 0, 'objects': 0,
+                          'last_fetch': time.time(), 'last_changed': None}},
+                f)
+    projects = []
+    for name in ('work', 'new'):
+      worktree = os.path.join(self.tempdir, name)
+      gitdir = os.path.join(worktree, '.git')
+      projects.append(project.Project(
+          manifest=manifest, name=name, remote=project.RemoteSpec('origin'),
+          gitdir=gitdir, objdir=gitdir, worktree=worktree, relpath=name,
+          revisionExpr=branch, revisionId=None))
+
+    self.cmd = sync.Sync()
+    self.cmd.manifest = manifest
+    self.cmd.jobs = 2
+    self.cmd.GetProjects = lambda args, **kwargs: projects
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Plan(self, **kwargs):
+    opt = _PlanOptions()
+    for name, value in kwargs.items():
+      setattr(opt, name, value)
+    saved = sys.stdout
+    sys.stdout = StringIO()
+    try:
+      self.cmd._Plan(opt, [])
+      return sys.stdout.getvalue()
+    finally:
+      sys.stdout = saved
+
+  def test_json(self):
+    """The JSON plan has an entry per project and the estimated time."""
+    plan = json.loads(self._Plan(json=True))
+    self.assertEqual(['estimated_fetch_time', 'jobs', 'projects'],
+                     sorted(plan))
+    self.assertEqual(2, plan['jobs'])
+    self.assertEqual(8.0, plan['estimated_fetch_time'])
+    work, new = plan['projects']
+    self.assertEqual(['estimate', 'local', 'name', 'network', 'path',
+                      'start', 'worker'], sorted(work))
+    self.assertEqual(('work', 'work', 'fetch', 'untouched', 8.0, 0.0),
+                     (work['path'], work['name'], work['network'],
+                      work['local'], work['estimate'], work['start']))
+    # New projects are assumed to take as long as a typical project.
+    self.assertEqual(('new', 'clone', 'checkout', 8.0, 0.0),
+                     (new['path'], new['network'], new['local'],
+                      new['estimate'], new['start']))
+    self.assertEqual([0, 1], sorted([work['worker'], new['worker']]))
+
+  def test_json_local_only(self):
+    """With --local-only nothing is fetched."""
+    plan = json.loads(self._Plan(json=True, local_only=True))
+    self.assertEqual(0, plan['estimated_fetch_time'])
+    work, new = plan['projects']
+    self.assertEqual((None, 'untouched', 0, None),
+                     (work['network'], work['local'], work['estimate'],
+                      work['worker']))
+    self.assertEqual('checkout', new['local'])
+
+  def test_text(self):
+    """The text plan is a table with a row per project."""
+    lines = self._Plan().splitlines()
+    self.assertEqual(
+        'Sync plan for 2 projects with -j2, estimated fetch time 8.0s:',
+        lines[0])
+    self.assertEqual(['PROJECT', 'NETWORK', 'WORK', 'TREE', 'ESTIMATE',
+                      'WORKER', 'START'], lines[1].split())
+    self.assertEqual(['work', 'fetch', 'untouched', '8.0s'],
+                     lines[2].split()[:4])
+    self.assertEqual(['new', 'clone', 'checkout', '8.0s'],
+                     lines[3].split()[:4])
+    self.assertEqual(4, len(lines))
+
+  def test_text_network_only(self):
+    """With --network-only work trees are left out of the plan."""
+    lines = self._Plan(network_only=True).splitlines()
+    self.assertEqual(['work', 'fetch', '-', '8.0s'], lines[2].split()[:4])
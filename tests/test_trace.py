@@ -0,0 +1,75 @@
+# -*- coding:utf-8 -*-
+#
+# Copyright (C) 2019 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for the trace.py module."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import trace
+
+
+def _Record(verb, project, start, duration):
+  return trace.CommandRecord(verb, project, start, start + duration, 0, 10, 1)
+
+
+class TraceSummaryUnitTest(unittest.TestCase):
+  """Tests the accounting of git processes."""
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp(prefix='repo_tests')
+    self.records = [_Record('fetch', 'a', 100.0, d) for d in range(1, 21)]
+    self.records.append(_Record('config', 'b', 101.0, 0.5))
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def test_percentile(self):
+    """Percentiles use the nearest rank."""
+    values = list(range(1, 21))
+    self.assertEqual(10, trace._Percentile(values, 50))
+    self.assertEqual(19, trace._Percentile(values, 95))
+    self.assertEqual(7, trace._Percentile([7], 95))
+
+  def test_summary(self):
+    """Verbs and projects are listed costliest first."""
+    lines = trace.FormatTraceSummary(self.records).splitlines()
+    self.assertEqual('21 git processes, 210.500s in total, 210 bytes of output',
+                     lines[0])
+    verbs = lines[lines.index('') + 2:]
+    self.assertEqual(['fetch', '20', '210.000s', '10.000s', '19.000s'],
+                     verbs[0].split())
+    self.assertEqual('config', verbs[1].split()[0])
+
+  def test_summary_limit(self):
+    """Long tables are cut."""
+    text = trace.FormatTraceSummary(self.records, limit=1)
+    self.assertEqual(2, text.count('... and 1 more'))
+
+  def test_trace_events(self):
+    """Trace events are relative to the first process, in microseconds."""
+    path = os.path.join(self.tempdir, 'trace.json')
+    trace.WriteTraceEvents(self.records, path)
+    with open(path) as fd:
+      events = json.load(fd)['traceEvents']
+    self.assertEqual(21, len(events))
+    self.assertEqual(0, events[0]['ts'])
+    self.assertEqual(1000000, events[0]['dur'])
+    self.assertEqual(1000000, events[-1]['ts'])
+    self.assertEqual('b', events[-1]['args']['project'])
@@ -15,8 +15,16 @@
 # limitations under the License.
 
 from __future__ import print_function
+import json
+import math
 import sys
 import os
+import time
+try:
+  import threading as _threading
+except ImportError:
+  import dummy_threading as _threading
+
 REPO_TRACE = 'REPO_TRACE'
 
 try:
@@ -34,3 +42,99 @@ def SetTrace():
 def Trace(fmt, *args):
   if IsTrace():
     print(fmt % args, file=sys.stderr)
+
+
+# Accounting of the git processes run, for --trace-summary and --trace-json.
+_SUMMARY = False
+_COMMANDS = []
+_COMMANDS_LOCK = _threading.Lock()
+
+
+class CommandRecord(object):
+  """One finished git process."""
+
+  def __init__(self, verb, project, start, end, rc, out_bytes, thread):
+    self.verb = verb
+    self.project = project
+    self.start = start
+    self.end = end
+    self.rc = rc
+    self.out_bytes = out_bytes
+    self.thread = thread
+
+  @property
+  def duration(self):
+    return self.end - self.start
+
+
+def IsTraceSummary():
+  return _SUMMARY
+
+def SetTraceSummary():
+  global _SUMMARY
+  _SUMMARY = True
+
+def RecordCommand(verb, project, start, rc, out_bytes=0):
+  """Account for a git process started at |start| that just finished."""
+  if not _SUMMARY:
+    return
+  r = CommandRecord(verb, project, start, time.time(), rc, out_bytes,
+                    _threading.current_thread().ident)
+  with _COMMANDS_LOCK:
+    _COMMANDS.append(r)
+
+def Commands():
+  """The git processes recorded so far."""
+  with _COMMANDS_LOCK:
+    return list(_COMMANDS)
+
+def _Percentile(values, pct):
+  """Nearest-rank percentile of the sorted |values|."""
+  rank = int(math.ceil(pct / 100.0 * len(values)))
+  return values[max(0, rank - 1)]
+
+def FormatTraceSummary(records, limit=20):
+  """Tabulate |records| per verb and per project, costliest first."""
+  lines = ['%d git processes, %.3fs in total, %d bytes of output' %
+           (len(records), sum(r.duration for r in records),
+            sum(r.out_bytes for r in records))]
+  for title, key in (('VERB', lambda r: r.verb),
+                     ('PROJECT', lambda r: r.project or '-')):
+    groups = {}
+    for r in records:
+      groups.setdefault(key(r), []).append(r.duration)
+    rows = sorted(groups.items(), key=lambda kv: (-sum(kv[1]), kv[0]))
+    lines.append('')
+    lines.append('%-40s %6s %9s %8s %8s' %
+                 (title, 'COUNT', 'TOTAL', 'P50', 'P95'))
+    for name, durations in rows[:limit]:
+      durations.sort()
+      lines.append('%-40s %6d %8.3fs %7.3fs %7.3fs' %
+                   (name, len(durations), sum(durations),
+                    _Percentile(durations, 50), _Percentile(durations, 95)))
+    if len(rows) > limit:
+      lines.append('... and %d more' % (len(rows) - limit))
+  return '\n'.join(lines)
+
+def WriteTraceEvents(records, path):
+  """Write |records| to |path| in the Chrome trace event format.
+
+  The file can be loaded in chrome://tracing or https://ui.perfetto.dev.
+  """
+  origin = min([r.start for r in records] or [0])
+  threads = {}
+  events = []
+  for r in records:
+    tid = threads.setdefault(r.thread, len(threads) + 1)
+    events.append({
+        'name': r.verb,
+        'cat': 'git',
+        'ph': 'X',
+        'ts': int((r.start - origin) * 1e6),
+        'dur': int(r.duration * 1e6),
+        'pid': 1,
+        'tid': tid,
+        'args': {'project': r.project, 'rc': r.rc, 'bytes': r.out_bytes},
+    })
+  with open(path, 'w') as fd:
+    json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fd)